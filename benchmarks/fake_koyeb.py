@@ -0,0 +1,442 @@
+"""Stand-in for the Koyeb API, used by the benchmarks.
+
+The behavior of the fake API is described by a scenario (see the files of the
+scenarios directory):
+
+    {
+        "latency": {
+            "default": {"median_ms": 40, "p99_ms": 150},
+            "GET /v1/deployments/{id}": {"median_ms": 30, "p99_ms": 100}
+        },
+        "failures": {
+            "GET /v1/deployments/{id}": {"rate": 0.05, "status": 503}
+        },
+        "stalls": {
+            "GET /v1/deployments/{id}": {"rate": 0.02, "seconds": 60}
+        },
+        "deployment": {
+            "phases": [["PENDING", 1], ["PROVISIONING", 10], ["STARTING", 3], ["HEALTHY", null]]
+        },
+        "build_logs": {
+            "lines": 5000, "line_bytes": 100, "lines_per_second": 2000, "error_lines": [],
+            "steps": [[0, "Cloning into /workspace"], [0.1, "===> DETECTING"], [0.3, "===> BUILDING"]]
+        },
+        "runtime_logs": {"lines": 20},
+        "app": {"median_ms": 20, "p99_ms": 80, "cold_start_ms": 1500}
+    }
+
+Latencies follow a log-normal distribution defined by its median and its 99th
+percentile. A stalled call waits "seconds" before being answered, like a
+request stuck on a bad connection. The status of a deployment only depends on the time elapsed since
+its creation, so the time at which it becomes healthy is known exactly, and
+the time taken by the action to notice it can be measured. The "steps" of the
+build logs are written once the given share of the lines has been written.
+
+Requests to paths outside of /v1/ and /_bench/ are answered like the deployed
+application would, with the latency of "app", plus "cold_start_ms" for the
+first request of every path.
+
+Besides the endpoints of the API used by the action, the fake API exposes:
+
+- GET /_bench/scenario: the scenario, for the fake koyeb CLI,
+- GET /_bench/stats: the number of calls per endpoint and the deployments,
+- GET /_bench/deployments/<id>: a deployment, without counting a call,
+- POST /_bench/cli: counts a run of the fake koyeb CLI,
+- POST /_bench/reset: forgets the counters and all the resources.
+
+A scenario file may also list the "flows" of run.py it applies to, set
+"expect_failure" when the deployments are expected to fail, and set "env",
+environment variables of the scripts, to enable their optional features.
+"""
+
+import collections
+import datetime
+import json
+import math
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SCENARIO = {
+    'latency': {'default': {'median_ms': 30, 'p99_ms': 120}},
+    'failures': {},
+    'stalls': {},
+    'deployment': {'phases': [['PENDING', 1], ['PROVISIONING', 10], ['STARTING', 3], ['HEALTHY', None]]},
+    'build_logs': {
+        'lines': 2000, 'line_bytes': 100, 'lines_per_second': 0, 'error_lines': [],
+        'steps': [
+            [0, 'Cloning into /workspace...'], [0.05, '===> DETECTING'], [0.1, '===> RESTORING'],
+            [0.15, '===> BUILDING'], [0.85, '===> EXPORTING'], [0.95, 'Saving registry.koyeb.com/bench/app...'],
+        ],
+    },
+    'runtime_logs': {'lines': 20},
+    'app': {'median_ms': 20, 'p99_ms': 80, 'cold_start_ms': 1500},
+}
+
+IDS = re.compile(r'/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+CATALOG_REGIONS = ['fra', 'was', 'par', 'sfo', 'sin', 'tyo']
+CATALOG_INSTANCES = ['free', 'nano', 'micro', 'small', 'medium', 'large', 'xlarge', '2xlarge']
+
+
+def load_scenario(path=None):
+    """Returns the scenario of the file at `path`, completed with the default
+    values."""
+    scenario = json.loads(json.dumps(DEFAULT_SCENARIO))
+    if path:
+        with open(path) as f:
+            content = json.load(f)
+        for key, value in content.items():
+            if isinstance(value, dict) and isinstance(scenario.get(key), dict):
+                scenario[key].update(value)
+            else:
+                scenario[key] = value
+    return scenario
+
+
+def rfc3339(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def endpoint(method, path):
+    return f'{method} {IDS.sub("/{id}", path)}'
+
+
+def sample_latency(spec):
+    """Returns a latency in seconds, drawn from the log-normal distribution
+    with the median and 99th percentile of `spec`."""
+    median = spec.get('median_ms', 0) / 1000
+    if median <= 0:
+        return 0
+    p99 = max(spec.get('p99_ms', median * 1000) / 1000, median)
+    sigma = math.log(p99 / median) / 2.326
+    return random.lognormvariate(math.log(median), sigma)
+
+
+class FakeKoyeb:
+    """Resources of the fake API, shared by the threads of the server."""
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.apps = {}
+            self.services = {}
+            self.deployments = {}
+            self.secrets = {}
+            self.calls = collections.Counter()
+            self.cli_runs = collections.Counter()
+            self.failures = collections.Counter()
+            self.stalls = collections.Counter()
+            self.app_paths = set()
+            self.held = None
+
+    def reset_counters(self):
+        """Forgets the counters, but keeps the resources."""
+        with self.lock:
+            self.calls.clear()
+            self.cli_runs.clear()
+            self.failures.clear()
+            self.stalls.clear()
+
+    def hold(self, status=None):
+        """Keeps the deployments in `status` once they reach it, until
+        called again without status."""
+        with self.lock:
+            self.held = status
+
+    def add_apps(self, names, *, age=0):
+        """Creates applications created `age` seconds ago, without counting
+        calls."""
+        with self.lock:
+            for name in names:
+                app_id = str(uuid.uuid4())
+                created_at = rfc3339(time.time() - age)
+                self.apps[app_id] = {'id': app_id, 'name': name, 'domains': [], 'created_at': created_at, 'updated_at': created_at}
+
+    def stats(self):
+        with self.lock:
+            return {
+                'calls': dict(self.calls),
+                'cli_runs': dict(self.cli_runs),
+                'failures': dict(self.failures),
+                'stalls': dict(self.stalls),
+                'deployments': [self.deployment(deployment_id) for deployment_id in self.deployments],
+            }
+
+    def phases(self, definition):
+        phases = self.scenario['deployment']['phases']
+        # Services whose name starts with "fail" never become healthy.
+        if definition.get('name', '').startswith('fail'):
+            phases = [phase for phase in phases if phase[0] not in ('STARTING', 'HEALTHY')] + [['ERROR', None]]
+        statuses = [status for status, _ in phases]
+        if self.held in statuses:
+            phases = phases[:statuses.index(self.held)] + [[self.held, None]]
+        return phases
+
+    def deployment(self, deployment_id):
+        """Returns the deployment, with its current status and the time at
+        which it reached its final status."""
+        deployment = dict(self.deployments[deployment_id])
+        if deployment.get('canceled_at'):
+            deployment['status'] = 'CANCELED'
+            deployment['final_at'] = deployment['canceled_at']
+            return deployment
+
+        elapsed = time.time() - deployment['created_at']
+        start = 0
+        for status, duration in self.phases(deployment['definition']):
+            if duration is None or elapsed < start + duration:
+                deployment['status'] = status
+                break
+            start += duration
+        deployment['final_at'] = deployment['created_at'] + start
+        return deployment
+
+    def new_deployment(self, service, definition):
+        deployment_id = str(uuid.uuid4())
+        self.deployments[deployment_id] = {
+            'id': deployment_id,
+            'service_id': service['id'],
+            'app_id': service['app_id'],
+            'definition': definition,
+            'created_at': time.time(),
+        }
+        service['latest_deployment_id'] = deployment_id
+        return deployment_id
+
+
+def already_exists():
+    return 400, {'status': 400, 'code': 'invalid_argument', 'message': 'Validation error',
+                 'fields': [{'field': 'name', 'description': 'already exists'}]}
+
+
+def handle(koyeb, method, path, query, body):
+    """Returns a tuple (HTTP status, response) for a request to the API."""
+    parts = path.strip('/').split('/')
+
+    if path == '/_bench/scenario':
+        return 200, koyeb.scenario
+    if path == '/_bench/stats':
+        return 200, koyeb.stats()
+    if parts[:2] == ['_bench', 'deployments'] and len(parts) == 3:
+        with koyeb.lock:
+            if parts[2] not in koyeb.deployments:
+                return 404, {'status': 404, 'message': 'Deployment not found'}
+            return 200, {'deployment': koyeb.deployment(parts[2])}
+    if path == '/_bench/reset':
+        koyeb.reset()
+        return 200, {}
+    if path == '/_bench/cli':
+        with koyeb.lock:
+            koyeb.cli_runs[body.get('command', '')] += 1
+        return 200, {}
+
+    if path == '/v1/catalog/regions':
+        return 200, {'regions': [{'id': region, 'status': 'AVAILABLE'} for region in CATALOG_REGIONS]}
+    if path == '/v1/catalog/instances':
+        return 200, {'instances': [{'id': instance, 'regions': CATALOG_REGIONS} for instance in CATALOG_INSTANCES]}
+
+    with koyeb.lock:
+        if parts[:2] == ['v1', 'apps'] and len(parts) == 2:
+            if method == 'POST':
+                if any(app['name'] == body['name'] for app in koyeb.apps.values()):
+                    return already_exists()
+                app_id = str(uuid.uuid4())
+                koyeb.apps[app_id] = {
+                    'id': app_id, 'name': body['name'],
+                    'domains': [{'name': f'{body["name"]}-org.koyeb.app'}],
+                    'created_at': rfc3339(time.time()), 'updated_at': rfc3339(time.time()),
+                }
+                return 200, {'app': koyeb.apps[app_id]}
+            apps = [app for app in koyeb.apps.values() if query.get('name', '') in app['name']]
+            offset, limit = int(query.get('offset', 0)), int(query.get('limit', 100))
+            return 200, {'apps': apps[offset:offset + limit], 'count': len(apps)}
+
+        if parts[:2] == ['v1', 'apps'] and len(parts) == 3:
+            app = koyeb.apps.get(parts[2])
+            if app is None:
+                return 404, {'status': 404, 'message': 'App not found'}
+            if method == 'DELETE':
+                del koyeb.apps[parts[2]]
+                for service_id in [id for id, service in koyeb.services.items() if service['app_id'] == parts[2]]:
+                    del koyeb.services[service_id]
+                return 200, {}
+            return 200, {'app': app}
+
+        if parts[:2] == ['v1', 'services'] and len(parts) == 2:
+            if method == 'POST':
+                definition = body['definition']
+                if body['app_id'] not in koyeb.apps:
+                    return 404, {'status': 404, 'message': 'App not found'}
+                if any(
+                    service['app_id'] == body['app_id'] and service['name'] == definition['name']
+                    for service in koyeb.services.values()
+                ):
+                    return already_exists()
+                service_id = str(uuid.uuid4())
+                service = {'id': service_id, 'app_id': body['app_id'], 'name': definition['name'],
+                           'updated_at': rfc3339(time.time())}
+                koyeb.services[service_id] = service
+                koyeb.new_deployment(service, definition)
+                return 200, {'service': service}
+            services = [
+                service for service in koyeb.services.values()
+                if service['app_id'] == query.get('app_id') and query.get('name', '') in service['name']
+            ]
+            offset, limit = int(query.get('offset', 0)), int(query.get('limit', 100))
+            return 200, {'services': services[offset:offset + limit], 'count': len(services)}
+
+        if parts[:2] == ['v1', 'services'] and len(parts) == 3:
+            service = koyeb.services.get(parts[2])
+            if service is None:
+                return 404, {'status': 404, 'message': 'Service not found'}
+            if method == 'PUT':
+                koyeb.new_deployment(service, body['definition'])
+                service['updated_at'] = rfc3339(time.time())
+            return 200, {'service': service}
+
+        if parts[:2] == ['v1', 'deployments'] and len(parts) == 2:
+            statuses = query['statuses'].split(',') if query.get('statuses') else None
+            deployments = [
+                koyeb.deployment(deployment_id) for deployment_id, deployment in koyeb.deployments.items()
+                if query.get('service_id') in (None, deployment['service_id'])
+                and query.get('app_id') in (None, deployment['app_id'])
+            ]
+            deployments = [
+                {**deployment, 'created_at': rfc3339(deployment['created_at'])}
+                for deployment in sorted(deployments, key=lambda deployment: deployment['created_at'], reverse=True)
+                if statuses is None or deployment['status'] in statuses
+            ]
+            offset, limit = int(query.get('offset', 0)), int(query.get('limit', 100))
+            return 200, {'deployments': deployments[offset:offset + limit], 'count': len(deployments)}
+
+        if parts[:2] == ['v1', 'deployments'] and len(parts) >= 3:
+            if parts[2] not in koyeb.deployments:
+                return 404, {'status': 404, 'message': 'Deployment not found'}
+            if len(parts) == 4 and parts[3] == 'cancel' and method == 'POST':
+                koyeb.deployments[parts[2]].setdefault('canceled_at', time.time())
+            deployment = koyeb.deployment(parts[2])
+            return 200, {'deployment': {**deployment, 'created_at': rfc3339(deployment['created_at'])}}
+
+        if parts[:2] == ['v1', 'secrets'] and len(parts) == 2:
+            if method == 'POST':
+                if any(secret['name'] == body['name'] for secret in koyeb.secrets.values()):
+                    return already_exists()
+                secret_id = str(uuid.uuid4())
+                koyeb.secrets[secret_id] = {
+                    'id': secret_id, 'name': body['name'], 'type': body.get('type', 'SIMPLE'),
+                    'updated_at': time.time(),
+                }
+                return 200, {'secret': koyeb.secrets[secret_id]}
+            secrets = [secret for secret in koyeb.secrets.values() if query.get('name', '') in secret['name']]
+            offset, limit = int(query.get('offset', 0)), int(query.get('limit', 100))
+            return 200, {'secrets': secrets[offset:offset + limit], 'count': len(secrets)}
+
+        if parts[:2] == ['v1', 'secrets'] and len(parts) == 3:
+            secret = koyeb.secrets.get(parts[2])
+            if secret is None:
+                return 404, {'status': 404, 'message': 'Secret not found'}
+            if method == 'PUT':
+                secret['updated_at'] = time.time()
+            return 200, {'secret': secret}
+
+    return 404, {'status': 404, 'message': f'Unknown endpoint {method} {path}'}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    koyeb = None
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        url = urllib.parse.urlsplit(self.path)
+        # Repeated parameters, such as statuses, are joined with commas.
+        query = {key: ','.join(values) for key, values in urllib.parse.parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+
+        if not url.path.startswith(('/v1/', '/_bench/')):
+            self.rfile.read(length)
+            return self._handle_app(url.path)
+
+        body = json.loads(self.rfile.read(length)) if length else {}
+        if not url.path.startswith('/_bench/'):
+            name = endpoint(self.command, url.path)
+            scenario = self.koyeb.scenario
+            with self.koyeb.lock:
+                self.koyeb.calls[name] += 1
+            latency = scenario['latency'].get(name, scenario['latency']['default'])
+            time.sleep(sample_latency(latency))
+
+            stall = scenario['stalls'].get(name)
+            if stall and random.random() < stall.get('rate', 0):
+                with self.koyeb.lock:
+                    self.koyeb.stalls[name] += 1
+                time.sleep(stall['seconds'])
+
+            failure = scenario['failures'].get(name)
+            if failure and random.random() < failure.get('rate', 0):
+                with self.koyeb.lock:
+                    self.koyeb.failures[name] += 1
+                headers = {'Retry-After': str(failure['retry_after'])} if 'retry_after' in failure else {}
+                return self._send(failure.get('status', 503), {'status': failure.get('status', 503), 'message': 'Injected failure'}, headers)
+
+        status, response = handle(self.koyeb, self.command, url.path, query, body)
+        self._send(status, response)
+
+    def _handle_app(self, path):
+        spec = self.koyeb.scenario['app']
+        with self.koyeb.lock:
+            cold = path not in self.koyeb.app_paths
+            self.koyeb.app_paths.add(path)
+        time.sleep(sample_latency(spec) + (spec.get('cold_start_ms', 0) / 1000 if cold else 0))
+        self._send(200, {'path': path})
+
+    def _send(self, status, response, headers=None):
+        data = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+def start_server(scenario, *, port=0):
+    """Starts the fake API in a background thread, and returns a tuple
+    (FakeKoyeb, URL of the server, server)."""
+    koyeb = FakeKoyeb(scenario)
+    handler = type('BoundHandler', (Handler,), {'koyeb': koyeb})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return koyeb, f'http://127.0.0.1:{server.server_address[1]}', server
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Runs the fake Koyeb API until interrupted.')
+    parser.add_argument('--scenario', help='Scenario file')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    _, url, server = start_server(load_scenario(args.scenario), port=args.port)
+    print(f'Fake Koyeb API listening on {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+"""Benchmarks of the scripts of the action, against the fake Koyeb API and
+the fake koyeb CLI of this directory.
+
+Each flow runs the scripts the way a workflow does, and reports:
+
+- wall: end-to-end wall time of the flow,
+- api/deploy: calls to the API per deployed service,
+- cli/deploy: runs of the koyeb CLI per deployed service,
+- status/deploy: calls checking the status of deployments per deployed
+  service,
+- detect: time between the deployment becoming healthy (or failing) and the
+  end of the script waiting for it,
+- logs/s: build log lines received by the job per second, and the number of
+  lines lost,
+- failed: share of the runs of the flow which failed.
+
+Results can be saved, and compared to saved results to fail on regressions:
+
+    benchmarks/run.py --save baseline.json
+    benchmarks/run.py --baseline baseline.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+SCRIPTS_DIR = os.path.join(ROOT_DIR, 'scripts')
+SCENARIOS_DIR = os.path.join(BENCHMARKS_DIR, 'scenarios')
+
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_koyeb import load_scenario, start_server  # noqa: E402
+
+# Same arguments as the "git" step of action.yaml with the default inputs.
+SERVICE_ARGS = [
+    '--service-type', 'web',
+    '--git-url', 'github.com/org/repo',
+    '--git-workdir', '',
+    '--git-branch', 'main',
+    '--git-builder', 'buildpack',
+    '--git-build-command', '',
+    '--git-run-command', '',
+    '--service-instance-type', 'nano',
+    '--service-regions', 'fra',
+    '--service-env', 'PORT=8000',
+    '--service-ports', '8000:http',
+    '--service-routes', '/:8000',
+    '--service-checks', '',
+    '--privileged', 'false',
+    '--skip-cache', 'false',
+]
+
+# Lower is better for every metric.
+METRICS = ('wall', 'api/deploy', 'cli/deploy', 'status/deploy', 'detect', 'lost_logs', 'failed')
+EXPRESSION = re.compile(r'\$\{\{\s*([^}]*?)\s*\}\}')
+
+
+class Run:
+    """Output of a script: lines with the time they were received."""
+
+    def __init__(self, argv, *, env, verbose=False):
+        self.argv = argv
+        self.lines = []
+        self.start = time.time()
+        proc = subprocess.Popen(argv, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        for line in iter(proc.stdout.readline, b''):
+            self.lines.append((time.time(), line.decode(errors='replace')))
+            if verbose:
+                sys.stdout.write(line.decode(errors='replace'))
+        self.returncode = proc.wait()
+        self.end = time.time()
+
+    def check(self):
+        if self.returncode != 0:
+            output = ''.join(line for _, line in self.lines[-30:])
+            raise RuntimeError(f'{" ".join(self.argv)} exited with {self.returncode}:\n{output}')
+        return self
+
+    def output(self):
+        return ''.join(line for _, line in self.lines)
+
+
+class Bench:
+    """Environment of the scripts, and the fake API they talk to."""
+
+    def __init__(self, scenario, *, client, verbose):
+        self.scenario = scenario
+        self.koyeb, self.url, self.server = start_server(scenario)
+        self.verbose = verbose
+        self.tmp = tempfile.mkdtemp(prefix='koyeb-bench-')
+        self.env = {
+            **os.environ,
+            'PATH': f'{os.path.join(BENCHMARKS_DIR, "bin")}{os.pathsep}{os.environ["PATH"]}',
+            'KOYEB_API_URL': self.url,
+            'KOYEB_TOKEN': 'bench-token',
+            'KOYEB_CLIENT': client,
+            'PYTHONUNBUFFERED': '1',
+        }
+        for name in ('GITHUB_OUTPUT', 'GITHUB_STEP_SUMMARY', 'GITHUB_ENV', 'KOYEB_STATE_CACHE', 'KOYEB_TRACE'):
+            self.env.pop(name, None)
+        self.env.update(scenario.get('env', {}))
+
+    def run(self, script, *args, env=None):
+        """Runs the script, which must succeed unless the scenario expects
+        the deployments to fail."""
+        argv = [sys.executable, os.path.join(SCRIPTS_DIR, script), *args]
+        run = Run(argv, env={**self.env, **(env or {})}, verbose=self.verbose)
+        if not self.scenario.get('expect_failure'):
+            run.check()
+        elif run.returncode == 0:
+            raise RuntimeError(f'{script} succeeded, but the scenario expects a failure')
+        return run
+
+    def stats(self):
+        return self.koyeb.stats()
+
+
+def log_metrics(bench, runs):
+    """Returns the throughput of the build logs received by the job, and the
+    number of lines lost."""
+    times = [t for run in runs for t, line in run.lines if ' build-log ' in line]
+    expected = bench.scenario['build_logs']['lines']
+    metrics = {'lost_logs': max(0, expected - len(times))}
+    if len(times) > 1 and times[-1] > times[0]:
+        metrics['logs/s'] = len(times) / (times[-1] - times[0])
+    return metrics
+
+
+# Calls of the fake API checking the status of deployments.
+STATUS_CALLS = ('GET /v1/deployments/{id}', 'GET /v1/deployments')
+
+
+def deployment_metrics(bench, start, end, *, deploys):
+    """Returns the metrics computed from the calls received by the fake API,
+    for a flow which deployed `deploys` services and ended at `end`."""
+    stats = bench.stats()
+    api_calls = sum(stats['calls'].values())
+    cli_runs = sum(stats['cli_runs'].values())
+    finals = [deployment['final_at'] for deployment in stats['deployments'] if deployment['status'] in ('HEALTHY', 'ERROR', 'CANCELED')]
+    metrics = {
+        'wall': end - start,
+        'api/deploy': api_calls / deploys,
+        'cli/deploy': cli_runs / deploys,
+        'status/deploy': sum(stats['calls'].get(name, 0) for name in STATUS_CALLS) / deploys,
+        'calls': stats['calls'],
+    }
+    if finals:
+        metrics['detect'] = end - max(finals)
+    return metrics
+
+
+def flow_deploy(bench):
+    """deploy.py on a new service."""
+    run = bench.run('deploy.py', '--app-name', 'bench', '--service-name', 'api', '--git-sha', 'a' * 40, *SERVICE_ARGS)
+    return {**deployment_metrics(bench, run.start, run.end, deploys=1), **log_metrics(bench, [run])}
+
+
+def flow_redeploy(bench):
+    """deploy.py on an existing service, with a new commit."""
+    bench.run('deploy.py', '--app-name', 'bench', '--service-name', 'api', '--git-sha', 'a' * 40, *SERVICE_ARGS)
+    bench.koyeb.reset_counters()
+    run = bench.run('deploy.py', '--app-name', 'bench', '--service-name', 'api', '--git-sha', 'b' * 40, *SERVICE_ARGS)
+    return {**deployment_metrics(bench, run.start, run.end, deploys=1), **log_metrics(bench, [run])}
+
+
+def flow_resume(bench):
+    """deploy.py timing out while the deployment is held in STARTING, then
+    run again with the journal of the first attempt once the deployment can
+    become healthy, like a re-run of the workflow."""
+    journal = os.path.join(bench.tmp, 'journal.json')
+    env = {'KOYEB_JOURNAL': journal, 'GITHUB_RUN_ID': '1'}
+    args = ['--app-name', 'bench', '--service-name', 'api', '--git-sha', 'a' * 40, *SERVICE_ARGS]
+    bench.koyeb.hold('STARTING')
+    try:
+        first = Run([sys.executable, os.path.join(SCRIPTS_DIR, 'deploy.py'), *args, '--healthy-timeout', '1'],
+                    env={**bench.env, **env}, verbose=bench.verbose)
+    finally:
+        bench.koyeb.hold()
+    if first.returncode == 0:
+        raise RuntimeError('The first attempt should time out')
+    with open(journal) as f:
+        recorded = [entry['deployment_id'] for entry in json.load(f)['entries'].values()]
+
+    bench.koyeb.reset_counters()
+    run = bench.run('deploy.py', *args, env=env)
+
+    deployments = bench.stats()['deployments']
+    if [deployment['id'] for deployment in deployments] != recorded:
+        raise RuntimeError(f'{len(deployments)} deployments instead of the one of the first attempt')
+    metrics = deployment_metrics(bench, run.start, run.end, deploys=1)
+    # The deployment became healthy as soon as it was released.
+    metrics.pop('detect', None)
+    return metrics
+
+
+def flow_supersede(bench):
+    """service-upsert.py three times in a row with --cancel-superseded, like
+    three pushes, then deployment-wait-healthy.py on the last deployment."""
+    app = ['--app-name', 'bench', '--service-name', 'api', '--cancel-superseded', 'true']
+    runs = [bench.run('app-create.py', '--app-name', 'bench')]
+    for sha in ('a', 'b', 'c'):
+        runs.append(bench.run('service-upsert.py', *app, '--git-sha', sha * 40, *SERVICE_ARGS))
+    runs.append(bench.run('deployment-get-last-id.py', '--app-name', 'bench', '--service-name', 'api'))
+    deployment_id = re.search(r'deployment-id=(\S+)', runs[-1].output()).group(1)
+    runs.append(bench.run('deployment-wait-healthy.py', '--deployment-id', deployment_id))
+
+    statuses = [deployment['status'] for deployment in bench.stats()['deployments']]
+    if statuses.count('CANCELED') != 2:
+        raise RuntimeError(f'Deployments in status {", ".join(statuses)} instead of two cancelled')
+    return deployment_metrics(bench, runs[0].start, runs[-1].end, deploys=3)
+
+
+def flow_scripts(bench):
+    """The scripts of the stages of a deployment, one process each."""
+    app = ['--app-name', 'bench']
+    runs = [bench.run('app-create.py', *app)]
+    runs.append(bench.run('service-upsert.py', *app, '--service-name', 'api', '--git-sha', 'a' * 40, *SERVICE_ARGS))
+    runs.append(bench.run('deployment-get-last-id.py', *app, '--service-name', 'api'))
+    deployment_id = re.search(r'deployment-id=(\S+)', runs[-1].output()).group(1)
+    runs.append(bench.run('deployment-show-build-logs.py', '--deployment-id', deployment_id))
+    runs.append(bench.run('deployment-wait-healthy.py', '--deployment-id', deployment_id))
+    wait_end = runs[-1].end
+    runs.append(bench.run('app-show-domain.py', *app))
+    metrics = deployment_metrics(bench, runs[0].start, runs[-1].end, deploys=1)
+    metrics['detect'] = wait_end - max(d['final_at'] for d in bench.stats()['deployments'])
+    return {**metrics, **log_metrics(bench, runs)}
+
+
+def flow_manifest(bench):
+    """deploy-manifest.py with three services, one depending on another."""
+    manifest = {
+        'defaults': {
+            'git-url': 'github.com/org/repo', 'git-workdir': '', 'git-sha': 'a' * 40,
+            'git-build-command': '', 'git-run-command': '',
+            'service-ports': '8000:http', 'service-routes': '/:8000',
+        },
+        'services': [
+            {'service-name': 'api'},
+            {'service-name': 'worker', 'service-type': 'worker'},
+            {'service-name': 'web', 'depends-on': ['api']},
+        ],
+    }
+    path = os.path.join(bench.tmp, 'manifest.json')
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
+    run = bench.run('deploy-manifest.py', '--manifest', path, '--app-name', 'bench')
+    return deployment_metrics(bench, run.start, run.end, deploys=len(manifest['services']))
+
+
+def flow_fleet(bench):
+    """deploy-manifest.py with twelve services of the same application,
+    deployed and followed at the same time."""
+    manifest = {
+        'defaults': {
+            'git-url': 'github.com/org/repo', 'git-branch': 'main', 'git-workdir': '', 'git-sha': 'a' * 40,
+            'git-build-command': '', 'git-run-command': '',
+            'service-ports': '8000:http', 'service-routes': '/:8000',
+        },
+        'services': [{'service-name': f'service-{number}'} for number in range(12)],
+    }
+    path = os.path.join(bench.tmp, 'fleet.json')
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
+    run = bench.run('deploy-manifest.py', '--manifest', path, '--app-name', 'bench', '--concurrency', '12')
+    return deployment_metrics(bench, run.start, run.end, deploys=len(manifest['services']))
+
+
+def flow_secrets(bench):
+    """secret-upsert.py synchronizing 150 secrets, 50 of them already
+    existing."""
+    path = os.path.join(bench.tmp, 'secrets.env')
+    with open(path, 'w') as f:
+        f.writelines(f'SECRET_{number}=value-{number}\n' for number in range(50))
+    bench.run('secret-upsert.py', '--secrets-file', path)
+    with open(path, 'w') as f:
+        f.writelines(f'SECRET_{number}=new-value-{number}\n' for number in range(150))
+    bench.koyeb.reset_counters()
+    run = bench.run('secret-upsert.py', '--secrets-file', path)
+    metrics = deployment_metrics(bench, run.start, run.end, deploys=1)
+    metrics.pop('detect', None)
+    return metrics
+
+
+def flow_cleanup(bench):
+    """app-cleanup.py on 300 applications: 200 stale preview applications,
+    50 applications of live branches and 50 applications not matching the
+    pattern."""
+    names = [f'repo-stale-{number}' for number in range(200)] + [f'repo-live-{number}' for number in range(50)]
+    bench.koyeb.add_apps(names, age=10 * 24 * 60 * 60)
+    bench.koyeb.add_apps([f'other-{number}' for number in range(50)], age=10 * 24 * 60 * 60)
+    run = bench.run(
+        'app-cleanup.py', '--app-pattern', 'repo-*', '--older-than', '1d', '--rate', '50',
+        '--repository', 'org/repo', '--live-branches', ','.join(f'live-{number}' for number in range(50)),
+    )
+    remaining = len(bench.koyeb.apps)
+    if remaining != 100:
+        raise RuntimeError(f'{remaining} applications left after the cleanup instead of 100')
+    metrics = deployment_metrics(bench, run.start, run.end, deploys=200)
+    metrics.pop('detect', None)
+    return metrics
+
+
+def flow_verify(bench):
+    """endpoints-verify.py on two routes of the fake application, after
+    replaying a warm-up list of three requests."""
+    path = os.path.join(bench.tmp, 'warmup.txt')
+    with open(path, 'w') as f:
+        f.write('/\n/api/users\nPOST /api/cache\n')
+    run = bench.run(
+        'endpoints-verify.py', '--url', bench.url, '--service-routes', '/:8000,/api/users:8000',
+        '--warmup-file', path, '--verify-requests', '20',
+    )
+    return {'wall': run.end - run.start}
+
+
+def render(text, context):
+    """Replaces the ${{ a.b }} expressions of a workflow with their value in
+    `context`. Only property accesses are supported."""
+    def replace(match):
+        value = context
+        for part in match.group(1).split('.'):
+            value = value.get(part, '') if isinstance(value, dict) else ''
+        return str(value)
+    return EXPRESSION.sub(replace, text)
+
+
+def flow_action(bench):
+    """The steps of action.yaml, run like the GitHub runner would."""
+    try:
+        import yaml
+    except ImportError:
+        raise RuntimeError('PyYAML is required to run the steps of action.yaml')
+    with open(os.path.join(ROOT_DIR, 'action.yaml')) as f:
+        action = yaml.safe_load(f)
+
+    inputs = {name: str(spec.get('default', '')) for name, spec in action['inputs'].items()}
+    github = {'repository': 'org/repo', 'ref_name': 'main', 'action_path': ROOT_DIR}
+    context = {'github': github, 'env': {}}
+    context['inputs'] = {name: render(value, context) for name, value in inputs.items()}
+    context['inputs'].update({'app-name': 'bench', 'git-sha': 'a' * 40, 'service-ports': '8000:http', 'service-routes': '/:8000'})
+
+    github_env = os.path.join(bench.tmp, 'github_env')
+    open(github_env, 'w').close()
+    runs = []
+    for step in action['runs']['steps']:
+        script = os.path.join(bench.tmp, 'step.sh')
+        with open(script, 'w') as f:
+            f.write(render(step['run'], context))
+        env = {
+            **bench.env, **context['env'],
+            **{name: render(str(value), context) for name, value in (step.get('env') or {}).items()},
+            'GITHUB_ENV': github_env,
+            'GITHUB_OUTPUT': os.path.join(bench.tmp, 'github_output'),
+            'GITHUB_STEP_SUMMARY': os.path.join(bench.tmp, 'github_step_summary'),
+        }
+        runs.append(Run(['sh', '-e', script], env=env, verbose=bench.verbose).check())
+        with open(github_env) as f:
+            context['env'].update(line.rstrip('\n').split('=', 1) for line in f if '=' in line)
+
+    return {**deployment_metrics(bench, runs[0].start, runs[-1].end, deploys=1), **log_metrics(bench, runs)}
+
+
+FLOWS = {
+    'deploy': flow_deploy,
+    'redeploy': flow_redeploy,
+    'scripts': flow_scripts,
+    'supersede': flow_supersede,
+    'resume': flow_resume,
+    'action': flow_action,
+    'manifest': flow_manifest,
+    'fleet': flow_fleet,
+    'secrets': flow_secrets,
+    'cleanup': flow_cleanup,
+    'verify': flow_verify,
+}
+
+
+def summarize(samples):
+    """Returns the median of every numeric metric of the samples."""
+    keys = {key for sample in samples for key, value in sample.items() if isinstance(value, (int, float))}
+    return {key: statistics.median(sample[key] for sample in samples if key in sample) for key in sorted(keys)}
+
+
+def format_table(results):
+    columns = ('wall', 'api/deploy', 'cli/deploy', 'status/deploy', 'detect', 'logs/s', 'lost_logs', 'failed')
+    lines = [f'{"scenario/flow":<32}' + ''.join(f'{column:>14}' for column in columns)]
+    for name, metrics in results.items():
+        cells = ''.join(
+            f'{metrics[column]:>14.2f}' if column in metrics else f'{"-":>14}'
+            for column in columns
+        )
+        lines.append(f'{name:<32}{cells}')
+    return '\n'.join(lines)
+
+
+def compare(results, baseline, tolerance):
+    """Returns the list of regressions of `results` compared to `baseline`."""
+    regressions = []
+    for name, metrics in results.items():
+        for metric in METRICS:
+            if metric not in metrics or metric not in baseline.get(name, {}):
+                continue
+            before, after = baseline[name][metric], metrics[metric]
+            # Small absolute differences are noise.
+            if after > before * (1 + tolerance) and after - before > 0.05:
+                regressions.append(f'{name} {metric}: {before:.2f} -> {after:.2f}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the scripts of the action against a fake Koyeb.')
+    parser.add_argument('--scenario', action='append',
+                        help=f'Scenario name or file, can be repeated. Default: all the scenarios of {SCENARIOS_DIR}')
+    parser.add_argument('--flow', action='append', choices=sorted(FLOWS),
+                        help='Flow to run, can be repeated. Default: all the flows')
+    parser.add_argument('--client', choices=('api', 'cli'), default='api',
+                        help='Backend used by the scripts (KOYEB_CLIENT)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Number of runs of every flow. The median of the runs is reported')
+    parser.add_argument('--save', help='Save the results to this JSON file')
+    parser.add_argument('--baseline', help='Fail if the results regressed compared to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative regression tolerated by --baseline')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the scripts')
+    args = parser.parse_args()
+
+    scenarios = args.scenario or sorted(name[:-len('.json')] for name in os.listdir(SCENARIOS_DIR) if name.endswith('.json'))
+    results = {}
+    for scenario_name in scenarios:
+        path = scenario_name if os.path.exists(scenario_name) else os.path.join(SCENARIOS_DIR, f'{scenario_name}.json')
+        scenario = load_scenario(path)
+        bench = Bench(scenario, client=args.client, verbose=args.verbose)
+        try:
+            for flow in args.flow or FLOWS:
+                if flow not in scenario.get('flows', FLOWS):
+                    continue
+                samples = []
+                for _ in range(args.repeat):
+                    bench.koyeb.reset()
+                    try:
+                        samples.append({**FLOWS[flow](bench), 'failed': 0})
+                    except RuntimeError as exc:
+                        print(f'{scenario_name}/{flow} failed: {exc}', file=sys.stderr)
+                        samples.append({'failed': 1})
+                name = f'{os.path.basename(path)[:-len(".json")]}/{flow}'
+                results[name] = summarize(samples)
+                print(f'{name}: {json.dumps({k: round(v, 3) for k, v in results[name].items()})}', file=sys.stderr)
+        finally:
+            bench.server.shutdown()
+
+    print(format_table(results))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressions:\n' + '\n'.join(f'  {regression}' for regression in regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
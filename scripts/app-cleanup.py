@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import argparse
+
+from koyeb_cleanup import app_slug, cleanup_apps, parse_duration
+from koyeb_service import argparse_to_bool
+
+
+def argparse_to_duration(value):
+    try:
+        return parse_duration(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--app-pattern', required=True,
+                        help='Only consider the applications whose name matches this pattern, for example "myrepo-*"')
+    parser.add_argument('--live-branches', required=False,
+                        help='Comma or whitespace separated list of the existing branches, whose applications are kept. Requires --repository')
+    parser.add_argument('--repository', required=False,
+                        help='Repository (<owner>/<repo>) the applications of --live-branches were deployed from')
+    parser.add_argument('--older-than', required=False, type=argparse_to_duration,
+                        help='Only delete the applications created before this duration, such as 90 (seconds), 30m, 12h or 7d')
+    parser.add_argument('--idle-for', required=False, type=argparse_to_duration,
+                        help='Only delete the applications not deployed during this duration, such as 12h or 7d')
+    parser.add_argument('--concurrency', required=False, type=int, default=8,
+                        help='Maximum number of applications deleted at the same time')
+    parser.add_argument('--rate', required=False, type=float, default=5,
+                        help='Maximum number of deletions started per second, 0 for no limit')
+    parser.add_argument('--dry-run', type=argparse_to_bool, nargs='?', const=True, default=False,
+                        help='Only report the applications which would be deleted')
+    args = parser.parse_args()
+
+    if args.concurrency < 1:
+        parser.error('--concurrency should be at least 1')
+    if args.rate < 0:
+        parser.error('--rate should not be negative')
+
+    live_slugs = None
+    if args.live_branches is not None:
+        if not args.repository:
+            parser.error('--live-branches requires --repository')
+        branches = args.live_branches.replace(',', ' ').split()
+        live_slugs = {app_slug(args.repository, branch) for branch in branches}
+
+    cleanup_apps(
+        pattern=args.app_pattern,
+        live_slugs=live_slugs,
+        older_than=args.older_than,
+        idle_for=args.idle_for,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == '__main__':
+    main()
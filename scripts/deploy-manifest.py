@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+
+import argparse
+
+from koyeb_manifest import deploy_manifest
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', required=True,
+                        help='YAML or JSON file listing the services to deploy')
+    parser.add_argument('--concurrency', required=False, type=int, default=8,
+                        help='Maximum number of services deployed at the same time')
+    parser.add_argument('--app-name', required=False,
+                        help='Koyeb app of the services which do not set app-name in the manifest')
+    args = parser.parse_args()
+
+    if args.concurrency < 1:
+        parser.error('--concurrency should be at least 1')
+
+    deploy_manifest(args.manifest, concurrency=args.concurrency, default_app_name=args.app_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+import argparse
+
+from koyeb_deploy import deploy, koyeb_preflight
+from koyeb_preflight import PreflightError
+from koyeb_service import add_service_arguments, apply_service_config, argparse_to_bool, check_mutual_exclusive_options
+from koyeb_verify import add_verify_arguments, verify_options
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--app-name', required=True,
+                        help='Name of the Koyeb app to create')
+    parser.add_argument('--service-name', required=True,
+                        help='Name of the Koyeb service to create and deploy')
+    parser.add_argument('--build-timeout', required=False, type=int, default=60 * 15,  # 15 minutes
+                        help='If the deployment is still building after this timeout, the process will exit with an error')
+    parser.add_argument('--healthy-timeout', required=False, type=float, default=60 * 15,  # 15 minutes
+                        help='Raise an error if the deployment is not healthy after this timeout')
+    parser.add_argument('--wait-strategy', required=False, choices=('adaptive', 'fixed'), default='adaptive',
+                        help='How to poll the deployment status: with an adaptive backoff, or every 3 seconds. Runtime logs always trigger a check')
+    parser.add_argument('--build-log-archive', required=False,
+                        help='Also write the build logs to this gzip file, and an index of the build steps and errors next to it')
+    parser.add_argument('--verify-endpoints', type=argparse_to_bool, nargs='?', const=True, default=False,
+                        help='Once the deployment is healthy, probe the routes of the service on every domain and report their latency')
+    add_service_arguments(parser)
+    add_verify_arguments(parser)
+    args = parser.parse_args()
+
+    check_mutual_exclusive_options(parser, args)
+    apply_service_config(parser, args)
+    try:
+        koyeb_preflight([(args.app_name, args.service_name, vars(args))])
+    except PreflightError as exc:
+        parser.error(str(exc))
+
+    deploy(
+        app_name=args.app_name,
+        service_name=args.service_name,
+        spec=vars(args),
+        build_timeout=args.build_timeout,
+        healthy_timeout=args.healthy_timeout,
+        wait_strategy=args.wait_strategy,
+        log_archive=args.build_log_archive,
+        verify=verify_options(args) if args.verify_endpoints else None,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,8 @@
 #!/usr/bin/env python
 
 import argparse
-import json
-import subprocess
 
-
-def koyeb_get_last_deployment_id(*, app_name, service_name):
-    """Wrapper around koyeb CLI to get the last deployment ID of a service.
-    Assumes that the koyeb CLI is installed and configured."""
-    proc = subprocess.run([
-        'koyeb', 'service', 'get',
-        f'{app_name}/{service_name}',
-        '-o', 'json'
-    ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if proc.returncode != 0:
-        stderr = proc.stderr.decode()
-        raise RuntimeError(
-            f'Error while getting the last deployment of {app_name}/{service_name}\n{"v" * 100}\n{stderr.strip()}\n{"^" * 100}')
-
-    service = json.loads(proc.stdout.decode())
-    return service['latest_deployment_id']
+from koyeb_deploy import koyeb_get_last_deployment_id
 
 
 def main():
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+import argparse
+
+from koyeb_deploy import koyeb_app_get
+from koyeb_service import argparse_to_routes
+from koyeb_verify import add_verify_arguments, domain_urls, verify_endpoints, verify_options
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--app-name', required=False,
+                        help='Name of the Koyeb app whose domains are verified')
+    parser.add_argument('--url', required=False, action='append',
+                        help='Base URL to verify instead of the domains of the app, can be repeated')
+    parser.add_argument('--service-routes', required=True,
+                        help='Comma separated list of <path>:<port> of the routes to verify',
+                        type=argparse_to_routes)
+    add_verify_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.app_name and not args.url:
+        parser.error('--app-name or --url is required')
+
+    urls = args.url or domain_urls(koyeb_app_get(args.app_name, cached=True))
+    verify_endpoints(urls, args.service_routes, **verify_options(args))
+
+
+if __name__ == '__main__':
+    main()
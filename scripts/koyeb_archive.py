@@ -0,0 +1,215 @@
+"""Compressed archive of the build logs, with an index of the build steps and
+of the errors.
+
+The archive is a gzip file made of several gzip members, which `gunzip` and
+`zcat` read as a single stream. A new member starts at every buildpack phase
+("===> BUILDING") and Docker step ("Step 2/7 : RUN ..." or "#5 [2/7] RUN ..."),
+and every `max_member_bytes` of logs. The index, written next to the archive
+in `<archive>.index.json`, records where every member starts in the archive,
+so the lines around an error are read by decompressing one or two members
+instead of the whole log.
+"""
+
+import collections
+import gzip
+import json
+import os
+import re
+
+from koyeb_github import github_step_summary
+
+ERRORS = re.compile(rb'(?i:\berror\b|\bfatal\b|\bfailed\b|ERR!)')
+# Steps are matched with the newline before them, which is found much faster
+# than the beginning of a line.
+MARKERS = re.compile(
+    rb'\n(?:\x1b\[[0-9;]*m)*(?P<step>===> [A-Z]+[^\n]*|Step \d+/\d+ : [^\n]*|#\d+ \[[^\]\n]+\] [^\n]*)'
+    rb'|(?P<error>' + ERRORS.pattern + rb')'
+)
+ANSI_ESCAPES = re.compile(rb'\x1b\[[0-9;]*[A-Za-z]')
+
+
+def index_path(path):
+    return f'{path}.index.json'
+
+
+class LogArchive:
+    """Compresses the logs fed in arbitrary chunks to the archive at `path`,
+    and writes its index when closed. Only the last `max_errors` errors are
+    kept in the index. A line longer than `max_member_bytes`, such as a
+    progress bar redrawn with carriage returns, is written as it comes
+    instead of being kept until its end."""
+
+    def __init__(self, path, *, max_member_bytes=1024 * 1024, max_errors=1000):
+        self.path = path
+        self.max_member_bytes = max_member_bytes
+        self.file = open(path, 'wb')
+        self.lines = 0
+        self.bytes = 0
+        self.members = []
+        self.steps = []
+        self.errors = collections.deque(maxlen=max_errors)
+        self.error_count = 0
+        self._gzip = None
+        self._member_size = 0
+        self._partial = b''
+        self._line_start = True
+        self._start_member()
+
+    def _start_member(self, step=None):
+        # A step starting right at the beginning of a member doesn't need a
+        # new one.
+        if self._gzip is None or self._member_size:
+            if self._gzip is not None:
+                self._gzip.close()
+                self.members[-1]['archive_length'] = self.file.tell() - self.members[-1]['archive_offset']
+            self.members.append({'line': self.lines + 1, 'offset': self.bytes, 'archive_offset': self.file.tell()})
+            self._gzip = gzip.GzipFile(filename='', fileobj=self.file, mode='wb', mtime=0)
+            self._member_size = 0
+        if step is not None:
+            self.steps.append({'name': step, 'line': self.lines + 1, 'member': len(self.members) - 1})
+
+    def _write(self, data):
+        if data:
+            self._gzip.write(data)
+            self.lines += data.count(b'\n')
+            self.bytes += len(data)
+            self._member_size += len(data)
+
+    def feed(self, chunk):
+        data = self._partial + chunk
+        end = data.rfind(b'\n') + 1
+        self._partial = data[end:]
+        self._scan(data[:end])
+        if len(self._partial) >= self.max_member_bytes:
+            self._scan(self._partial)
+            self._partial = b''
+
+    def _error(self, line):
+        if not self.errors or self.errors[-1]['line'] != line:
+            self.errors.append({'line': line, 'member': len(self.members) - 1})
+            self.error_count += 1
+
+    def _scan(self, data):
+        """Writes `data`, made of complete lines or of the beginning of a long
+        line, to the archive and indexes its steps and errors."""
+        if not data:
+            return
+        # Positions in `data` are one less than in `lines`: a step matched at
+        # a newline of `lines` starts at the same position in `data`. The
+        # rest of a line already partly written can't start a step.
+        lines = (b'\n' if self._line_start else b' ') + data
+        self._line_start = data.endswith(b'\n')
+        pos = 0
+        for match in MARKERS.finditer(lines):
+            if match.lastgroup == 'step':
+                self._write(data[pos:match.start()])
+                pos = match.start()
+                step = match.group('step')
+                self._start_member(step=step.strip().decode(errors='replace'))
+                # The step consumed its line, which may report an error too.
+                if ERRORS.search(step):
+                    self._error(self.lines + 1)
+                continue
+
+            self._error(self.lines + lines.count(b'\n', pos + 1, match.start()) + 1)
+        self._write(data[pos:])
+
+        if self._member_size >= self.max_member_bytes:
+            self._start_member()
+
+    def close(self):
+        if self._partial:
+            self._scan(self._partial + b'\n')
+            self._partial = b''
+        self._gzip.close()
+        self.members[-1]['archive_length'] = self.file.tell() - self.members[-1]['archive_offset']
+        self.file.close()
+
+        index = {
+            'lines': self.lines,
+            'bytes': self.bytes,
+            'members': self.members,
+            'steps': self.steps,
+            'errors': list(self.errors),
+            'error_count': self.error_count,
+        }
+        with open(index_path(self.path), 'w') as f:
+            json.dump(index, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_member(f, member):
+    """Returns the lines of a member of the archive opened as `f`."""
+    f.seek(member['archive_offset'])
+    return gzip.decompress(f.read(member['archive_length'])).splitlines()
+
+
+def failure_context(path, *, context=20):
+    """Returns a tuple (step, line number, lines) with the `context` lines
+    around the last error of the archive at `path`, or the last lines of the
+    log if no error was found. The step is None if the line is not part of any
+    step. Returns None if the log is empty."""
+    with open(index_path(path)) as f:
+        index = json.load(f)
+    if not index['lines']:
+        return None
+
+    if index['errors']:
+        target = index['errors'][-1]
+        line, member = target['line'], target['member']
+        first, last = line - context, line + context
+    else:
+        line, member = index['lines'], len(index['members']) - 1
+        first, last = line - context, line
+
+    steps = [step for step in index['steps'] if step['line'] <= line]
+    step = steps[-1] if steps else None
+
+    # The lines before the error may start in the previous member, but never
+    # before the beginning of the step.
+    members = [member]
+    if member > 0 and first < index['members'][member]['line'] and (step is None or step['member'] < member):
+        members.insert(0, member - 1)
+    if step is not None:
+        first = max(first, step['line'])
+
+    lines = []
+    with open(path, 'rb') as f:
+        start = index['members'][members[0]]['line']
+        for number in members:
+            lines.extend(read_member(f, index['members'][number]))
+
+    first = max(first, start)
+    selected = lines[first - start:last - start + 1]
+    return (step['name'] if step else None), line, [ANSI_ESCAPES.sub(b'', l).decode(errors='replace') for l in selected]
+
+
+def failure_summary(path, *, deployment_id, context=20):
+    """Returns a markdown summary of the build failure recorded in the archive
+    at `path`, or None if the log is empty."""
+    failure = failure_context(path, context=context)
+    if failure is None:
+        return None
+    step, line, lines = failure
+
+    where = f'in step `{step}`' if step else 'before the first step'
+    text = '\n'.join(lines)
+    return (
+        f'### Build of deployment {deployment_id} failed\n\n'
+        f'Line {line} of the build logs, {where} (full logs in `{os.path.basename(path)}`):\n\n'
+        f'````text\n{text}\n````'
+    )
+
+
+def write_failure_summary(archive_path, deployment_id):
+    """Prints the lines around the last error of the build logs archived at
+    `archive_path`, and adds them to the summary of the job."""
+    summary = failure_summary(archive_path, deployment_id=deployment_id)
+    if summary:
+        print(f'Build failure:\n{"v" * 100}\n{summary}\n{"^" * 100}')
+        github_step_summary(summary)
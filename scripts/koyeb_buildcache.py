@@ -0,0 +1,199 @@
+"""Effectiveness of the build cache, measured from the build logs.
+
+The build logs are scanned as they are received for the markers of the
+builders:
+
+- buildpacks: "Restoring metadata/data for ..." while restoring the cache,
+  "Reusing layer ..." (hit) or "Adding layer ..." (miss) while exporting,
+- Docker BuildKit: "#5 [2/7] RUN ...", then "#5 CACHED" (hit) or
+  "#5 DONE 12.3s" (miss, with its duration),
+- the classic Docker builder: "Step 2/7 : RUN ...", then "---> Using cache"
+  (hit) or "---> Running in ..." (miss),
+- kaniko: "Using caching version of cmd: ..." (hit) or "No cached layer found
+  for cmd ..." (miss).
+
+The first Docker step which missed the cache is the first instruction of the
+Dockerfile invalidated by the change, and every step after it in the same
+stage is rebuilt: moving it later in the Dockerfile, or making its inputs
+change less often, brings the cache back.
+"""
+
+import re
+import time
+
+from koyeb_github import github_output, github_step_summary, markdown_table
+
+# Markers are matched with the newline before them: a literal newline is
+# found much faster than the beginning of a line, so the logs are scanned
+# several times faster than they are received.
+CACHE_MARKERS = re.compile(
+    rb'\n(?:\x1b\[[0-9;]*m)*(?:\[\w+\] |INFO\[\d+\] )?(?:'
+    rb'(?P<buildkit_step>#(?P<step_id>\d+) \[(?P<step_name>(?:[\w.-]+ )?\d+/\d+)\] (?P<step_command>[^\n]*))'
+    rb'|(?P<buildkit_cached>#(?P<cached_id>\d+) CACHED)'
+    rb'|(?P<buildkit_done>#(?P<done_id>\d+) DONE (?P<seconds>[\d.]+)s)'
+    rb'|(?P<classic_step>Step (?P<classic_name>\d+/\d+) : (?P<classic_command>[^\n]*))'
+    rb'|(?P<classic_hit> ---> Using cache)'
+    rb'|(?P<classic_miss> ---> Running in )'
+    rb'|(?P<kaniko_hit>Using caching version of cmd: (?P<kaniko_hit_command>[^\n]*))'
+    rb'|(?P<kaniko_miss>No cached layer found for cmd (?P<kaniko_miss_command>[^\n]*))'
+    rb'|(?P<layer_hit>Reusing (?:cache )?layer )'
+    rb'|(?P<layer_miss>Adding (?:cache )?layer )'
+    rb'|(?P<restored>Restoring (?:metadata|data) for )'
+    rb')'
+)
+
+
+def _text(value):
+    return value.decode(errors='replace').strip()
+
+
+class BuildCacheStats:
+    """Counts the hits and misses of the build cache in build logs fed in
+    arbitrary chunks. `miss_seconds` is the time spent building the Docker
+    steps which missed the cache: buildpacks don't report the time spent per
+    layer."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.restored = 0
+        self.miss_seconds = 0.0
+        self.builder = None
+        self._partial = b'\n'
+        # BuildKit steps by ID, and IDs of the cached ones.
+        self._steps = {}
+        self._cached = set()
+        # Docker steps which missed the cache, in the order they started.
+        self._missed = []
+        # Classic builder step running: [name, start time, missed].
+        self._classic = None
+        self._last_seen = None
+
+    def feed(self, chunk):
+        data = self._partial + chunk
+        end = data.rfind(b'\n')
+        self._partial = data[end:]
+        now = self._last_seen = time.monotonic()
+        for match in CACHE_MARKERS.finditer(data, 0, end):
+            getattr(self, f'_on_{match.lastgroup}')(match, now)
+
+    def _on_buildkit_step(self, match, now):
+        self.builder = 'docker'
+        self._steps.setdefault(match['step_id'], f'[{_text(match["step_name"])}] {_text(match["step_command"])}')
+
+    def _on_buildkit_cached(self, match, now):
+        if match['cached_id'] in self._steps and match['cached_id'] not in self._cached:
+            self._cached.add(match['cached_id'])
+            self.hits += 1
+
+    def _on_buildkit_done(self, match, now):
+        step = self._steps.get(match['done_id'])
+        if step is not None and match['done_id'] not in self._cached:
+            self.misses += 1
+            self.miss_seconds += float(match['seconds'])
+            self._missed.append((list(self._steps).index(match['done_id']), step))
+
+    def _end_classic_step(self, now):
+        if self._classic is not None and self._classic[2]:
+            self.miss_seconds += now - self._classic[1]
+        self._classic = None
+
+    def _on_classic_step(self, match, now):
+        self.builder = 'docker'
+        self._end_classic_step(now)
+        self._classic = [f'[{_text(match["classic_name"])}] {_text(match["classic_command"])}', now, False]
+
+    def _on_classic_hit(self, match, now):
+        if self._classic is not None:
+            self.hits += 1
+
+    def _on_classic_miss(self, match, now):
+        if self._classic is not None and not self._classic[2]:
+            self._classic[2] = True
+            self.misses += 1
+            self._missed.append((len(self._missed), self._classic[0]))
+
+    def _on_kaniko_hit(self, match, now):
+        self.builder = 'docker'
+        self.hits += 1
+
+    def _on_kaniko_miss(self, match, now):
+        self.builder = 'docker'
+        self.misses += 1
+        self._missed.append((len(self._missed), _text(match['kaniko_miss_command'])))
+
+    def _on_layer_hit(self, match, now):
+        self.builder = self.builder or 'buildpack'
+        self.hits += 1
+
+    def _on_layer_miss(self, match, now):
+        self.builder = self.builder or 'buildpack'
+        self.misses += 1
+
+    def _on_restored(self, match, now):
+        self.builder = self.builder or 'buildpack'
+        self.restored += 1
+
+    def close(self):
+        """Ends the step of the classic builder still running, at the time
+        the last logs were received."""
+        if self._last_seen is not None:
+            self._end_classic_step(self._last_seen)
+
+    @property
+    def detected(self):
+        return self.builder is not None
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    @property
+    def first_invalidated_step(self):
+        """Returns the first Docker step, in the order of the Dockerfile,
+        which missed the cache, or None."""
+        return min(self._missed)[1] if self._missed else None
+
+    def report(self):
+        if not self.detected:
+            return 'no cache marker found'
+        parts = [f'{self.hits} hits, {self.misses} misses']
+        if self.hit_rate is not None:
+            parts[0] += f' ({self.hit_rate:.0%} hit rate)'
+        if self.restored:
+            parts.append(f'{self.restored} layers restored')
+        if self.builder == 'docker':
+            parts.append(f'{self.miss_seconds:.1f}s in misses')
+        if self.first_invalidated_step:
+            parts.append(f'first invalidated step: {self.first_invalidated_step}')
+        return ', '.join(parts)
+
+    def summary(self):
+        """Returns the stats as a markdown table."""
+        rate = f'{self.hit_rate:.0%}' if self.hit_rate is not None else '-'
+        rows = [
+            ('Builder', self.builder),
+            ('Hits', self.hits),
+            ('Misses', self.misses),
+            ('Hit rate', rate),
+        ]
+        if self.builder == 'buildpack':
+            rows.append(('Layers restored', self.restored))
+        else:
+            rows.append(('Time in misses', f'{self.miss_seconds:.1f}s'))
+            rows.append(('First invalidated step', f'`{self.first_invalidated_step}`' if self.first_invalidated_step else '-'))
+        return markdown_table(['Build cache', ''], rows)
+
+
+def publish_build_cache(stats, *, deployment_id):
+    """Adds the stats to the summary of the job, and sets the cache-hits,
+    cache-misses, cache-miss-seconds and cache-first-invalidated-step outputs
+    of the step. Does nothing if no cache marker was found in the logs."""
+    if not stats.detected:
+        return
+    github_step_summary(f'### Build cache of deployment {deployment_id}\n\n{stats.summary()}')
+    github_output('cache-hits', stats.hits)
+    github_output('cache-misses', stats.misses)
+    github_output('cache-miss-seconds', f'{stats.miss_seconds:.1f}')
+    github_output('cache-first-invalidated-step', stats.first_invalidated_step or '')
@@ -0,0 +1,171 @@
+"""Garbage collection of stale applications, such as the preview applications
+deployed for every branch.
+
+The applications of the organization are listed once, and the candidates are
+selected by name pattern, by age, by time since their last deployment, and by
+excluding the applications of the branches which still exist. The candidates
+are then deleted concurrently, with a limit on the number of deletions started
+per second.
+"""
+
+import concurrent.futures
+import fnmatch
+import re
+import time
+
+from koyeb_client import get_client
+from koyeb_github import github_output, github_step_summary, markdown_table
+from koyeb_retry import TokenBucket
+from koyeb_trace import traced
+from koyeb_utils import parse_time
+
+DURATION = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$')
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+
+def parse_duration(value):
+    """Returns the number of seconds of a duration such as "90", "30m", "12h"
+    or "7d"."""
+    match = DURATION.match(value)
+    if not match:
+        raise ValueError(f'"{value}" is not a duration: use a number of seconds, or a number followed by s, m, h, d or w')
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def app_slug(repository, branch):
+    """Returns the name of the application deployed by default for `branch`,
+    computed like the "Slugify application name" step of action.yaml."""
+    name = f'{repository}/{branch}'.split('/', 1)[1]
+    return re.sub(r'[^a-z0-9]', '-', name)[-23:].removeprefix('-')
+
+
+class Candidate:
+    def __init__(self, app):
+        self.app = app
+        self.name = app['name']
+        self.created_at = parse_time(app.get('created_at'))
+        self.last_deployed_at = None
+        self.action = 'KEEP'
+        self.reason = ''
+
+
+def select_apps(apps, *, pattern, live_slugs=None, older_than=None):
+    """Returns a Candidate for every application whose name matches
+    `pattern`. Candidates are marked "DELETE" unless they belong to a live
+    branch, or were created less than `older_than` seconds ago."""
+    now = time.time()
+    candidates = []
+    for app in apps:
+        if not fnmatch.fnmatchcase(app['name'], pattern):
+            continue
+        candidate = Candidate(app)
+        candidates.append(candidate)
+
+        if live_slugs is not None and candidate.name in live_slugs:
+            candidate.reason = 'the branch still exists'
+        elif older_than is not None and candidate.created_at is not None and now - candidate.created_at < older_than:
+            candidate.reason = f'created {format_age(now - candidate.created_at)} ago'
+        else:
+            candidate.action = 'DELETE'
+    return candidates
+
+
+def last_deployed_at(app):
+    """Returns the time of the last update of the services of the
+    application, or the time of its last update if it has no service."""
+    services = get_client().service_list(app['name'], app=app)
+    times = [parse_time(service.get('updated_at')) for service in services]
+    times = [t for t in times if t is not None]
+    if times:
+        return max(times)
+    return parse_time(app.get('updated_at')) or parse_time(app.get('created_at'))
+
+
+def check_idle(candidates, *, idle_for, pool):
+    """Keeps the candidates deployed less than `idle_for` seconds ago. The
+    services of the candidates are fetched concurrently with `pool`."""
+    now = time.time()
+    to_check = [candidate for candidate in candidates if candidate.action == 'DELETE']
+    futures = {pool.submit(last_deployed_at, candidate.app): candidate for candidate in to_check}
+    for future in concurrent.futures.as_completed(futures):
+        candidate = futures[future]
+        try:
+            candidate.last_deployed_at = future.result()
+        except Exception as exc:
+            candidate.action = 'KEEP'
+            candidate.reason = f'unable to get the last deployment: {str(exc).splitlines()[0]}'
+            continue
+        if candidate.last_deployed_at is not None and now - candidate.last_deployed_at < idle_for:
+            candidate.action = 'KEEP'
+            candidate.reason = f'deployed {format_age(now - candidate.last_deployed_at)} ago'
+
+
+def delete_app(candidate, limiter):
+    limiter.acquire()
+    get_client().app_delete(candidate.name, app=candidate.app)
+
+
+def format_age(seconds):
+    for unit, size in (('d', 24 * 60 * 60), ('h', 60 * 60), ('m', 60)):
+        if seconds >= size:
+            return f'{int(seconds // size)}{unit}'
+    return f'{int(seconds)}s'
+
+
+def report_table(candidates):
+    """Returns the report of the cleanup as a markdown table."""
+    now = time.time()
+    rows = []
+    for candidate in sorted(candidates, key=lambda candidate: (candidate.action, candidate.name)):
+        age = format_age(now - candidate.created_at) if candidate.created_at else ''
+        deployed = f'{format_age(now - candidate.last_deployed_at)} ago' if candidate.last_deployed_at else ''
+        rows.append((candidate.name, age, deployed, candidate.action, candidate.reason))
+    return markdown_table(['Application', 'Age', 'Last deployment', 'Action', 'Details'], rows)
+
+
+@traced()
+def cleanup_apps(*, pattern, live_slugs=None, older_than=None, idle_for=None, concurrency=8, rate=5, dry_run=False):
+    """Deletes the applications matching `pattern` which are not in
+    `live_slugs`, older than `older_than` seconds and not deployed for
+    `idle_for` seconds. At most `concurrency` deletions run at the same time,
+    and at most `rate` start per second. Raises an error listing the
+    applications which could not be deleted."""
+    client = get_client()
+    apps = client.app_list()
+    candidates = select_apps(apps, pattern=pattern, live_slugs=live_slugs, older_than=older_than)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if idle_for is not None:
+            check_idle(candidates, idle_for=idle_for, pool=pool)
+
+        to_delete = [candidate for candidate in candidates if candidate.action == 'DELETE']
+        print(f'>> {len(apps)} applications, {len(candidates)} matching {pattern}, {len(to_delete)} to delete')
+
+        if dry_run:
+            for candidate in to_delete:
+                candidate.action = 'WOULD DELETE'
+        else:
+            limiter = TokenBucket(rate, burst=1)
+            futures = {pool.submit(delete_app, candidate, limiter): candidate for candidate in to_delete}
+            for future in concurrent.futures.as_completed(futures):
+                candidate = futures[future]
+                try:
+                    future.result()
+                except Exception as exc:
+                    candidate.action = 'FAILED'
+                    candidate.reason = str(exc).splitlines()[0] if str(exc) else type(exc).__name__
+                    print(f'Error while deleting the application {candidate.name}:\n{exc}')
+                    continue
+                candidate.action = 'DELETED'
+                print(f'Application {candidate.name} deleted.')
+
+    table = report_table(candidates)
+    print(table)
+    title = 'Koyeb applications to clean up (dry run)' if dry_run else 'Koyeb applications cleanup'
+    github_step_summary(f'### {title}\n\n{table}')
+    github_output('deleted-apps', ','.join(sorted(c.name for c in candidates if c.action == 'DELETED')))
+
+    failed = [candidate.name for candidate in candidates if candidate.action == 'FAILED']
+    if failed:
+        raise RuntimeError(f'Some applications could not be deleted: {", ".join(sorted(failed))}')
+    return candidates
@@ -0,0 +1,727 @@
+"""Client for Koyeb, shared by the scripts of this action.
+
+By default, requests are sent to the Koyeb REST API over a pool of keep-alive
+connections, which avoids spawning the koyeb CLI (and paying a new TLS
+handshake) for every call. The API token is read from the KOYEB_TOKEN
+environment variable, or from the configuration file of the koyeb CLI.
+
+Set KOYEB_CLIENT=cli to fall back to the koyeb CLI. The CLI is also used when
+no API token can be found, and to stream deployment logs.
+
+Both clients are rate limited and retry transient errors (see koyeb_retry).
+Every call has a deadline of KOYEB_CALL_TIMEOUT seconds (30 by default): a
+koyeb process still running after it is killed, and a request waiting for the
+API that long is aborted. The call then fails like on a network error.
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import queue
+import re
+import shlex
+import subprocess
+import threading
+import urllib.parse
+
+from koyeb_service import service_common_args, service_definition
+from koyeb_retry import get_retrier
+from koyeb_state import StateCache
+from koyeb_trace import api_operation, get_tracer
+
+DEFAULT_API_URL = 'https://app.koyeb.com'
+DEFAULT_CALL_TIMEOUT = 30
+CLI_CONFIG_FILE = os.path.join(os.path.expanduser('~'), '.koyeb.yaml')
+
+
+class KoyebError(RuntimeError):
+    """Raised when a call to Koyeb fails. `status` is the HTTP status code of
+    the response, or None if it is unknown. `retry_after` is the number of
+    seconds to wait before retrying, if Koyeb set it."""
+
+    def __init__(self, message, *, status=None, details='', retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+        self.retry_after = retry_after
+
+
+class KoyebNotFound(KoyebError):
+    pass
+
+
+class KoyebAlreadyExists(KoyebError):
+    pass
+
+
+class KoyebConnectionError(KoyebError):
+    """Raised when Koyeb could not be reached, or the connection was lost
+    before the response was received."""
+
+
+class KoyebTimeout(KoyebConnectionError):
+    """Raised when a call to Koyeb doesn't complete before its deadline."""
+
+
+def format_error(title, details):
+    return f'{title}\n{"v" * 100}\n{details.strip()}\n{"^" * 100}'
+
+
+def is_already_exists_error(details):
+    # koyeb-cli displays an error containing the strings "400 Bad request" and
+    # "Name already exists". The API returns a 400 with "already exists" in the
+    # description of the invalid field.
+    details = details.lower()
+    return '400 bad request' in details and 'already exists' in details
+
+
+# koyeb-cli displays an error containing the string "404 Not Found". Any
+# "404" or "not found" doesn't do: identifiers and hashes may contain 404, and
+# the error of a server may mention a route or a file not found.
+CLI_NOT_FOUND = re.compile(r'\b404 not found\b', re.IGNORECASE)
+
+
+def is_not_found_error(details):
+    return bool(CLI_NOT_FOUND.search(details))
+
+
+# Errors displayed by the koyeb CLI when the API is overloaded or unreachable.
+CLI_RATE_LIMITED = re.compile(r'\b429\b|too many requests', re.IGNORECASE)
+CLI_UNAVAILABLE = re.compile(r'\b503\b|service unavailable', re.IGNORECASE)
+CLI_SERVER_ERROR = re.compile(
+    r'\b50[024]\b|internal server error|bad gateway|gateway timeout'
+    r'|connection refused|connection reset|i/o timeout|handshake timeout|unexpected eof',
+    re.IGNORECASE,
+)
+
+
+def is_transient_error(exc, *, idempotent):
+    """Returns True if the call which raised `exc` may succeed if retried.
+    Calls throttled (429) or rejected because Koyeb is unavailable (503) are
+    always retried. Server errors and network errors are only retried for
+    idempotent calls, since the call may have been applied."""
+    if not isinstance(exc, KoyebError) or isinstance(exc, (KoyebNotFound, KoyebAlreadyExists)):
+        return False
+    if exc.status is not None:
+        return exc.status in (429, 503) or (idempotent and exc.status >= 500)
+    if isinstance(exc, KoyebConnectionError):
+        return idempotent
+    # The koyeb CLI doesn't expose the status of the response.
+    if CLI_RATE_LIMITED.search(exc.details) or CLI_UNAVAILABLE.search(exc.details):
+        return True
+    return idempotent and CLI_SERVER_ERROR.search(exc.details) is not None
+
+
+def parse_retry_after(value):
+    """Returns the number of seconds of a Retry-After header, or None if it is
+    missing or is a date."""
+    try:
+        return max(0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def read_cli_config(path=CLI_CONFIG_FILE):
+    """Returns the top-level `key: value` pairs of the koyeb CLI configuration
+    file, or an empty dict if it doesn't exist."""
+    config = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith((' ', '\t', '#')) or ':' not in line:
+                    continue
+                key, value = line.split(':', 1)
+                config[key.strip()] = value.strip().strip('\'"')
+    except FileNotFoundError:
+        pass
+    return config
+
+
+class ConnectionPool:
+    """Thread-safe pool of keep-alive HTTP connections to a single host."""
+
+    def __init__(self, url, *, maxsize=8, timeout=30):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize)
+
+    def _connect(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _get(self):
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _put(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def request(self, method, path, *, body=None, headers=None):
+        """Sends a request and returns a tuple (status, headers, body)."""
+        conn, reused = self._get()
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            resp = conn.getresponse()
+            data = resp.read()
+        except TimeoutError:
+            conn.close()
+            raise
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            # The server may have closed an idle keep-alive connection: retry
+            # once on a fresh connection.
+            if not reused:
+                raise
+            conn = self._connect()
+            conn.request(method, path, body=body, headers=headers or {})
+            resp = conn.getresponse()
+            data = resp.read()
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._put(conn)
+        return resp.status, resp.headers, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def format_command(args, *, max_repeats=5):
+    """Returns the command line `args` quoted for display. When an option is
+    repeated more than `max_repeats` times in a row, such as --env for a large
+    environment, the other occurrences are only counted."""
+    parts = []
+    i = 0
+    while i < len(args):
+        option = args[i]
+        if option.startswith('--') and '=' not in option:
+            end = i
+            while end + 1 < len(args) and args[end] == option:
+                end += 2
+            repeats = (end - i) // 2
+            if repeats > max_repeats:
+                for j in range(i, i + 2 * max_repeats, 2):
+                    parts += [option, shlex.quote(args[j + 1])]
+                parts.append(f'[... {repeats - max_repeats} more {option}]')
+                i = end
+                continue
+        parts.append(shlex.quote(option))
+        i += 1
+    return ' '.join(parts)
+
+
+class KoyebCLIClient:
+    """Wrapper around the koyeb CLI. Assumes that the koyeb CLI is installed
+    and configured."""
+
+    # `koyeb service update` merges the options into the current definition
+    # of the service itself.
+    service_update_needs_current = False
+
+    def __init__(self, *, timeout=DEFAULT_CALL_TIMEOUT, state=None):
+        self.timeout = timeout
+        self.state = state or StateCache()
+
+    def _run(self, args, error_title, *, echo=False, input=None):
+        if echo:
+            print(f'>> {format_command(args)}')
+
+        # Running "create" twice may create the resource twice, or fail
+        # because the first run created it. Updating a service twice
+        # triggers two deployments.
+        idempotent = args[2] != 'create' and args[1:3] != ['service', 'update']
+        return get_retrier().call(
+            lambda: self._run_once(args, error_title, input=input),
+            operation=' '.join(args[:3]),
+            is_transient=lambda exc: is_transient_error(exc, idempotent=idempotent),
+        )
+
+    def _run_once(self, args, error_title, *, input=None):
+        with get_tracer().span(' '.join(args[:3]), 'cli') as span:
+            try:
+                # The process is killed when the timeout expires.
+                proc = subprocess.run(args, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                      timeout=self.timeout)
+            except subprocess.TimeoutExpired as exc:
+                raise KoyebTimeout(format_error(error_title, f'{" ".join(args[:3])} killed after {exc.timeout}s')) from exc
+            span['exit_status'] = proc.returncode
+
+        if proc.returncode != 0:
+            stderr = proc.stderr.decode()
+            message = format_error(error_title, stderr)
+            if is_already_exists_error(stderr):
+                raise KoyebAlreadyExists(message, details=stderr)
+            if is_not_found_error(stderr):
+                raise KoyebNotFound(message, details=stderr)
+            raise KoyebError(message, details=stderr)
+
+        stdout = proc.stdout.decode()
+        return json.loads(stdout) if stdout.strip() else None
+
+    def app_create(self, app_name):
+        app = self._run(
+            ['koyeb', 'app', 'create', app_name, '-o', 'json', '-d'],
+            f'Error while creating the application {app_name}',
+        )
+        self.state.put('apps', app_name, app)
+        return app
+
+    def app_get(self, app_name, *, cached=False):
+        """Returns the application. If `cached` is True, the application may
+        come from the state cache."""
+        app = self.state.get('apps', app_name) if cached else None
+        if app:
+            return app
+        app = self._run(
+            ['koyeb', 'app', 'get', app_name, '-o', 'json'],
+            f'Error while getting the application {app_name}',
+        )
+        self.state.put('apps', app_name, app)
+        return app
+
+    def app_list(self):
+        response = self._run(['koyeb', 'app', 'list', '-o', 'json'], 'Error while listing the applications')
+        if isinstance(response, dict):
+            return response.get('apps') or []
+        return response or []
+
+    def app_delete(self, app_name, *, app=None):
+        self._run(['koyeb', 'app', 'delete', app_name], f'Error while deleting the application {app_name}')
+        self.state.invalidate('apps', app_name)
+
+    def service_get(self, app_name, service_name):
+        return self._run(
+            ['koyeb', 'service', 'get', f'{app_name}/{service_name}', '-o', 'json'],
+            f'Error while getting the service {app_name}/{service_name}',
+        )
+
+    def service_list(self, app_name, *, app=None):
+        response = self._run(
+            ['koyeb', 'service', 'list', '--app', app_name, '-o', 'json'],
+            f'Error while listing the services of {app_name}',
+        )
+        if isinstance(response, dict):
+            return response.get('services') or []
+        return response or []
+
+    def service_create(self, app_name, service_name, spec):
+        args = [
+            'koyeb', 'service', 'create',
+            service_name,
+            '--app', app_name,
+            '-o', 'json',
+        ] + service_common_args(**spec)
+        return self._run(args, f'Error while creating the service {service_name}', echo=True)
+
+    def service_update(self, app_name, service_name, spec, *, current=None):
+        args = [
+            'koyeb', 'service', 'update',
+            f'{app_name}/{service_name}',
+            '-o', 'json'
+        ] + service_common_args(**spec)
+        return self._run(args, f'Error while updating the service {service_name}', echo=True)
+
+    def deployment_get(self, deployment_id):
+        return self._run(
+            ['koyeb', 'deployments', 'get', deployment_id, '-o', 'json'],
+            f'Error while getting info of deployment {deployment_id}',
+        )
+
+    def deployment_list(self, service_id, *, statuses=None):
+        """Returns the deployments of the service, optionally only the ones
+        in one of `statuses`."""
+        response = self._run(
+            ['koyeb', 'deployments', 'list', '--service', service_id, '-o', 'json'],
+            f'Error while listing the deployments of service {service_id}',
+        )
+        if isinstance(response, dict):
+            response = response.get('deployments')
+        return [
+            deployment for deployment in response or []
+            if deployment.get('service_id') == service_id and (statuses is None or deployment['status'] in statuses)
+        ]
+
+    def app_deployments(self, app_id, limit=100):
+        """Returns the latest deployments of all the services of the
+        application, the most recent first."""
+        response = self._run(
+            ['koyeb', 'deployments', 'list', '--app', app_id, '-o', 'json'],
+            f'Error while listing the deployments of application {app_id}',
+        )
+        if isinstance(response, dict):
+            response = response.get('deployments')
+        deployments = [deployment for deployment in response or [] if deployment.get('app_id') == app_id]
+        return sorted(deployments, key=lambda deployment: deployment.get('created_at') or '', reverse=True)[:limit]
+
+    def deployment_cancel(self, deployment_id):
+        self._run(
+            ['koyeb', 'deployments', 'cancel', deployment_id, '-o', 'json'],
+            f'Error while cancelling deployment {deployment_id}',
+        )
+
+    def deployment_logs_args(self, deployment_id, log_type='build'):
+        """Returns the command streaming the logs of the deployment."""
+        return ['koyeb', 'deployment', 'logs', deployment_id, '-t', log_type]
+
+    def deployment_logs(self, deployment_id, log_type='build'):
+        """Returns a subprocess.Popen streaming the logs of the deployment on
+        its stdout."""
+        return subprocess.Popen(
+            self.deployment_logs_args(deployment_id, log_type),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0
+        )
+
+    def secret_list(self):
+        response = self._run(['koyeb', 'secret', 'list', '-o', 'json'], 'Error while listing the secrets')
+        if isinstance(response, dict):
+            return response.get('secrets') or []
+        return response or []
+
+    # The catalog is only available through the API.
+    def catalog_regions(self):
+        return None
+
+    def catalog_instances(self):
+        return None
+
+    # The value is written to the stdin of the CLI, so it doesn't show up in
+    # the list of processes.
+    def secret_create(self, secret_name, secret_value):
+        return self._run(
+            ['koyeb', 'secret', 'create', secret_name, '--value-from-stdin', '-o', 'json', '-d'],
+            f'Error while creating the secret {secret_name}',
+            input=secret_value.encode(),
+        )
+
+    def secret_update(self, secret_name, secret_value, *, secret=None):
+        return self._run(
+            ['koyeb', 'secret', 'update', secret_name, '--value-from-stdin', '-o', 'json'],
+            f'Error while updating the secret {secret_name}',
+            input=secret_value.encode(),
+        )
+
+
+class KoyebAPIClient:
+    """Client for the Koyeb REST API. Connections are kept alive and shared
+    between threads."""
+
+    # An update replaces the whole definition of the service, which is merged
+    # with the current one first (see service_update).
+    service_update_needs_current = True
+
+    def __init__(self, token, *, url=DEFAULT_API_URL, pool_size=8, timeout=DEFAULT_CALL_TIMEOUT, state=None):
+        self.url = url.rstrip('/')
+        self.pool = ConnectionPool(self.url, maxsize=pool_size, timeout=timeout)
+        self._headers = {
+            'Authorization': f'Bearer {token}',
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'User-Agent': 'koyeb-action-git-deploy',
+        }
+        # Logs are streamed through a websocket, for which the koyeb CLI is
+        # used.
+        self._cli = KoyebCLIClient(timeout=timeout)
+        self.state = state or StateCache()
+        # Applications by name, to avoid resolving the same name for every
+        # call made to its services, and names of the applications taken from
+        # the state cache.
+        self._apps = {}
+        self._apps_from_state = set()
+
+    def request(self, method, path, *, params=None, body=None, error_title=None, idempotent=None):
+        """Sends a request to the API, and returns the decoded response.
+        Transient errors are retried (see is_transient_error). GET, PUT and
+        DELETE requests are idempotent unless `idempotent` is False."""
+        if params:
+            path = f'{path}?{urllib.parse.urlencode(params, doseq=True)}'
+        payload = json.dumps(body).encode() if body is not None else None
+        if idempotent is None:
+            idempotent = method in ('GET', 'PUT', 'DELETE')
+
+        return get_retrier().call(
+            lambda: self._request_once(method, path, payload, error_title),
+            operation=api_operation(method, path),
+            is_transient=lambda exc: is_transient_error(exc, idempotent=idempotent),
+        )
+
+    def _request_once(self, method, path, payload, error_title):
+        with get_tracer().span(api_operation(method, path), 'api') as span:
+            try:
+                status, headers, data = self.pool.request(method, path, body=payload, headers=self._headers)
+            except TimeoutError as exc:
+                raise KoyebTimeout(format_error(
+                    error_title or f'Error during {method} {path}', f'no response after {self.pool.timeout}s',
+                )) from exc
+            except (http.client.HTTPException, OSError) as exc:
+                raise KoyebConnectionError(format_error(error_title or f'Error during {method} {path}', str(exc))) from exc
+            span['status'] = status
+
+        if status >= 400:
+            details = f'{status} {http.client.responses.get(status, "")}: {data.decode(errors="replace")}'
+            message = format_error(error_title or f'Error during {method} {path}', details)
+            if status == 404:
+                raise KoyebNotFound(message, status=status, details=details)
+            if is_already_exists_error(details):
+                raise KoyebAlreadyExists(message, status=status, details=details)
+            raise KoyebError(message, status=status, details=details,
+                             retry_after=parse_retry_after(headers.get('Retry-After')))
+
+        return json.loads(data) if data else None
+
+    def _find(self, collection, name, *, params=None, error_title):
+        """Returns the object of `collection` named `name`. The API filters on
+        names with a partial match, so the exact name is checked here."""
+        response = self.request(
+            'GET', f'/v1/{collection}',
+            params={'name': name, 'limit': 100, **(params or {})},
+            error_title=error_title,
+        )
+        for item in response.get(collection, []):
+            if item['name'] == name:
+                return item
+        raise KoyebNotFound(format_error(error_title, f'{name} not found'), status=404)
+
+    def _list(self, collection, *, params=None, error_title, page_size=100):
+        """Returns all the objects of `collection`, fetched page by page."""
+        items = []
+        while True:
+            response = self.request(
+                'GET', f'/v1/{collection}', params={**(params or {}), 'limit': page_size, 'offset': len(items)},
+                error_title=error_title,
+            )
+            page = response.get(collection) or []
+            items.extend(page)
+            if len(page) < page_size:
+                return items
+
+    def app_create(self, app_name):
+        response = self.request(
+            'POST', '/v1/apps', body={'name': app_name},
+            error_title=f'Error while creating the application {app_name}',
+        )
+        self._apps[app_name] = response['app']
+        self.state.put('apps', app_name, response['app'])
+        return response['app']
+
+    def app_get(self, app_name, *, cached=False):
+        """Returns the application. If `cached` is True and the application
+        has already been fetched by this client or is in the state cache, it is
+        not fetched again."""
+        if cached and app_name in self._apps:
+            return self._apps[app_name]
+        if cached and self.state.get('apps', app_name):
+            self._apps[app_name] = self.state.get('apps', app_name)
+            self._apps_from_state.add(app_name)
+            return self._apps[app_name]
+        app = self._find('apps', app_name, error_title=f'Error while getting the application {app_name}')
+        self._apps[app_name] = app
+        self._apps_from_state.discard(app_name)
+        self.state.put('apps', app_name, app)
+        return app
+
+    def app_list(self):
+        """Returns all the applications of the organization."""
+        return self._list('apps', error_title='Error while listing the applications')
+
+    def app_delete(self, app_name, *, app=None):
+        """Deletes the application and its services. `app` is the application
+        as returned by app_list(), if already fetched by the caller."""
+        if app is None:
+            app = self.app_get(app_name)
+        self.request(
+            'DELETE', f'/v1/apps/{app["id"]}',
+            error_title=f'Error while deleting the application {app_name}',
+        )
+        self._apps.pop(app_name, None)
+        self.state.invalidate('apps', app_name)
+
+    def _with_app(self, app_name, call):
+        """Returns call(application). If the application comes from the state
+        cache and the call fails, the cache may be stale: the application is
+        fetched again and the call retried."""
+        try:
+            return call(self.app_get(app_name, cached=True))
+        except KoyebError:
+            if app_name not in self._apps_from_state:
+                raise
+        self.state.invalidate('apps', app_name)
+        return call(self.app_get(app_name))
+
+    def service_get(self, app_name, service_name):
+        return self._with_app(app_name, lambda app: self._find(
+            'services', service_name, params={'app_id': app['id']},
+            error_title=f'Error while getting the service {app_name}/{service_name}',
+        ))
+
+    def service_list(self, app_name, *, app=None):
+        """Returns all the services of the application. `app` is the
+        application, if already fetched by the caller."""
+        if app is not None:
+            return self._list('services', params={'app_id': app['id']},
+                              error_title=f'Error while listing the services of {app_name}')
+        return self._with_app(app_name, lambda app: self._list(
+            'services', params={'app_id': app['id']},
+            error_title=f'Error while listing the services of {app_name}',
+        ))
+
+    def service_create(self, app_name, service_name, spec):
+        def create(app):
+            print(f'>> POST {self.url}/v1/services ({app_name}/{service_name})')
+            return self.request(
+                'POST', '/v1/services',
+                body={'app_id': app['id'], 'definition': service_definition(**dict(spec, service_name=service_name))},
+                error_title=f'Error while creating the service {service_name}',
+            )
+        return self._with_app(app_name, create)['service']
+
+    def service_update(self, app_name, service_name, spec, *, current=None):
+        """Updates the service. `current` is an optional tuple (service, latest
+        deployment) already fetched by the caller."""
+        if current is None:
+            service = self.service_get(app_name, service_name)
+            deployment = None
+            if service.get('latest_deployment_id'):
+                deployment = self.deployment_get(service['latest_deployment_id'])
+        else:
+            service, deployment = current
+        definition = service_definition(**dict(spec, service_name=service_name))
+
+        # Like the CLI, only override the fields managed by this action and
+        # keep the rest of the current definition (scaling, volumes, ...).
+        if deployment is not None:
+            current_definition = dict(deployment.get('definition') or {})
+            current_definition.pop('docker' if 'git' in definition else 'git', None)
+            definition = {**current_definition, **definition}
+
+        print(f'>> PUT {self.url}/v1/services/{service["id"]} ({app_name}/{service_name})')
+        # Every update applied triggers a deployment: an update which failed
+        # with a server error may have been applied, so it isn't retried.
+        response = self.request(
+            'PUT', f'/v1/services/{service["id"]}', body={'definition': definition},
+            error_title=f'Error while updating the service {service_name}', idempotent=False,
+        )
+        return response['service']
+
+    def deployment_get(self, deployment_id):
+        response = self.request(
+            'GET', f'/v1/deployments/{deployment_id}',
+            error_title=f'Error while getting info of deployment {deployment_id}',
+        )
+        return response['deployment']
+
+    def deployment_list(self, service_id, *, statuses=None):
+        """Returns the deployments of the service, optionally only the ones
+        in one of `statuses`."""
+        params = {'service_id': service_id}
+        if statuses is not None:
+            params['statuses'] = list(statuses)
+        return self._list('deployments', params=params,
+                          error_title=f'Error while listing the deployments of service {service_id}')
+
+    def app_deployments(self, app_id, limit=100):
+        """Returns the `limit` latest deployments of all the services of the
+        application, the most recent first, in a single call."""
+        response = self.request(
+            'GET', '/v1/deployments', params={'app_id': app_id, 'limit': limit},
+            error_title=f'Error while listing the deployments of application {app_id}',
+        )
+        return response.get('deployments') or []
+
+    def deployment_cancel(self, deployment_id):
+        self.request(
+            'POST', f'/v1/deployments/{deployment_id}/cancel',
+            error_title=f'Error while cancelling deployment {deployment_id}',
+        )
+
+    def deployment_logs_args(self, deployment_id, log_type='build'):
+        return self._cli.deployment_logs_args(deployment_id, log_type)
+
+    def deployment_logs(self, deployment_id, log_type='build'):
+        return self._cli.deployment_logs(deployment_id, log_type)
+
+    def secret_list(self):
+        """Returns all the secrets, without their values."""
+        return self._list('secrets', error_title='Error while listing the secrets')
+
+    def catalog_regions(self):
+        """Returns the regions where services can be deployed."""
+        response = self.request('GET', '/v1/catalog/regions', params={'limit': 100},
+                                error_title='Error while listing the regions')
+        return response.get('regions') or []
+
+    def catalog_instances(self):
+        """Returns the instance types, with the regions where they are
+        available."""
+        response = self.request('GET', '/v1/catalog/instances', params={'limit': 100},
+                                error_title='Error while listing the instance types')
+        return response.get('instances') or []
+
+    def secret_create(self, secret_name, secret_value):
+        response = self.request(
+            'POST', '/v1/secrets', body={'name': secret_name, 'type': 'SIMPLE', 'value': secret_value},
+            error_title=f'Error while creating the secret {secret_name}',
+        )
+        return response['secret']
+
+    def secret_update(self, secret_name, secret_value, *, secret=None):
+        """Updates the value of the secret. `secret` is the secret as returned
+        by secret_list(), if already fetched by the caller."""
+        if secret is None:
+            secret = self._find('secrets', secret_name, error_title=f'Error while updating the secret {secret_name}')
+        response = self.request(
+            'PUT', f'/v1/secrets/{secret["id"]}',
+            body={'name': secret_name, 'type': secret.get('type', 'SIMPLE'), 'value': secret_value},
+            error_title=f'Error while updating the secret {secret_name}',
+        )
+        return response['secret']
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the client shared by the whole process. The backend is selected
+    with the KOYEB_CLIENT environment variable: "api", "cli", or "auto" (the
+    default) to use the API when a token is available."""
+    global _client
+
+    with _client_lock:
+        if _client is not None:
+            return _client
+
+        backend = os.environ.get('KOYEB_CLIENT', 'auto').lower()
+        if backend not in ('auto', 'api', 'cli'):
+            raise ValueError(f'KOYEB_CLIENT should be "auto", "api" or "cli", not "{backend}"')
+
+        config = read_cli_config() if backend != 'cli' else {}
+        token = os.environ.get('KOYEB_TOKEN') or config.get('token')
+
+        if backend == 'api' and not token:
+            raise KoyebError('KOYEB_CLIENT=api requires an API token in KOYEB_TOKEN or in the koyeb CLI configuration')
+
+        url = os.environ.get('KOYEB_API_URL') or config.get('url') or DEFAULT_API_URL
+        namespace = hashlib.sha256(f'{url}\0{token or ""}'.encode()).hexdigest()[:16]
+        state = StateCache.from_environment(namespace=namespace)
+        timeout = float(os.environ.get('KOYEB_CALL_TIMEOUT') or DEFAULT_CALL_TIMEOUT)
+
+        if backend == 'cli' or not token:
+            _client = KoyebCLIClient(timeout=timeout, state=state)
+        else:
+            _client = KoyebAPIClient(token, url=url, timeout=timeout, state=state)
+        return _client
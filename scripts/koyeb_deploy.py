@@ -0,0 +1,454 @@
+"""Stages of the deployment of a service on Koyeb.
+
+Each stage can be run on its own by the scripts of this directory, and
+deploy.py runs all of them in a single process, passing the state from one
+stage to the next in memory.
+"""
+
+import asyncio
+import json
+
+from koyeb_buildcache import BuildCacheStats, publish_build_cache
+from koyeb_client import KoyebAlreadyExists, KoyebError, KoyebNotFound, get_client
+from koyeb_follow import follow_deployment
+from koyeb_github import github_output, github_step_summary
+from koyeb_journal import Journal
+from koyeb_preflight import preflight
+from koyeb_profile import DeploymentProfile, report_profile
+from koyeb_service import definition_diff, definition_hash, is_pinned_source, service_definition
+from koyeb_source import SourceHashError, is_ancestor, source_hash
+from koyeb_verify import domain_urls, verify_endpoints
+from koyeb_wait import FAILED_STATUSES, AdaptiveBackoff, Deadline, FixedInterval, koyeb_wait_status, make_strategy
+from koyeb_trace import traced
+from koyeb_utils import parse_time
+
+# Statuses of the deployments which haven't started running yet, and can be
+# cancelled when a newer deployment supersedes them.
+SUPERSEDABLE_STATUSES = ('PENDING', 'PROVISIONING', 'SCHEDULED')
+
+
+class DeployState:
+    """State shared between the stages of a deployment."""
+
+    def __init__(self, *, app_name, service_name):
+        self.app_name = app_name
+        self.service_name = service_name
+        self.app = None
+        self.service = None
+        self.deployment_id = None
+        self.build_cache = BuildCacheStats()
+
+
+@traced()
+def koyeb_app_create(app_name):
+    """Creates an app. If the app already exists, it does nothing and returns
+    None, otherwise it returns the created app."""
+    client = get_client()
+    if client.state.get('apps', app_name):
+        print(f'App {app_name} already exists according to the state cache. Skip.')
+        return None
+
+    try:
+        response = client.app_create(app_name)
+    except KoyebAlreadyExists:
+        print(f'App {app_name} already exists. Skip.')
+        return None
+
+    print(
+        f'App {app_name} successfully created. Output:\n{"v" * 100}\n{json.dumps(response, indent=2)}\n{"^" * 100}')
+    return response
+
+
+def koyeb_app_get(app_name, *, cached=False):
+    """Returns the application named `app_name`."""
+    return get_client().app_get(app_name, cached=cached)
+
+
+def koyeb_service_current(app_name, service_name):
+    """Returns a tuple (service, latest deployment of the service). The
+    deployment is None if the service has never been deployed.
+
+    If the service is in the state cache, only its latest deployment is
+    fetched. The entry is dropped if the deployment doesn't belong to the
+    service anymore."""
+    client = get_client()
+    key = f'{app_name}/{service_name}'
+    cached = client.state.get('services', key)
+    if cached:
+        try:
+            deployment = client.deployment_get(cached['latest_deployment_id'])
+        except KoyebNotFound:
+            deployment = None
+        if deployment is not None and deployment.get('service_id') == cached['id']:
+            return {'id': cached['id'], 'name': service_name, 'latest_deployment_id': deployment['id']}, deployment
+        client.state.invalidate('services', key)
+
+    service = client.service_get(app_name, service_name)
+    deployment = None
+    if service.get('latest_deployment_id'):
+        deployment = client.deployment_get(service['latest_deployment_id'])
+    return service, deployment
+
+
+def print_definition_diff(changes):
+    if not changes:
+        print('>> The service definition is unchanged.')
+        return
+    print('>> Changes to the service definition:')
+    for path, current, desired in changes:
+        print(f'   {path}: {current!r} -> {desired!r}')
+
+
+def source_paths(spec):
+    """Returns the paths of the repository the build of the service depends
+    on: its workdir and the paths of spec['watch_paths']."""
+    return [spec.get('git_workdir') or ''] + list(spec.get('watch_paths') or [])
+
+
+def current_source_hash(spec):
+    """Returns the hash of the sources to deploy (see koyeb_source), or None
+    if it can't be computed from the local clone."""
+    try:
+        return source_hash(spec['git_sha'], source_paths(spec))
+    except SourceHashError as exc:
+        print(f'>> Unable to hash the sources to deploy, assuming they changed: {exc}')
+        return None
+
+
+def deployed_source_hash(deployment, spec, cached):
+    """Returns the hash of the sources of `deployment`, from the state cache
+    or from the local clone, or None if it is unknown."""
+    if cached and cached.get('latest_deployment_id') == deployment['id'] and cached.get('source_hash'):
+        return cached['source_hash']
+    sha = ((deployment.get('definition') or {}).get('git') or {}).get('sha')
+    if not sha:
+        return None
+    try:
+        return source_hash(sha, source_paths(spec))
+    except SourceHashError as exc:
+        print(f'>> Unable to hash the deployed sources: {exc}')
+        return None
+
+
+def koyeb_resume(journal, app_name, service_name, desired_hash):
+    """Returns a tuple (service, updated), like koyeb_service_upsert, for the
+    deployment triggered by a previous attempt of the run with the same
+    definition (see koyeb_journal). Returns None if there is none, or if it
+    failed and must be deployed again."""
+    entry = journal.get(app_name, service_name, definition_hash=desired_hash)
+    if entry is None:
+        return None
+    try:
+        deployment = get_client().deployment_get(entry['deployment_id'])
+    except KoyebNotFound:
+        return None
+    if deployment['status'] in FAILED_STATUSES:
+        print(f'>> The deployment {deployment["id"]} of a previous attempt is {deployment["status"]}: deploying again.')
+        return None
+
+    service = {'id': deployment['service_id'], 'name': service_name, 'latest_deployment_id': deployment['id']}
+    if deployment['status'] == 'HEALTHY':
+        print(f'>> The deployment {deployment["id"]} of a previous attempt is healthy. Skip.')
+        return service, False
+    print(f'>> Resuming the deployment {deployment["id"]} of a previous attempt, currently {deployment["status"]}.')
+    return service, True
+
+
+def without_git_sha(definition):
+    if not definition.get('git'):
+        return definition
+    return dict(definition, git=dict(definition['git'], sha=''))
+
+
+def up_to_date_in_state_cache(app_name, service_name, spec):
+    """Returns the entry of the service in the state cache if it knows that
+    the definition of `spec` is deployed and healthy, else None."""
+    desired = service_definition(**dict(spec, service_name=service_name))
+    cached = get_client().state.get('services', f'{app_name}/{service_name}')
+    if (
+        cached and cached['healthy'] and is_pinned_source(desired) and not spec.get('force')
+        and cached['definition_hash'] == definition_hash(desired)
+    ):
+        return cached
+    return None
+
+
+def koyeb_preflight(services):
+    """Runs the pre-flight checks (see koyeb_preflight) of `services`, a list
+    of tuples (app name, service name, spec). The services which the state
+    cache knows are up to date are not checked, as they won't be deployed."""
+    preflight({
+        service_name: spec for app_name, service_name, spec in services
+        if up_to_date_in_state_cache(app_name, service_name, spec) is None
+    })
+
+
+@traced()
+def koyeb_service_upsert(app_name, service_name, spec):
+    """Updates the service, or creates it if it doesn't exist yet. Returns a
+    tuple (service, updated): the service contains the ID of the deployment
+    to follow, and updated is False if the update has been skipped.
+
+    Unless spec['force'] is set, the update is skipped when the definition of
+    the service didn't change, the last deployment is healthy and the source
+    to deploy is pinned (see koyeb_service.is_pinned_source). If the state
+    cache knows that this definition is already deployed and healthy, the
+    service is not even fetched. When the update can't be skipped and the
+    client doesn't need the current definition to update the service, the
+    service is updated first, and only created if it doesn't exist.
+
+    If spec['skip_unchanged_source'] is set, a GIT deployment is also skipped
+    when only the GIT sha changed, and the sources of the workdir and of
+    spec['watch_paths'] are the same at both commits.
+
+    With KOYEB_JOURNAL, the triggered deployment is recorded, and the
+    deployment of a previous attempt of the same run is resumed instead of
+    triggering a new one (see koyeb_resume)."""
+    client = get_client()
+    key = f'{app_name}/{service_name}'
+    desired = service_definition(**dict(spec, service_name=service_name))
+    desired_hash = definition_hash(desired)
+    desired_source_definition_hash = definition_hash(without_git_sha(desired))
+
+    journal = Journal.from_environment()
+    resumed = koyeb_resume(journal, app_name, service_name, desired_hash)
+    if resumed is not None:
+        return resumed
+
+    source = None
+    if spec.get('skip_unchanged_source') and desired.get('git') and is_pinned_source(desired) and not spec.get('force'):
+        source = current_source_hash(spec)
+
+    cached = up_to_date_in_state_cache(app_name, service_name, spec)
+    if cached:
+        print(f'>> Nothing to deploy: the deployment {cached["latest_deployment_id"]} is up to date according to the state cache. Skip.')
+        return {'id': cached['id'], 'name': service_name, 'latest_deployment_id': cached['latest_deployment_id']}, False
+
+    cached = client.state.get('services', key)
+    if cached and cached['healthy'] and is_pinned_source(desired) and not spec.get('force'):
+        if (
+            source is not None and cached.get('source_hash') == source
+            and cached.get('source_definition_hash') == desired_source_definition_hash
+        ):
+            print(f'>> Nothing to deploy: the sources of the deployment {cached["latest_deployment_id"]} are unchanged according to the state cache. Skip.')
+            return {'id': cached['id'], 'name': service_name, 'latest_deployment_id': cached['latest_deployment_id']}, False
+
+    def remember(service, *, healthy):
+        if not healthy:
+            journal.record(app_name, service_name, 'deployed',
+                           deployment_id=service['latest_deployment_id'], definition_hash=desired_hash)
+        client.state.put('services', key, {
+            'id': service['id'],
+            'latest_deployment_id': service['latest_deployment_id'],
+            'definition_hash': desired_hash,
+            'source_hash': source,
+            'source_definition_hash': desired_source_definition_hash,
+            'healthy': healthy,
+        })
+        return service
+
+    if (spec.get('force') or not is_pinned_source(desired)) and not client.service_update_needs_current:
+        # The update can't be skipped, so the current definition isn't needed:
+        # update first, and only create the service if it doesn't exist.
+        if spec.get('force'):
+            print('>> Update forced.')
+        else:
+            print('>> The GIT sha or the docker image digest is not set, the source may have changed: triggering an update.')
+        try:
+            service = client.service_update(app_name, service_name, spec)
+        except KoyebNotFound:
+            client.state.invalidate('services', key)
+            print(f'Service {service_name} does not exist yet. Creating it.')
+            return remember(client.service_create(app_name, service_name, spec), healthy=False), True
+        if spec.get('cancel_superseded'):
+            koyeb_cancel_superseded(service, desired)
+        return remember(service, healthy=False), True
+
+    try:
+        service, deployment = koyeb_service_current(app_name, service_name)
+    except KoyebNotFound:
+        print(f'Service {service_name} does not exist yet. Creating it.')
+        return remember(client.service_create(app_name, service_name, spec), healthy=False), True
+
+    if deployment is not None:
+        changes = definition_diff(deployment.get('definition') or {}, desired)
+        print_definition_diff(changes)
+
+        if spec.get('force'):
+            print('>> Update forced.')
+        elif deployment['status'] != 'HEALTHY':
+            print(f'>> The last deployment is {deployment["status"]}: triggering an update.')
+        elif not is_pinned_source(desired):
+            print('>> The GIT sha or the docker image digest is not set, the source may have changed: triggering an update.')
+        elif not changes:
+            print(f'>> Nothing to deploy: the deployment {deployment["id"]} is up to date. Skip.')
+            return remember(service, healthy=True), False
+        elif (
+            source is not None and [path for path, _, _ in changes] == ['git.sha']
+            and deployed_source_hash(deployment, spec, cached) == source
+        ):
+            print(f'>> Nothing to deploy: the sources of {", ".join(source_paths(spec)) or "/"} are unchanged since the deployment {deployment["id"]}. Skip.')
+            return remember(service, healthy=True), False
+
+    try:
+        service = client.service_update(app_name, service_name, spec, current=(service, deployment))
+    except KoyebNotFound:
+        if not cached:
+            raise
+        # The service found in the state cache doesn't exist anymore.
+        client.state.invalidate('services', key)
+        return koyeb_service_upsert(app_name, service_name, spec)
+    if spec.get('cancel_superseded'):
+        koyeb_cancel_superseded(service, desired)
+    return remember(service, healthy=False), True
+
+
+def is_superseded(deployment, latest, desired):
+    """Returns True if `deployment` deploys an older source than `latest`,
+    the deployment of the `desired` definition. GIT commits are compared in
+    the local clone; when they can't be, and for docker images, the
+    deployment created first is the older one."""
+    if parse_time(deployment['created_at']) > parse_time(latest['created_at']):
+        return False
+    sha = ((deployment.get('definition') or {}).get('git') or {}).get('sha')
+    desired_sha = (desired.get('git') or {}).get('sha')
+    if sha and desired_sha and sha != desired_sha:
+        try:
+            return is_ancestor(sha, desired_sha)
+        except SourceHashError as exc:
+            print(f'>> Unable to compare the commits, assuming the deployment {deployment["id"]} is older: {exc}')
+    return True
+
+
+@traced()
+def koyeb_cancel_superseded(service, desired):
+    """Cancels the deployments of `service` still waiting or building which
+    are superseded by its latest deployment, of the `desired` definition (see
+    is_superseded). Returns the IDs of the cancelled deployments."""
+    client = get_client()
+    deployments = client.deployment_list(service['id'], statuses=SUPERSEDABLE_STATUSES)
+    latest = next((d for d in deployments if d['id'] == service['latest_deployment_id']), None)
+    if latest is None:
+        latest = client.deployment_get(service['latest_deployment_id'])
+
+    cancelled = []
+    for deployment in deployments:
+        if deployment['id'] == latest['id'] or not is_superseded(deployment, latest, desired):
+            continue
+        try:
+            client.deployment_cancel(deployment['id'])
+        except KoyebError as exc:
+            print(f'>> Unable to cancel the superseded deployment {deployment["id"]}: {exc}')
+            continue
+        print(f'>> Cancelled the deployment {deployment["id"]} ({deployment["status"]}), superseded by {latest["id"]}.')
+        cancelled.append(deployment['id'])
+
+    if cancelled:
+        github_step_summary(
+            f'### Superseded deployments of service {service["name"]}\n\n'
+            f'Cancelled in favor of deployment {latest["id"]}:\n\n' + '\n'.join(f'- {d}' for d in cancelled)
+        )
+    return cancelled
+
+
+@traced()
+def koyeb_get_last_deployment_id(*, app_name, service_name):
+    """Returns the last deployment ID of a service."""
+    service = get_client().service_get(app_name, service_name)
+    return service['latest_deployment_id']
+
+
+@traced()
+def koyeb_wait_healthy(*, deployment_id, timeout, strategy='adaptive'):
+    """Waits for the deployment to be healthy. `strategy` is the name of the
+    strategy used to decide when to check the status again (see
+    koyeb_wait.make_strategy). The duration of every status is reported (see
+    koyeb_profile)."""
+    strategy = make_strategy(strategy, deployment_id)
+    profile = DeploymentProfile(deployment_id)
+
+    def on_change(info):
+        profile.on_status(info)
+        print(f'>>>> Deployment status is {info["status"]}')
+
+    strategy.start()
+    try:
+        koyeb_wait_status(
+            deployment_id=deployment_id,
+            statuses=('HEALTHY',),
+            deadline=Deadline(timeout),
+            strategy=strategy,
+            on_change=on_change,
+        )
+        Journal.from_environment().record_healthy(deployment_id)
+    finally:
+        strategy.stop()
+        report_profile(profile)
+
+
+def show_domains(app):
+    for domain in app['domains']:
+        print(f"Your application is available at: {domain['name']}")
+
+
+@traced()
+async def deploy_service(state, spec, *, build_timeout, healthy_timeout, strategy=None, prefix='', log_archive=None):
+    """Creates or updates the service of `state`, then follows the triggered
+    deployment until it is healthy. The application must already exist. The
+    build logs are archived to `log_archive`, if set."""
+    print(f'{prefix}==> Create or update Koyeb service {state.app_name}/{state.service_name}')
+    state.service, updated = await asyncio.to_thread(koyeb_service_upsert, state.app_name, state.service_name, spec)
+    state.deployment_id = state.service['latest_deployment_id']
+    print(f'{prefix}deployment-id={state.deployment_id}')
+    if not updated:
+        return
+
+    print(f'{prefix}==> Follow deployment {state.deployment_id}')
+    await follow_deployment(
+        state.deployment_id,
+        build_timeout=build_timeout,
+        healthy_timeout=healthy_timeout,
+        strategy=strategy,
+        prefix=prefix,
+        log_archive=log_archive,
+        build_cache=state.build_cache,
+    )
+    get_client().state.update('services', f'{state.app_name}/{state.service_name}', healthy=True)
+    Journal.from_environment().record_healthy(state.deployment_id)
+
+
+def deploy(*, app_name, service_name, spec, build_timeout, healthy_timeout, wait_strategy='adaptive', log_archive=None,
+           verify=None):
+    """Runs all the stages of a deployment: creates the application, creates or
+    updates the service, follows the build and runtime logs until the
+    deployment is healthy and displays the domains of the application. If
+    `verify` is set, the routes of the service are then probed on every domain,
+    with `verify` as keyword arguments of koyeb_verify.verify_endpoints."""
+    state = DeployState(app_name=app_name, service_name=service_name)
+
+    print(f'==> Create Koyeb application {app_name}')
+    state.app = koyeb_app_create(app_name)
+
+    try:
+        asyncio.run(deploy_service(
+            state, spec,
+            build_timeout=build_timeout,
+            healthy_timeout=healthy_timeout,
+            strategy=FixedInterval() if wait_strategy == 'fixed' else AdaptiveBackoff(),
+            log_archive=log_archive,
+        ))
+    finally:
+        if state.deployment_id:
+            github_output('deployment-id', state.deployment_id)
+            publish_build_cache(state.build_cache, deployment_id=state.deployment_id)
+
+    # The application has only to be fetched if it already existed, and the
+    # client may already know it from the service update.
+    if state.app is None:
+        state.app = koyeb_app_get(app_name, cached=True)
+    show_domains(state.app)
+
+    if verify is not None and spec['service_type'] == 'web':
+        print('==> Verify the endpoints of the service')
+        verify_endpoints(domain_urls(state.app), spec['service_routes'], **verify)
+    return state
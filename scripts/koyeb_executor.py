@@ -0,0 +1,239 @@
+"""Execution of the calls made to Koyeb by the loops polling the status of a
+deployment.
+
+At most KOYEB_MAX_CALLS calls (8 by default) run at the same time in the whole
+process, so following many deployments at the same time doesn't start an
+unbounded number of koyeb processes or connections. Calls run in a pool of
+as many daemon threads, started once and reused by the synchronous polling
+loops and by the asyncio followers alike, so a call whose result is no longer
+needed doesn't delay the exit of the process. Every call made by the clients
+has its own deadline (see KOYEB_CALL_TIMEOUT in koyeb_client): a stalled call
+is aborted instead of blocking the job.
+
+Reads which can safely be sent twice, such as getting a deployment, can be
+hedged: when a call hasn't completed after the 95th percentile of the
+latencies observed for the same operation (or 2 seconds, until 10 calls have
+completed), a second identical call is sent, and the first one to succeed
+wins. A single slow response, often stuck on a
+bad connection, then no longer delays the detection of a status change.
+"""
+
+import asyncio
+import atexit
+import collections
+import concurrent.futures
+import os
+import queue
+import sys
+import threading
+import time
+
+from koyeb_trace import get_tracer
+from koyeb_utils import percentile
+
+DEFAULT_MAX_CALLS = 8
+
+
+class LatencyTracker:
+    """Latencies of the last `window` successful calls of every operation.
+    Shared by threads."""
+
+    def __init__(self, *, window=100, min_samples=10):
+        self.min_samples = min_samples
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds):
+        with self._lock:
+            self._latencies[operation].append(seconds)
+
+    def percentile(self, operation, p):
+        """Returns the `p`th percentile of the latencies of `operation`, or
+        None until `min_samples` calls have completed."""
+        with self._lock:
+            latencies = list(self._latencies[operation])
+        if len(latencies) < self.min_samples:
+            return None
+        return percentile(latencies, p)
+
+
+class DaemonThreadPool:
+    """Pool of at most `max_workers` threads, started on demand and reused,
+    like concurrent.futures.ThreadPoolExecutor. Its threads are daemon
+    threads: the threads of a ThreadPoolExecutor are joined when the
+    interpreter exits, so a call still running, such as the losing call of a
+    hedge, would delay the exit of the process until its deadline."""
+
+    def __init__(self, max_workers, *, name='koyeb'):
+        self.max_workers = max_workers
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._idle = threading.Semaphore(0)
+        self._threads = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args):
+        """Returns a concurrent.futures.Future of func(*args)."""
+        future = concurrent.futures.Future()
+        self._queue.put((future, func, args))
+        if not self._idle.acquire(blocking=False):
+            with self._lock:
+                if self._threads < self.max_workers:
+                    self._threads += 1
+                    threading.Thread(target=self._work, name=f'{self.name}-{self._threads}', daemon=True).start()
+        return future
+
+    def _work(self):
+        while True:
+            future, func, args = self._queue.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args))
+                except BaseException as exc:
+                    future.set_exception(exc)
+            # Don't keep the result of the last call alive while idle.
+            future = None
+            self._idle.release()
+
+
+class KoyebExecutor:
+    """Runs blocking calls to Koyeb in a pool of `max_workers` threads. Calls
+    are hedged after at least `min_hedge_delay` seconds, and after
+    `default_hedge_delay` seconds while the latency of the operation is
+    unknown. `counters` holds the number of calls, of hedged calls, and of
+    hedged calls won by the second call."""
+
+    def __init__(self, *, max_workers=DEFAULT_MAX_CALLS, tracker=None, min_hedge_delay=0.2, default_hedge_delay=2):
+        self.tracker = tracker or LatencyTracker()
+        self.min_hedge_delay = min_hedge_delay
+        self.default_hedge_delay = default_hedge_delay
+        self.counters = {'calls': 0, 'hedged': 0, 'hedge_wins': 0}
+        self._pool = DaemonThreadPool(max_workers)
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _timed(self, func, args, operation):
+        start = time.monotonic()
+        result = func(*args)
+        self.tracker.record(operation, time.monotonic() - start)
+        return result
+
+    def _submit(self, func, args, operation):
+        self._count('calls')
+        return self._pool.submit(self._timed, func, args, operation)
+
+    def _hedge_delay(self, operation):
+        delay = self.tracker.percentile(operation, 95)
+        return self.default_hedge_delay if delay is None else max(self.min_hedge_delay, delay)
+
+    def _winner(self, done, hedge, span):
+        """Returns the first future of `done` which succeeded, or None."""
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    self._count('hedge_wins')
+                span['winner'] = 'hedge' if future is hedge else 'first'
+                return future
+        return None
+
+    async def _hedged(self, func, args, operation):
+        pending = {asyncio.wrap_future(self._submit(func, args, operation))}
+        try:
+            delay = self._hedge_delay(operation)
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return done.pop().result()
+
+            self._count('hedged')
+            with get_tracer().span(operation, 'hedge', after=round(delay, 3)) as span:
+                hedge = asyncio.wrap_future(self._submit(func, args, operation))
+                pending.add(hedge)
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    winner = self._winner(done, hedge, span)
+                    if winner is not None:
+                        return winner.result()
+                # Both calls failed.
+                done.pop().result()
+        finally:
+            # The losing calls can't be interrupted once started: their result
+            # is dropped, and they end at the latest at the deadline of the
+            # call.
+            for future in pending:
+                future.cancel()
+
+    def _hedged_call(self, func, args, operation):
+        pending = {self._submit(func, args, operation)}
+        try:
+            delay = self._hedge_delay(operation)
+            done, _ = concurrent.futures.wait(pending, timeout=delay)
+            if done:
+                return done.pop().result()
+
+            self._count('hedged')
+            with get_tracer().span(operation, 'hedge', after=round(delay, 3)) as span:
+                hedge = self._submit(func, args, operation)
+                pending.add(hedge)
+                while pending:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    winner = self._winner(done, hedge, span)
+                    if winner is not None:
+                        return winner.result()
+                # Both calls failed.
+                done.pop().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def run(self, func, *args, operation, hedge=False):
+        """Returns func(*args), called in another thread. `operation` names the call,
+        to compare its latency with the previous calls of the same operation.
+        If `hedge` is set, func must be safe to call twice."""
+        if hedge:
+            return await self._hedged(func, args, operation)
+        return await asyncio.wrap_future(self._submit(func, args, operation))
+
+    def call(self, func, *args, operation, hedge=False):
+        """Same as run(), for code which doesn't run an event loop: waits for
+        the calls of the pool without starting one."""
+        if hedge:
+            return self._hedged_call(func, args, operation)
+        return self._submit(func, args, operation).result()
+
+    def report(self):
+        """Returns a line describing the hedged calls, or None if there was
+        none."""
+        counters = dict(self.counters)
+        if not counters['hedged']:
+            return None
+        return (
+            f'{counters["hedged"]} of {counters["calls"]} calls to Koyeb hedged, '
+            f'{counters["hedge_wins"]} answered first by the second call'
+        )
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _report():
+    report = _executor.report()
+    if report:
+        sys.stderr.write(f'>> {report}\n')
+
+
+def get_executor():
+    """Returns the executor shared by the whole process, with at most
+    KOYEB_MAX_CALLS calls running at the same time. Its counters are reported
+    when the process exits."""
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            max_workers = int(os.environ.get('KOYEB_MAX_CALLS') or DEFAULT_MAX_CALLS)
+            _executor = KoyebExecutor(max_workers=max_workers)
+            atexit.register(_report)
+        return _executor
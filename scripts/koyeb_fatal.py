@@ -0,0 +1,130 @@
+"""Early detection of failed builds.
+
+The build logs are matched, as they are received, against the signatures of
+errors after which a build can't succeed: a package manager giving up, a
+compiler killed by the OOM killer, a step of the Dockerfile returning a
+non-zero code... When one matches, the matching lines are reported and, if
+KOYEB_CANCEL_FAILED_BUILDS is "true", the deployment is cancelled right
+away instead of waiting for Koyeb to give up on the build. Cancelling is
+opt-in: a signature may match the output of a command whose failure is
+ignored, such as a step ending with `|| true`.
+
+Signatures are fixed strings, found anywhere in a line of the logs. Set
+KOYEB_FATAL_BUILD_ERRORS to more signatures, one per line, to add them to the
+built-in ones.
+"""
+
+import os
+import sys
+
+from koyeb_archive import ANSI_ESCAPES
+from koyeb_client import KoyebError, get_client
+from koyeb_github import github_step_summary
+from koyeb_service import argparse_to_bool
+
+FATAL_BUILD_ERRORS = (
+    # npm and yarn giving up on an install or a script.
+    b'npm ERR! code ',
+    b'npm error code ',
+    b'error Command failed with exit code ',
+    # Out of memory: node, or a compiler killed by the OOM killer.
+    b'JavaScript heap out of memory',
+    b'fatal error: Killed signal terminated program',
+    # A step of a Dockerfile failing, with BuildKit, the classic builder or
+    # kaniko.
+    b'did not complete successfully: exit code: ',
+    b'returned a non-zero code: ',
+    b'error building image: ',
+    b'failed to solve: ',
+    # Buildpacks.
+    b'ERROR: failed to build: ',
+    b'ERROR: No buildpack groups passed detection',
+)
+
+# Lines reported after the first match.
+MAX_LINES = 20
+
+
+class FatalErrors:
+    """Finds the signatures of fatal errors in the build logs, fed in
+    arbitrary chunks. `on_match` is called with the first matching line; the
+    next matching lines are only collected in `lines`.
+
+    Every signature is searched with bytes.find(), which scans the logs
+    several times faster than a regular expression alternating all the
+    signatures: the cost is linear in the size of the logs and in the number
+    of signatures."""
+
+    def __init__(self, signatures=FATAL_BUILD_ERRORS, *, on_match=None):
+        self.signatures = signatures
+        self.on_match = on_match
+        self.lines = []
+        self._partial = b''
+
+    @classmethod
+    def from_environment(cls, *, on_match=None):
+        extra = os.environ.get('KOYEB_FATAL_BUILD_ERRORS') or ''
+        signatures = FATAL_BUILD_ERRORS + tuple(line.strip().encode() for line in extra.splitlines() if line.strip())
+        return cls(signatures, on_match=on_match)
+
+    @property
+    def matched(self):
+        return bool(self.lines)
+
+    def feed(self, chunk):
+        if len(self.lines) >= MAX_LINES:
+            return
+        data = self._partial + chunk
+        end = data.rfind(b'\n') + 1
+        self._partial = data[end:]
+
+        # Beginnings of the matching lines, in the order of the logs.
+        starts = set()
+        for signature in self.signatures:
+            pos = data.find(signature, 0, end)
+            while pos != -1:
+                starts.add(data.rfind(b'\n', 0, pos) + 1)
+                pos = data.find(signature, data.index(b'\n', pos), end)
+
+        for start in sorted(starts)[:MAX_LINES - len(self.lines)]:
+            line = data[start:data.index(b'\n', start)]
+            self.lines.append(ANSI_ESCAPES.sub(b'', line).decode(errors='replace').strip())
+            if len(self.lines) == 1 and self.on_match:
+                self.on_match(self.lines[0])
+
+
+def cancel_enabled():
+    return argparse_to_bool(os.environ.get('KOYEB_CANCEL_FAILED_BUILDS') or 'false')
+
+
+def cancel_failed_build(deployment_id, *, prefix=''):
+    """Cancels the deployment whose build logs show a fatal error, if
+    KOYEB_CANCEL_FAILED_BUILDS is true. Returns True if the deployment was
+    cancelled. A failure to cancel is only reported: the build then fails on
+    its own."""
+    if not cancel_enabled():
+        return False
+    print(f'{prefix}>>>> Fatal error in the build logs, cancelling deployment {deployment_id}')
+    try:
+        get_client().deployment_cancel(deployment_id)
+    except KoyebError as exc:
+        sys.stderr.write(f'{prefix}Warning: unable to cancel deployment {deployment_id}: {exc}\n')
+        return False
+    return True
+
+
+def report_fatal_errors(detector, deployment_id, *, cancelled, prefix=''):
+    """Prints the lines of the build logs which matched a fatal error, and
+    adds them to the summary of the job."""
+    if not detector.matched:
+        return
+    outcome = 'deployment cancelled' if cancelled else 'deployment not cancelled'
+    print(f'{prefix}>>>> Fatal errors in the build logs, {outcome}:')
+    for line in detector.lines:
+        print(f'{prefix}  {line}')
+    text = '\n'.join(detector.lines)
+    github_step_summary(
+        f'### Build of deployment {deployment_id} failed\n\n'
+        f'Fatal errors found in the build logs, {outcome}:\n\n'
+        f'````text\n{text}\n````'
+    )
@@ -0,0 +1,264 @@
+"""Follows a deployment from its build to its first healthy status.
+
+A single StatusPoller publishes every transition of the status of the
+deployment to its subscribers. Meanwhile, the build logs and then the runtime
+logs are streamed, so the output of an instance crashing during startup shows
+up as soon as it is written.
+"""
+
+import asyncio
+import sys
+import time
+
+from koyeb_archive import LogArchive, write_failure_summary
+from koyeb_buildcache import BuildCacheStats
+from koyeb_client import get_client
+from koyeb_fatal import FatalErrors, cancel_failed_build, report_fatal_errors
+from koyeb_logs import CHUNK_SIZE, BatchedWriter, LinePrefixer, LogStats
+from koyeb_profile import DeploymentProfile, report_profile
+from koyeb_trace import get_tracer
+from koyeb_tracker import get_tracker
+from koyeb_wait import FAILED_STATUSES, AdaptiveBackoff, Deadline
+
+BUILD_STATUSES = ('PENDING', 'PROVISIONING')
+
+
+class StatusPoller:
+    """Publishes the info of a deployment to every subscriber each time its
+    status changes, until the deployment is healthy or has failed. The status
+    is checked by the tracker of the event loop (see koyeb_tracker), shared by
+    all the deployments followed concurrently. `on_change` is called with the
+    info of the deployment as soon as its status changes, before the
+    subscribers get it."""
+
+    def __init__(self, deployment_id, *, strategy=None, min_notify_interval=1, on_change=None):
+        self.deployment_id = deployment_id
+        self.strategy = strategy or AdaptiveBackoff()
+        self.min_notify_interval = min_notify_interval
+        self.on_change = on_change
+        self.info = None
+        self._subscribers = []
+        self._last_notify = 0
+
+    def subscribe(self):
+        """Returns a queue receiving the info of the deployment on every status
+        change, starting with the current one. If polling fails, the exception
+        is put in the queue."""
+        queue = asyncio.Queue()
+        if self.info is not None:
+            queue.put_nowait(self.info)
+        self._subscribers.append(queue)
+        return queue
+
+    def notify(self):
+        """Checks the status as soon as possible, for example because logs
+        show activity on the deployment."""
+        if time.monotonic() - self._last_notify >= self.min_notify_interval:
+            self._last_notify = time.monotonic()
+            get_tracker().notify(self.deployment_id)
+
+    def _publish(self, item):
+        for queue in self._subscribers:
+            queue.put_nowait(item)
+
+    async def run(self):
+        done = asyncio.get_running_loop().create_future()
+
+        def on_change(info):
+            self.info = info
+            if self.on_change:
+                self.on_change(info)
+            self._publish(info)
+            if (info['status'] == 'HEALTHY' or info['status'] in FAILED_STATUSES) and not done.done():
+                done.set_result(info)
+
+        def on_error(exc):
+            self._publish(exc)
+            if not done.done():
+                done.set_exception(exc)
+
+        tracker = get_tracker()
+        watch = tracker.watch(self.deployment_id, on_change, on_error=on_error, strategy=self.strategy)
+        try:
+            return await done
+        finally:
+            tracker.unwatch(watch)
+
+
+async def wait_until(queue, predicate, *, deadline, deployment_id, waiting_for, prefix=''):
+    """Returns the first info received on `queue` whose status matches
+    `predicate`. Regularly reports that we are still waiting, and raises
+    asyncio.TimeoutError once the deadline expires."""
+    status = None
+    while True:
+        if deadline.expired():
+            raise asyncio.TimeoutError()
+        try:
+            item = await asyncio.wait_for(queue.get(), min(30, deadline.remaining()))
+        except asyncio.TimeoutError:
+            if not deadline.expired():
+                print(
+                    f'{prefix}[{int(deadline.elapsed())}s] Still waiting for deployment {deployment_id} to be {waiting_for}. Currently in status {status}.'
+                )
+            continue
+
+        if isinstance(item, Exception):
+            raise item
+        status = item['status']
+        if predicate(status):
+            return item
+
+
+async def print_transitions(queue, *, prefix=''):
+    while True:
+        item = await queue.get()
+        if isinstance(item, Exception):
+            return
+        print(f'{prefix}>>>> Deployment status is {item["status"]}')
+
+
+async def stream_logs(deployment_id, log_type, *, on_activity=None, prefix='', observers=()):
+    """Writes the logs of the deployment to stdout until cancelled or until
+    the stream ends, with `prefix` at the beginning of every line. Both pipes
+    of the CLI are read in chunks and written in batches. `on_activity` is called
+    every time logs are received, and every chunk of logs is fed to the
+    `observers`, such as LogStats or LogArchive."""
+    proc = await asyncio.create_subprocess_exec(
+        *get_client().deployment_logs_args(deployment_id, log_type),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    writer = BatchedWriter(sys.stdout.buffer)
+    flushed = asyncio.Event()
+
+    async def drain(pipe):
+        prefixer = LinePrefixer(prefix.encode())
+        while True:
+            chunk = await pipe.read(CHUNK_SIZE)
+            if not chunk:
+                writer.write(prefixer.end())
+                return
+            for observer in observers:
+                observer.feed(chunk)
+            writer.write(prefixer.feed(chunk))
+            flushed.set()
+            if on_activity:
+                on_activity()
+
+    async def flush_periodically():
+        # Flush the logs which have been buffered for too long when no new
+        # logs are received.
+        while True:
+            await flushed.wait()
+            flushed.clear()
+            await asyncio.sleep(writer.max_latency)
+            writer.write(b'')
+
+    flusher = asyncio.create_task(flush_periodically())
+    try:
+        await asyncio.gather(drain(proc.stdout), drain(proc.stderr))
+    finally:
+        await cancel(flusher)
+        writer.flush()
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+async def cancel(task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def follow_deployment(deployment_id, *, build_timeout, healthy_timeout, strategy=None, prefix='', log_archive=None,
+                            build_cache=None):
+    """Streams the build logs until the build is finished, then streams the
+    runtime logs until the deployment is healthy. Raises an error if the
+    deployment fails, or if it is not healthy `healthy_timeout` seconds after
+    the end of the build. `prefix` is written at the beginning of every line of
+    output, to tell apart deployments followed concurrently.
+
+    If `log_archive` is set, the build logs are also compressed to this file
+    (see koyeb_archive), and the lines around the error are added to the
+    summary of the job if the build fails. The hits and misses of the build
+    cache are counted in `build_cache`, a BuildCacheStats, if set. As soon as
+    the build logs show a fatal error, the deployment is cancelled if
+    KOYEB_CANCEL_FAILED_BUILDS is set (see koyeb_fatal).
+
+    The duration of every status and of every step of the build is reported
+    at the end (see koyeb_profile)."""
+    profile = DeploymentProfile(deployment_id)
+    poller = StatusPoller(deployment_id, strategy=strategy, on_change=profile.on_status)
+    build_queue = poller.subscribe()
+    health_queue = poller.subscribe()
+    tasks = [
+        asyncio.create_task(poller.run()),
+        asyncio.create_task(print_transitions(poller.subscribe(), prefix=prefix)),
+    ]
+
+    try:
+        build_stats = LogStats()
+        build_cache = build_cache if build_cache is not None else BuildCacheStats()
+        archive = LogArchive(log_archive) if log_archive else None
+        cancellation = None
+
+        def on_fatal_error(line):
+            nonlocal cancellation
+            cancellation = asyncio.create_task(asyncio.to_thread(cancel_failed_build, deployment_id, prefix=prefix))
+            # The deployment is no longer building once cancelled.
+            cancellation.add_done_callback(lambda task: poller.notify())
+
+        fatal_errors = FatalErrors.from_environment(on_match=on_fatal_error)
+        build_observers = [build_stats, profile.build_steps, build_cache, fatal_errors] + ([archive] if archive else [])
+        build_logs = asyncio.create_task(stream_logs(deployment_id, 'build', prefix=prefix, observers=build_observers))
+        # Only a build which ended with a failure is summarized: a build still
+        # running at the timeout may yet succeed, and the deployment is then
+        # waited for like after any other build.
+        build_failed = False
+        try:
+            with get_tracer().span('wait build', deployment_id=deployment_id):
+                info = await wait_until(
+                    build_queue, lambda status: status not in BUILD_STATUSES,
+                    deadline=Deadline(build_timeout), deployment_id=deployment_id, waiting_for='built', prefix=prefix,
+                )
+            print(f'{prefix}>>>> Build finished. Stop following build logs.')
+            build_failed = info['status'] in FAILED_STATUSES
+        except asyncio.TimeoutError:
+            sys.stderr.write(f'{prefix}Timeout reached, stop following build logs...\n')
+        finally:
+            await cancel(build_logs)
+            print(f'{prefix}>>>> Build logs: {build_stats.report()}')
+            cancelled = bool(cancellation and await cancellation)
+            build_failed = build_failed or cancelled
+            report_fatal_errors(fatal_errors, deployment_id, cancelled=cancelled, prefix=prefix)
+            build_cache.close()
+            print(f'{prefix}>>>> Build cache: {build_cache.report()}')
+            if archive:
+                archive.close()
+                if build_failed:
+                    write_failure_summary(log_archive, deployment_id)
+
+        # Every line written by an instance hints that its status may change:
+        # check it right away.
+        runtime_logs = asyncio.create_task(stream_logs(deployment_id, 'runtime', on_activity=poller.notify, prefix=prefix))
+        try:
+            with get_tracer().span('wait healthy', deployment_id=deployment_id):
+                info = await wait_until(
+                    health_queue, lambda status: status == 'HEALTHY' or status in FAILED_STATUSES,
+                    deadline=Deadline(healthy_timeout), deployment_id=deployment_id, waiting_for='healthy', prefix=prefix,
+                )
+        except asyncio.TimeoutError:
+            raise RuntimeError(
+                f'Timeout reached while waiting for deployment {deployment_id} to be healthy'
+            )
+        finally:
+            await cancel(runtime_logs)
+
+        if info['status'] != 'HEALTHY':
+            raise RuntimeError(
+                f'Deployment {deployment_id} is in status {info["status"]}.'
+            )
+        return info
+    finally:
+        for task in tasks:
+            await cancel(task)
+        report_profile(profile, prefix=prefix)
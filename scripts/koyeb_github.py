@@ -0,0 +1,34 @@
+"""Integration with the GitHub Actions runner."""
+
+import os
+
+
+def github_output(name, value):
+    """Sets the output `name` of the current step, if running in GitHub
+    Actions."""
+    path = os.environ.get('GITHUB_OUTPUT')
+    if path:
+        with open(path, 'a') as f:
+            f.write(f'{name}={value}\n')
+
+
+def markdown_table(headers, rows):
+    """Returns a markdown table with the column `headers` and the `rows`,
+    lists of values converted to strings. Pipes in the values are escaped and
+    newlines replaced by spaces, so they don't break the table."""
+    def row(values):
+        cells = (str(value).replace('|', '\\|').replace('\n', ' ') for value in values)
+        return f'| {" | ".join(cells)} |'
+
+    lines = [row(headers), f'|{"|".join("---" for _ in headers)}|']
+    lines += [row(values) for values in rows]
+    return '\n'.join(lines)
+
+
+def github_step_summary(markdown):
+    """Appends `markdown` to the summary of the current job, if running in
+    GitHub Actions."""
+    path = os.environ.get('GITHUB_STEP_SUMMARY')
+    if path:
+        with open(path, 'a') as f:
+            f.write(f'{markdown}\n')
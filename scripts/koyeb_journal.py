@@ -0,0 +1,106 @@
+"""Journal of the stages completed by the attempts of a workflow run.
+
+When a run is re-run, for example after a timeout while waiting for the
+deployment to be healthy, the deployment triggered by the previous attempt
+may still be building, or may have become healthy in the meantime. Set
+KOYEB_JOURNAL to the path of a file to record the deployment triggered for
+every service and the stages it completed. The file must be kept between
+the attempts even when the job fails, with actions/cache/save and
+`if: always()`: actions/cache only saves the cache of jobs which
+succeeded. The next attempt of the same run then follows this deployment
+again, or finishes right away if it is healthy, instead of triggering a new
+build.
+
+Entries are keyed by the run (GITHUB_RUN_ID), the application and the
+service, and only resumed when the definition to deploy, which includes the
+GIT sha or the docker image, is the same. Entries older than a week are
+dropped.
+"""
+
+import json
+import os
+import threading
+import time
+
+MAX_AGE = 7 * 24 * 60 * 60
+
+_journal_lock = threading.Lock()
+
+
+class Journal:
+    """Entries of the JSON file at `path`. Without `path`, nothing is
+    recorded. The file is read again before every change, so the scripts of
+    the same job, and the services of a manifest deployed concurrently, share
+    it."""
+
+    def __init__(self, path=None, *, run_id=None):
+        self.path = path or None
+        self.run_id = run_id or 'local'
+
+    @classmethod
+    def from_environment(cls):
+        return cls(os.environ.get('KOYEB_JOURNAL'), run_id=os.environ.get('GITHUB_RUN_ID'))
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                content = json.load(f)
+            if content.get('version') == 1:
+                return content
+        except (FileNotFoundError, ValueError):
+            pass
+        return {'version': 1, 'entries': {}}
+
+    def _key(self, app_name, service_name):
+        return f'{self.run_id}/{app_name}/{service_name}'
+
+    def get(self, app_name, service_name, *, definition_hash):
+        """Returns the entry of the service recorded by a previous attempt of
+        this run for the same definition, or None."""
+        if not self.enabled:
+            return None
+        with _journal_lock:
+            entry = self._load()['entries'].get(self._key(app_name, service_name))
+        if entry is None or entry['definition_hash'] != definition_hash:
+            return None
+        return entry
+
+    def record(self, app_name, service_name, stage, *, deployment_id, definition_hash=None):
+        """Records that the deployment `deployment_id` of the service
+        completed `stage`. `definition_hash` is required for the first
+        stage."""
+        if not self.enabled:
+            return
+        with _journal_lock:
+            content = self._load()
+            entries = content['entries']
+            key = self._key(app_name, service_name)
+            entry = entries.get(key)
+            if entry is None or entry['deployment_id'] != deployment_id:
+                entry = {'deployment_id': deployment_id, 'definition_hash': definition_hash, 'stages': []}
+            if stage not in entry['stages']:
+                entry['stages'].append(stage)
+            entry['at'] = time.time()
+            entries[key] = entry
+            content['entries'] = {key: e for key, e in entries.items() if time.time() - e['at'] < MAX_AGE}
+
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(content, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+
+    def record_healthy(self, deployment_id):
+        """Records that the deployment `deployment_id`, whatever its service,
+        is healthy. Does nothing if no entry of this run has it."""
+        if not self.enabled:
+            return
+        with _journal_lock:
+            entries = self._load()['entries']
+        for key, entry in entries.items():
+            if key.startswith(f'{self.run_id}/') and entry['deployment_id'] == deployment_id:
+                _, app_name, service_name = key.split('/', 2)
+                self.record(app_name, service_name, 'healthy', deployment_id=deployment_id)
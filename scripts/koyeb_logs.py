@@ -0,0 +1,241 @@
+"""Streaming of deployment logs.
+
+Logs are read from both pipes of the koyeb CLI in large non-blocking chunks,
+and written to the output of the job in batches: a noisy build doesn't turn
+into one write and one flush per line, and the stderr pipe of the CLI is
+drained so it can't fill up and block the CLI.
+"""
+
+import os
+import selectors
+import sys
+import time
+
+from koyeb_archive import LogArchive, write_failure_summary
+from koyeb_buildcache import BuildCacheStats, publish_build_cache
+from koyeb_client import get_client
+from koyeb_executor import get_executor
+from koyeb_fatal import FatalErrors, cancel_failed_build, report_fatal_errors
+from koyeb_profile import DeploymentProfile, report_profile
+from koyeb_wait import FAILED_STATUSES, Deadline
+from koyeb_trace import traced
+
+CHUNK_SIZE = 64 * 1024
+
+
+class LogStats:
+    """Counts the lines and bytes of a log stream to report its throughput."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.lines = 0
+        self.bytes = 0
+
+    def feed(self, chunk):
+        self.lines += chunk.count(b'\n')
+        self.bytes += len(chunk)
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start, 1e-3)
+        return (
+            f'{self.lines} lines, {self.bytes / 1024:.1f} KiB in {elapsed:.1f}s '
+            f'({self.lines / elapsed:.0f} lines/s, {self.bytes / 1024 / elapsed:.1f} KiB/s)'
+        )
+
+
+class BatchedWriter:
+    """Buffers the data written to `out`, and flushes it once the buffer holds
+    `max_bytes`, or once the oldest buffered data is `max_latency` seconds
+    old."""
+
+    def __init__(self, out, *, max_bytes=CHUNK_SIZE, max_latency=0.1):
+        self.out = out
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self._chunks = []
+        self._size = 0
+        self._since = None
+
+    def write(self, data):
+        if data:
+            if not self._chunks:
+                self._since = time.monotonic()
+            self._chunks.append(data)
+            self._size += len(data)
+        if self._size >= self.max_bytes or self.time_to_flush() == 0:
+            self.flush()
+
+    def time_to_flush(self):
+        """Returns the number of seconds before the buffer must be flushed, or
+        None if it is empty."""
+        if not self._chunks:
+            return None
+        return max(0, self._since + self.max_latency - time.monotonic())
+
+    def flush(self):
+        if self._chunks:
+            self.out.write(b''.join(self._chunks))
+            self._chunks = []
+            self._size = 0
+        self.out.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+class LinePrefixer:
+    """Adds a prefix at the beginning of every line of a stream received in
+    arbitrary chunks. Incomplete lines are kept until they are terminated, so
+    streams written concurrently are interleaved line by line."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._partial = b''
+
+    def feed(self, chunk):
+        if not self.prefix:
+            return chunk
+        lines = (self._partial + chunk).split(b'\n')
+        self._partial = lines.pop()
+        return b''.join(self.prefix + line + b'\n' for line in lines)
+
+    def end(self):
+        partial, self._partial = self._partial, b''
+        return self.prefix + partial + b'\n' if partial else b''
+
+
+class DeploymentStatus:
+    """`on_check` is called with the info of the deployment every time its
+    status is checked."""
+
+    def __init__(self, deployment_id, *, on_check=None):
+        self.deployment_id = deployment_id
+        self.on_check = on_check
+        self.status = None
+
+    def check(self):
+        """Called every few seconds to check the deployment status. Returns True if we
+        are no longer in the building phase."""
+        deployment_info = get_executor().call(
+            get_client().deployment_get, self.deployment_id, operation='deployment get', hedge=True,
+        )
+        deployment_status = deployment_info['status']
+        if self.on_check:
+            self.on_check(deployment_info)
+
+        old_status = self.status
+        self.status = deployment_status
+
+        if deployment_status not in ('PENDING', 'PROVISIONING'):
+            print(
+                f'>>>> Deployment status is {deployment_status}. Stop following build logs.'
+            )
+            return True
+        elif deployment_status != old_status:
+            print(f'>>>> Deployment status is {deployment_status}')
+            return False
+
+
+def koyeb_build_logs(deployment_id, timeout, tick_func, *, tick_interval=3, max_latency=None):
+    """This function is a generator that yields the build logs in chunks, read
+    from both the stdout and stderr of the koyeb CLI. Exits when the build is
+    finished or after `timeout` seconds. Every `tick_interval` seconds, whether
+    logs are received or not, the tick_func is called to check the deployment
+    status. If it returns True, the generator exits.
+
+    If `max_latency` is set, an empty chunk is yielded when no logs have been
+    received for `max_latency` seconds, so the caller can flush its buffers.
+    """
+    proc = get_client().deployment_logs(deployment_id, 'build')
+    deadline = Deadline(timeout)
+    next_tick = time.monotonic() + tick_interval
+
+    selector = selectors.DefaultSelector()
+    for pipe in (proc.stdout, proc.stderr):
+        os.set_blocking(pipe.fileno(), False)
+        selector.register(pipe, selectors.EVENT_READ)
+
+    try:
+        while selector.get_map():
+            wait = min(next_tick - time.monotonic(), deadline.remaining())
+            if max_latency is not None:
+                wait = min(wait, max_latency)
+
+            events = selector.select(max(0, wait))
+            for key, _ in events:
+                try:
+                    chunk = os.read(key.fd, CHUNK_SIZE)
+                except BlockingIOError:
+                    continue
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    continue
+                yield chunk
+            if not events and max_latency is not None:
+                yield b''
+
+            if deadline.expired():
+                sys.stderr.write('Timeout reached, killing the process...\n')
+                return
+
+            if time.monotonic() >= next_tick:
+                next_tick = time.monotonic() + tick_interval
+                if tick_func():
+                    return
+    finally:
+        selector.close()
+        proc.kill()
+        proc.wait()
+
+
+@traced()
+def show_build_logs(deployment_id, timeout, *, archive_path=None):
+    """Writes the build logs of the deployment to stdout until the build is
+    finished, then reports the throughput of the logs. If `archive_path` is
+    set, the logs are also compressed to this file (see koyeb_archive), and the
+    lines around the error are added to the summary of the job if the build
+    fails. The duration of the steps of the build is reported (see
+    koyeb_profile), and the hits and misses of the build cache are set as
+    outputs of the step (see koyeb_buildcache).
+
+    As soon as the logs show a fatal error, the deployment is cancelled if
+    KOYEB_CANCEL_FAILED_BUILDS is set (see koyeb_fatal), and the logs are
+    followed until its status changes."""
+    profile = DeploymentProfile(deployment_id)
+    status = DeploymentStatus(deployment_id, on_check=profile.on_status)
+    stats = LogStats()
+    build_cache = BuildCacheStats()
+    fatal_errors = FatalErrors.from_environment()
+    # None until a fatal error is found.
+    cancelled = None
+    archive = LogArchive(archive_path) if archive_path else None
+    observers = [stats, profile.build_steps, build_cache, fatal_errors] + ([archive] if archive else [])
+
+    with BatchedWriter(sys.stdout.buffer) as writer:
+        for chunk in koyeb_build_logs(
+            deployment_id, timeout, status.check,
+            max_latency=writer.max_latency,
+        ):
+            for observer in observers:
+                observer.feed(chunk)
+            writer.write(chunk)
+            if fatal_errors.matched and cancelled is None:
+                # The logs are followed until the next check of the status,
+                # which is no longer building once the deployment is
+                # cancelled.
+                writer.flush()
+                cancelled = cancel_failed_build(deployment_id)
+    print(f'>>>> Build logs: {stats.report()}')
+    report_fatal_errors(fatal_errors, deployment_id, cancelled=bool(cancelled))
+    build_cache.close()
+    print(f'>>>> Build cache: {build_cache.report()}')
+    publish_build_cache(build_cache, deployment_id=deployment_id)
+    report_profile(profile)
+
+    if archive:
+        archive.close()
+        if status.status in FAILED_STATUSES or cancelled:
+            write_failure_summary(archive_path, deployment_id)
@@ -0,0 +1,292 @@
+"""Deployment of several services described in a manifest file.
+
+The manifest is a YAML or JSON file:
+
+    defaults:
+      app-name: my-app
+      service-instance-type: nano
+    services:
+      - service-name: api
+        git-url: github.com/org/repo
+        git-workdir: api
+        service-env: [PORT=8000, DATABASE_URL=@DATABASE_URL]
+        service-ports: "8000:http"
+        service-routes: "/api:8000"
+      - service-name: web
+        depends-on: [api]
+        ...
+
+Each service accepts the same options as service-upsert.py, with the same
+syntax, plus build-timeout, healthy-timeout and build-log-archive. The
+commands and entrypoints may also be lists of arguments, and the
+environment, regions, ports, routes and checks lists of entries, each entry
+being read on its own: `service-env: [GREETING=Hello, world]` sets a single
+variable.
+Services are deployed concurrently, except that a service listed in
+depends-on must be healthy before the deployment of the dependent service
+starts.
+"""
+
+import argparse
+import asyncio
+import json
+import shlex
+import time
+
+from koyeb_deploy import DeployState, deploy_service, koyeb_app_create, koyeb_preflight
+from koyeb_github import github_step_summary, markdown_table
+from koyeb_preflight import PreflightError
+from koyeb_service import (
+    add_service_arguments, apply_service_config, check_mutual_exclusive_options, service_config_options,
+)
+
+# Same defaults as the inputs of action.yaml.
+SERVICE_DEFAULTS = {
+    'service-type': 'web',
+    'service-instance-type': 'nano',
+    'service-regions': 'fra',
+    'service-env': '',
+    'service-ports': '80:http',
+    'service-routes': '/:80',
+    'service-checks': '',
+    'build-timeout': 60 * 15,
+    'healthy-timeout': 60 * 15,
+}
+
+
+class ManifestError(Exception):
+    pass
+
+
+class ManifestService:
+    def __init__(self, *, name, app_name, spec, depends_on, build_timeout, healthy_timeout, build_log_archive=None):
+        self.name = name
+        self.app_name = app_name
+        self.spec = spec
+        self.depends_on = depends_on
+        self.build_timeout = build_timeout
+        self.healthy_timeout = healthy_timeout
+        self.build_log_archive = build_log_archive
+        self.state = DeployState(app_name=app_name, service_name=name)
+        self.status = 'WAITING'
+        self.error = None
+        self.duration = None
+
+
+def load_manifest_file(path):
+    with open(path) as f:
+        content = f.read()
+
+    if path.endswith('.json'):
+        return json.loads(content)
+
+    try:
+        import yaml
+    except ImportError:
+        raise ManifestError(f'PyYAML is required to read {path}. Install it or use a JSON manifest.')
+    return yaml.safe_load(content)
+
+
+def manifest_parser(name):
+    parser = argparse.ArgumentParser(prog=f'manifest service "{name}"', add_help=False)
+    parser.add_argument('--app-name', required=True)
+    parser.add_argument('--service-name', required=True)
+    parser.add_argument('--build-timeout', type=int)
+    parser.add_argument('--healthy-timeout', type=float)
+    parser.add_argument('--build-log-archive')
+    add_service_arguments(parser)
+    return parser
+
+
+# Options given as a command line, split like a shell does.
+COMMAND_OPTIONS = ('docker-command', 'docker-entrypoint', 'git-docker-command', 'git-docker-entrypoint')
+
+# Options of lists of entries, and their key in a --service-config file.
+LIST_OPTIONS = {
+    'service-env': 'env',
+    'service-regions': 'regions',
+    'service-ports': 'ports',
+    'service-routes': 'routes',
+    'service-checks': 'checks',
+}
+
+
+def manifest_to_argv(options):
+    """Converts the options of a service in the manifest to command line
+    arguments, so they are parsed and validated exactly like the options of
+    service-upsert.py. Returns the arguments, and the lists of entries of
+    LIST_OPTIONS, to parse entry by entry with service_config_options()
+    since their entries may contain commas."""
+    argv = []
+    config = {}
+    for key, value in options.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        elif isinstance(value, (list, tuple)):
+            if key in LIST_OPTIONS:
+                config[LIST_OPTIONS[key]] = list(value)
+                value = ''
+            elif key in COMMAND_OPTIONS:
+                value = shlex.join(str(item) for item in value)
+            else:
+                value = ','.join(str(item) for item in value)
+        argv.append(f'--{key}={value}')
+    return argv, config
+
+
+def parse_manifest(manifest, *, default_app_name=None):
+    """Returns the list of services of the manifest, in the order of the
+    file. Raises ManifestError if the manifest is invalid."""
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('services'), list):
+        raise ManifestError('The manifest should contain a list of "services".')
+
+    defaults = {**SERVICE_DEFAULTS, **(manifest.get('defaults') or {})}
+    if default_app_name:
+        defaults.setdefault('app-name', default_app_name)
+
+    services = {}
+    for entry in manifest['services']:
+        options = {**defaults, **entry}
+        name = options.get('service-name')
+        if not name:
+            raise ManifestError(f'Missing service-name for the service {entry}.')
+        if name in services:
+            raise ManifestError(f'The service {name} is listed twice.')
+
+        depends_on = options.pop('depends-on', None) or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        if 'docker' not in options:
+            options.setdefault('git-builder', 'buildpack')
+
+        parser = manifest_parser(name)
+        try:
+            argv, config = manifest_to_argv(options)
+            args = parser.parse_args(argv)
+            try:
+                for key, value in service_config_options(config).items():
+                    setattr(args, key, value)
+            except ValueError as exc:
+                parser.error(str(exc))
+            check_mutual_exclusive_options(parser, args)
+            apply_service_config(parser, args)
+        except SystemExit:
+            # argparse already printed the reason.
+            raise ManifestError(f'Invalid options for the service {name}.')
+
+        services[name] = ManifestService(
+            name=name,
+            app_name=args.app_name,
+            spec=vars(args),
+            depends_on=depends_on,
+            build_timeout=args.build_timeout,
+            healthy_timeout=args.healthy_timeout,
+            build_log_archive=args.build_log_archive,
+        )
+
+    check_dependencies(services)
+    return list(services.values())
+
+
+def check_dependencies(services):
+    """Raises ManifestError if a service depends on an unknown service, or if
+    dependencies are circular."""
+    for service in services.values():
+        for dependency in service.depends_on:
+            if dependency not in services:
+                raise ManifestError(f'The service {service.name} depends on the unknown service {dependency}.')
+
+    visited = set()
+
+    def visit(name, path):
+        if name in path:
+            raise ManifestError(f'Circular dependency: {" -> ".join(path + [name])}.')
+        if name in visited:
+            return
+        for dependency in services[name].depends_on:
+            visit(dependency, path + [name])
+        visited.add(name)
+
+    for name in services:
+        visit(name, [])
+
+
+async def deploy_manifest_services(services, *, concurrency):
+    """Deploys all the services, at most `concurrency` at a time. A service
+    starts once all its dependencies are healthy, and is skipped if one of
+    them failed."""
+    semaphore = asyncio.Semaphore(concurrency)
+    done = {service.name: asyncio.Event() for service in services}
+    by_name = {service.name: service for service in services}
+    width = max(len(service.name) for service in services)
+
+    # Create every application once, before deploying their services.
+    for app_name in dict.fromkeys(service.app_name for service in services):
+        await asyncio.to_thread(koyeb_app_create, app_name)
+
+    async def run(service):
+        try:
+            for dependency in service.depends_on:
+                await done[dependency].wait()
+                if by_name[dependency].status != 'HEALTHY':
+                    service.status = 'SKIPPED'
+                    service.error = f'dependency {dependency} is {by_name[dependency].status}'
+                    return
+
+            async with semaphore:
+                start = time.monotonic()
+                service.status = 'DEPLOYING'
+                try:
+                    await deploy_service(
+                        service.state, service.spec,
+                        build_timeout=service.build_timeout,
+                        healthy_timeout=service.healthy_timeout,
+                        prefix=f'[{service.name:<{width}}] ',
+                        log_archive=service.build_log_archive,
+                    )
+                    service.status = 'HEALTHY'
+                except Exception as exc:
+                    service.status = 'FAILED'
+                    service.error = str(exc).splitlines()[0] if str(exc) else type(exc).__name__
+                finally:
+                    service.duration = time.monotonic() - start
+        finally:
+            done[service.name].set()
+
+    await asyncio.gather(*(run(service) for service in services))
+
+
+def summary_table(services):
+    """Returns the summary of the deployments as a markdown table."""
+    rows = []
+    for service in services:
+        duration = f'{int(service.duration)}s' if service.duration is not None else ''
+        build_cache = service.state.build_cache
+        cache = f'{build_cache.hits} hits, {build_cache.misses} misses' if build_cache.detected else ''
+        rows.append((
+            f'{service.app_name}/{service.name}', service.status, service.state.deployment_id or '', duration,
+            cache, service.error or '',
+        ))
+    return markdown_table(['Service', 'Status', 'Deployment', 'Duration', 'Build cache', 'Details'], rows)
+
+
+def deploy_manifest(path, *, concurrency, default_app_name=None):
+    """Deploys all the services of the manifest at `path`. Raises an error if
+    any of them is not healthy at the end."""
+    services = parse_manifest(load_manifest_file(path), default_app_name=default_app_name)
+    try:
+        koyeb_preflight([(service.app_name, service.name, service.spec) for service in services])
+    except PreflightError as exc:
+        raise ManifestError(str(exc))
+    asyncio.run(deploy_manifest_services(services, concurrency=concurrency))
+
+    table = summary_table(services)
+    print(table)
+    github_step_summary(f'### Koyeb deployments\n\n{table}')
+
+    failed = [service.name for service in services if service.status != 'HEALTHY']
+    if failed:
+        raise RuntimeError(f'Some services were not deployed successfully: {", ".join(failed)}')
+    return services
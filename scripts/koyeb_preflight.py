@@ -0,0 +1,218 @@
+"""Pre-flight checks of the definitions of the services to deploy.
+
+Mistakes which make a deployment fail, or never become healthy, are looked
+for before anything is created or built:
+
+- offline, the consistency of every definition: ports, routes pointing at a
+  declared HTTP port, healthchecks on a declared port, names of the
+  environment variables...
+- online, the references to other resources: the secrets used by the
+  environment (`@NAME` and `{{ secret.NAME }}`) and by the private registry,
+  the regions and the instance types. The secrets, the regions and the
+  instance types are listed once, concurrently, whatever the number of
+  services checked. The secrets are only listed if a service references
+  some, and the regions and instance types only if a service doesn't use the
+  default ones. They are kept in the state cache (see koyeb_state).
+
+All the errors are reported at once. A reference which can't be checked,
+because listing the resources failed, is only reported as a warning. Set
+KOYEB_PREFLIGHT to "false" to skip the checks.
+"""
+
+import concurrent.futures
+import os
+import re
+import time
+
+from koyeb_client import KoyebError, get_client
+from koyeb_service import argparse_to_bool
+from koyeb_trace import traced
+
+ENV_NAME = re.compile(r'^[^\s=]+$')
+SECRET_TEMPLATE = re.compile(r'\{\{\s*secrets?\.([\w.-]+)\s*\}\}')
+SLUG = re.compile(r'^[a-z0-9][a-z0-9-]*$')
+
+# Defaults of the action, always available.
+DEFAULT_REGIONS = ('fra',)
+DEFAULT_INSTANCE_TYPE = 'nano'
+
+
+class PreflightError(Exception):
+    pass
+
+
+def _port(value):
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        return None
+    return port if 1 <= port <= 65535 else None
+
+
+def definition_errors(spec):
+    """Returns the inconsistencies of the parsed options `spec` of a service,
+    without calling Koyeb."""
+    errors = []
+
+    ports = {}
+    for entry in spec['service_ports']:
+        port = _port(entry['port'])
+        if port is None:
+            errors.append(f'"{entry["port"]}" is not a valid port number')
+        elif port in ports:
+            errors.append(f'port {port} is declared twice')
+        else:
+            ports[port] = entry['protocol']
+
+    paths = set()
+    for route in spec['service_routes']:
+        if not route['path'].startswith('/'):
+            errors.append(f'the path of the route {route["path"]}:{route["port"]} should start with /')
+        if route['path'] in paths:
+            errors.append(f'the route {route["path"]} is declared twice')
+        paths.add(route['path'])
+        if route['port'] not in ports:
+            errors.append(f'the route {route["path"]} points at port {route["port"]}, which is not declared in --service-ports')
+        elif ports[route['port']] == 'tcp':
+            errors.append(f'the route {route["path"]} points at port {route["port"]}, which is a TCP port')
+
+    for check in spec['service_checks']:
+        if check['port'] not in ports:
+            errors.append(f'the {check["protocol"]} healthcheck on port {check["port"]} targets a port not declared in --service-ports')
+        if check['protocol'] == 'http' and not check['path'].startswith('/'):
+            errors.append(f'the path of the healthcheck {check["port"]}:http:{check["path"]} should start with /')
+
+    for env in spec['service_env']:
+        if not ENV_NAME.match(env['name']):
+            errors.append(f'"{env["name"]}" is not a valid name of environment variable')
+        if env['value'] == '@':
+            errors.append(f'the environment variable {env["name"]} references a secret without a name')
+
+    if not spec['service_regions']:
+        errors.append('no region set in --service-regions')
+    for region in spec['service_regions']:
+        if not SLUG.match(region):
+            errors.append(f'"{region}" is not a valid region')
+    if not SLUG.match(spec['service_instance_type'] or ''):
+        errors.append(f'"{spec["service_instance_type"]}" is not a valid instance type')
+
+    if not spec.get('docker') and not spec.get('git_url'):
+        errors.append('set either --docker or --git-url')
+    return errors
+
+
+def referenced_secrets(spec):
+    """Returns the names of the secrets referenced by the options `spec` of a
+    service."""
+    names = set()
+    for env in spec['service_env']:
+        if env['value'].startswith('@'):
+            names.add(env['value'][1:])
+        else:
+            names.update(SECRET_TEMPLATE.findall(env['value']))
+    if spec.get('docker_private_registry_secret'):
+        names.add(spec['docker_private_registry_secret'])
+    names.discard('')
+    return names
+
+
+def uses_default_placement(spec):
+    """Returns True if the service runs on the default instance type, in the
+    default regions."""
+    return (
+        spec['service_instance_type'] == DEFAULT_INSTANCE_TYPE
+        and set(spec['service_regions']) <= set(DEFAULT_REGIONS)
+    )
+
+
+def cached_catalog(kind, fetch):
+    """Returns the list `kind` of the catalog of Koyeb, from the state cache
+    or from `fetch`."""
+    state = get_client().state
+    listed = state.get('catalog', kind)
+    if listed is None:
+        listed = fetch()
+        if listed is not None:
+            state.put('catalog', kind, listed)
+    return listed
+
+
+def list_references(specs):
+    """Returns a dict with the secrets, regions and instance types of Koyeb
+    needed to check the options `specs` of the services, listed
+    concurrently. The value of a list which failed is the error, and None if
+    the list is not needed or if the client can't list it."""
+    client = get_client()
+    calls = {}
+    if any(referenced_secrets(spec) for spec in specs):
+        calls['secrets'] = client.secret_list
+    if not all(uses_default_placement(spec) for spec in specs):
+        calls['regions'] = lambda: cached_catalog('regions', client.catalog_regions)
+        calls['instance types'] = lambda: cached_catalog('instances', client.catalog_instances)
+
+    references = {'secrets': None, 'regions': None, 'instance types': None}
+    if not calls:
+        return references
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        futures = {pool.submit(call): name for name, call in calls.items()}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                references[futures[future]] = future.result()
+            except KoyebError as exc:
+                references[futures[future]] = exc
+    return references
+
+
+def reference_errors(spec, references):
+    """Returns the references of the options `spec` of a service to
+    resources missing from the lists of list_references(). The lists which
+    are not available are skipped."""
+    errors = []
+
+    def check(kind, wanted, describe):
+        listed = references[kind]
+        if listed is None or isinstance(listed, Exception):
+            return None
+        available = {item.get('id') for item in listed} | {item.get('name') for item in listed}
+        errors.extend(describe(name) for name in sorted(wanted - available))
+        return listed
+
+    check('secrets', referenced_secrets(spec), lambda name: f'the secret {name} does not exist')
+    check('regions', set(spec['service_regions']), lambda name: f'the region {name} does not exist')
+    instances = check(
+        'instance types', {spec['service_instance_type']}, lambda name: f'the instance type {name} does not exist',
+    )
+
+    for instance in instances or []:
+        if spec['service_instance_type'] in (instance.get('id'), instance.get('name')) and instance.get('regions'):
+            for region in sorted(set(spec['service_regions']) - set(instance['regions'])):
+                errors.append(f'the instance type {spec["service_instance_type"]} is not available in the region {region}')
+    return errors
+
+
+def preflight_enabled():
+    return argparse_to_bool(os.environ.get('KOYEB_PREFLIGHT') or 'true')
+
+
+@traced()
+def preflight(specs):
+    """Checks the options of the services of the dict `specs`, by service
+    name. Raises PreflightError listing all the errors found. Does nothing if
+    KOYEB_PREFLIGHT is false."""
+    if not specs or not preflight_enabled():
+        return
+    start = time.monotonic()
+    errors = {name: definition_errors(spec) for name, spec in specs.items()}
+    references = list_references(specs.values())
+    for kind, listed in references.items():
+        if isinstance(listed, Exception):
+            print(f'>> Warning: unable to check the {kind}: {str(listed).splitlines()[0]}')
+    for name, spec in specs.items():
+        errors[name] += reference_errors(spec, references)
+
+    errors = {name: service_errors for name, service_errors in errors.items() if service_errors}
+    if errors:
+        raise PreflightError('Invalid service definition:\n' + '\n'.join(
+            f'  - {name}: {error}' for name, service_errors in errors.items() for error in service_errors
+        ))
+    print(f'>> Pre-flight checks of {", ".join(specs)} passed in {time.monotonic() - start:.2f}s')
@@ -0,0 +1,244 @@
+"""Profile of the phases of a deployment, and their trend over the last runs.
+
+While following a deployment, the time at which each status is first seen is
+recorded, and the steps of the build (clone, buildpack detection, cache
+restore, build, export and push) are detected in the build logs as they are
+received. The duration of every phase is reported at the end.
+
+Set KOYEB_PROFILE_HISTORY to the path of a file, for example kept with
+actions/cache, to remember the profiles of the last KOYEB_PROFILE_RUNS
+deployments (20 by default) of every service. Every phase is then compared
+with its median over these deployments, and the phases which became much
+slower, such as a build slowed down by a new dependency, are reported. The
+scripts following the same deployment one after the other (build logs, then
+health) complete the same entry of the history.
+"""
+
+import json
+import os
+import re
+import statistics
+import threading
+import time
+
+from koyeb_github import github_step_summary, markdown_table
+from koyeb_utils import parse_time
+from koyeb_wait import FAILED_STATUSES
+
+DEFAULT_RUNS = 20
+
+# A phase is a regression when it is both REGRESSION_FACTOR times slower
+# than its median, and REGRESSION_MIN_SECONDS slower.
+REGRESSION_FACTOR = 1.5
+REGRESSION_MIN_SECONDS = 10
+
+# Steps are matched with the newline before them, which is found much faster
+# than the beginning of a line.
+BUILD_STEPS = re.compile(
+    rb'\n(?:\x1b\[[0-9;]*m)*(?:'
+    rb'(?P<clone>(?i:cloning|fetching|checking out)\b)'
+    rb'|(?P<analyze>===> ANALYZING)'
+    rb'|(?P<detect>===> DETECTING)'
+    rb'|(?P<restore>===> RESTORING)'
+    rb'|(?P<build>===> BUILDING|Step \d+/\d+ : |#\d+ \[[^\]\n]+\] )'
+    rb'|(?P<export>===> EXPORTING|#\d+ exporting to image)'
+    rb'|(?P<push>#\d+ pushing |(?i:pushing |saving )\S+/)'
+    rb')'
+)
+
+
+class BuildSteps:
+    """Detects the steps of a build in its logs, fed in arbitrary chunks, and
+    records the time at which every step is first seen. Steps are timed when
+    their logs are received, so logs replayed long after the build give
+    meaningless durations."""
+
+    def __init__(self):
+        self.seen = {}
+        self._partial = b'\n'
+
+    def feed(self, chunk):
+        data = self._partial + chunk
+        end = data.rfind(b'\n')
+        self._partial = data[end:]
+        now = time.time()
+        for match in BUILD_STEPS.finditer(data, 0, end):
+            self.seen.setdefault(match.lastgroup, now)
+
+
+class DeploymentProfile:
+    """Times at which a deployment reached each status and each step of its
+    build."""
+
+    def __init__(self, deployment_id):
+        self.deployment_id = deployment_id
+        self.service_id = None
+        self.created_at = None
+        self.statuses = {}
+        self.build_steps = BuildSteps()
+
+    def on_status(self, info):
+        """Records the status of `info`, the info of the deployment, if it is
+        new."""
+        self.service_id = self.service_id or info.get('service_id')
+        if self.created_at is None and isinstance(info.get('created_at'), str):
+            self.created_at = parse_time(info['created_at'])
+        self.statuses.setdefault(info['status'], time.time())
+
+    def entry(self):
+        """Returns the profile as an entry of the history: the times of the
+        statuses and of the build steps, in seconds since the creation of the
+        deployment (or since it was first seen). Returns None if nothing was
+        recorded."""
+        times = {**self.statuses, **{f'build:{name}': at for name, at in self.build_steps.seen.items()}}
+        if not times:
+            return None
+        start = self.created_at or min(times.values())
+        marks = {name: round(max(0, at - start), 1) for name, at in times.items()}
+        # A deployment is PENDING as soon as it is created.
+        if 'PENDING' in marks and self.created_at is not None:
+            marks['PENDING'] = 0
+        return {'id': self.deployment_id, 'at': round(start, 1), 'marks': marks}
+
+
+def phase_durations(marks):
+    """Returns the duration of every phase of the `marks` of an entry, in
+    order: the statuses, the steps of the build, then the total time until the
+    deployment reached its final status. The phase running when the profile
+    stopped has no duration."""
+    statuses = sorted((at, name) for name, at in marks.items() if not name.startswith('build:'))
+    steps = sorted((at, name) for name, at in marks.items() if name.startswith('build:'))
+
+    durations = {}
+    for (at, name), (end, _) in zip(statuses, statuses[1:]):
+        durations[name] = end - at
+
+    build_end = None
+    if 'PROVISIONING' in marks:
+        build_end = min((at for at, _ in statuses if at > marks['PROVISIONING']), default=None)
+    for (at, name), (end, _) in zip(steps, steps[1:] + [(build_end, None)]):
+        if end is not None:
+            durations[name] = end - at
+
+    final = [at for at, name in statuses if name == 'HEALTHY' or name in FAILED_STATUSES]
+    if final:
+        durations['total'] = final[0]
+    return durations
+
+
+def merge_entries(first, second):
+    """Returns the entry combining the marks of two entries of the same
+    deployment, keeping the earliest time of every mark."""
+    at = min(first['at'], second['at'])
+    marks = {}
+    for entry in (first, second):
+        for name, offset in entry['marks'].items():
+            offset = round(offset + entry['at'] - at, 1)
+            marks[name] = min(offset, marks.get(name, offset))
+    return {**second, 'at': at, 'marks': marks}
+
+
+_history_lock = threading.Lock()
+
+
+class ProfileHistory:
+    """Entries of the last `runs` deployments of every service, in the JSON
+    file at `path`. Without `path`, nothing is remembered."""
+
+    def __init__(self, path=None, *, runs=DEFAULT_RUNS):
+        self.path = path or None
+        self.runs = runs
+
+    @classmethod
+    def from_environment(cls):
+        runs = int(os.environ.get('KOYEB_PROFILE_RUNS') or DEFAULT_RUNS)
+        return cls(os.environ.get('KOYEB_PROFILE_HISTORY'), runs=runs)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                content = json.load(f)
+            if content.get('version') == 1:
+                return content
+        except (FileNotFoundError, ValueError):
+            pass
+        return {'version': 1, 'services': {}}
+
+    def add(self, service, entry):
+        """Adds `entry` to the entries of `service`, or merges it with the
+        entry of the same deployment recorded by a previous script. Returns a
+        tuple (merged entry, entries of the previous deployments)."""
+        if not self.enabled:
+            return entry, []
+        with _history_lock:
+            content = self._load()
+            entries = content['services'].setdefault(service, [])
+            previous = [e for e in entries if e['id'] != entry['id']]
+            for e in entries:
+                if e['id'] == entry['id']:
+                    entry = merge_entries(e, entry)
+            content['services'][service] = (previous + [entry])[-self.runs:]
+
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(content, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        return entry, previous[-self.runs:]
+
+
+def format_seconds(seconds):
+    return f'{seconds:.1f}s' if seconds is not None else '-'
+
+
+def trend_report(durations, previous):
+    """Returns a tuple (markdown table, list of regressions) comparing the
+    `durations` of the phases of a deployment with the durations of the
+    `previous` deployments."""
+    if not previous:
+        rows = [(phase, format_seconds(duration)) for phase, duration in durations.items()]
+        return markdown_table(['Phase', 'Duration'], rows), []
+
+    rows = []
+    regressions = []
+    for phase, duration in durations.items():
+        values = [d[phase] for d in previous if phase in d]
+        median = statistics.median(values) if values else None
+        change = ''
+        if median:
+            change = f'{(duration - median) / median:+.0%}'
+            if duration > median * REGRESSION_FACTOR and duration - median >= REGRESSION_MIN_SECONDS:
+                regressions.append(f'{phase} took {format_seconds(duration)}, {change} compared to the median of {format_seconds(median)}')
+                change = f'**{change}**'
+        rows.append((
+            phase, format_seconds(duration), format_seconds(median),
+            format_seconds(min(values, default=None)), format_seconds(max(values, default=None)), change,
+        ))
+    headers = ['Phase', 'Duration', f'Median of last {len(previous)}', 'Min', 'Max', 'Change']
+    return markdown_table(headers, rows), regressions
+
+
+def report_profile(profile, *, prefix=''):
+    """Prints the duration of the phases of the deployment, and adds it to the
+    summary of the job. With KOYEB_PROFILE_HISTORY, the profile is added to
+    the history and compared with the previous deployments of the service."""
+    entry = profile.entry()
+    if entry is None:
+        return
+    entry, previous = ProfileHistory.from_environment().add(profile.service_id or 'unknown', entry)
+    durations = phase_durations(entry['marks'])
+    if not durations:
+        return
+
+    table, regressions = trend_report(durations, [phase_durations(e['marks']) for e in previous])
+    print(f'{prefix}>>>> Phases of deployment {profile.deployment_id}:')
+    print('\n'.join(f'{prefix}{line}' for line in table.splitlines()))
+    summary = f'### Phases of deployment {profile.deployment_id}\n\n{table}'
+    if regressions:
+        for regression in regressions:
+            print(f'{prefix}Warning: slower phase: {regression}')
+        summary += '\n\n#### Slower phases\n\n' + '\n'.join(f'- {regression}' for regression in regressions)
+    github_step_summary(summary)
@@ -0,0 +1,160 @@
+"""Rate limiting and retries of the calls to Koyeb, shared by all the threads
+of the process.
+
+Every call first takes a token from a single token bucket, refilled at
+KOYEB_RATE_LIMIT calls per second (20 by default, 0 to disable it), so
+concurrent deployments or secret writes don't burst over the rate limits of
+the organization. When Koyeb answers 429 Too Many Requests anyway, the bucket
+is paused for the duration of the Retry-After header: every thread waits, not
+only the one which was throttled.
+
+A call failing with a transient error is retried up to KOYEB_MAX_RETRIES
+times (5 by default), with a capped exponential backoff and a random jitter.
+The clients decide which errors are transient (see koyeb_client).
+"""
+
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+
+from koyeb_trace import get_tracer
+
+DEFAULT_RATE_LIMIT = 20
+DEFAULT_MAX_RETRIES = 5
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, and bursts of `burst`
+    calls. A `rate` of 0 disables the limit, but pauses are still honored.
+    Shared by threads."""
+
+    def __init__(self, rate, *, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Makes every caller of acquire() wait for `seconds`."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        """Waits until a call is allowed, and returns the number of seconds
+        waited."""
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if not self.rate:
+                        return waited
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class Retrier:
+    """Runs calls through the token bucket `bucket`, and retries them on
+    transient errors. `counters` holds the number of calls, of retries, of
+    calls which were rate limited by Koyeb, of calls which failed after all
+    their retries, and the time spent waiting for the bucket."""
+
+    def __init__(self, bucket, *, max_retries=DEFAULT_MAX_RETRIES, base_delay=0.5, max_delay=30):
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.counters = {'calls': 0, 'retries': 0, 'rate_limited': 0, 'gave_up': 0, 'throttled_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def backoff(self, attempt):
+        """Returns the delay before the retry number `attempt` (starting at
+        1): a random delay up to an exponentially growing cap."""
+        return random.uniform(self.base_delay / 2, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func, *, operation, is_transient):
+        """Returns func(). If it raises an exception for which
+        is_transient(exc) is True, it is called again after a delay: the
+        Retry-After delay of the error (its `retry_after` attribute) if set, a
+        backoff otherwise."""
+        attempt = 0
+        while True:
+            self._count('throttled_seconds', self.bucket.acquire())
+            self._count('calls')
+            try:
+                return func()
+            except Exception as exc:
+                if not is_transient(exc):
+                    raise
+                if attempt >= self.max_retries:
+                    self._count('gave_up')
+                    raise
+                attempt += 1
+                self._count('retries')
+
+                status = getattr(exc, 'status', None)
+                retry_after = getattr(exc, 'retry_after', None)
+                delay = min(self.max_delay, retry_after) if retry_after is not None else self.backoff(attempt)
+                reason = f'HTTP {status}' if status else str(exc).splitlines()[0]
+                sys.stderr.write(
+                    f'>> {operation} failed ({reason}), retry {attempt}/{self.max_retries} in {delay:.1f}s\n'
+                )
+                with get_tracer().span(operation, 'retry', attempt=attempt, reason=reason):
+                    if status == 429:
+                        # The whole process is over the rate limit.
+                        self._count('rate_limited')
+                        self.bucket.pause(delay)
+                    else:
+                        time.sleep(delay)
+
+    def report(self):
+        """Returns a line describing the retries, or None if there was none."""
+        counters = dict(self.counters)
+        if not counters['retries'] and counters['throttled_seconds'] < 1:
+            return None
+        return (
+            f'{counters["calls"]} calls to Koyeb, {counters["retries"]} retries '
+            f'({counters["rate_limited"]} rate limited, {counters["gave_up"]} failed after all retries), '
+            f'{counters["throttled_seconds"]:.1f}s throttled'
+        )
+
+
+_retrier = None
+_retrier_lock = threading.Lock()
+
+
+def _report():
+    report = _retrier.report()
+    if report:
+        sys.stderr.write(f'>> {report}\n')
+
+
+def get_retrier():
+    """Returns the retrier shared by the whole process, configured with the
+    KOYEB_RATE_LIMIT and KOYEB_MAX_RETRIES environment variables. Its
+    counters are reported when the process exits."""
+    global _retrier
+
+    with _retrier_lock:
+        if _retrier is None:
+            rate = float(os.environ.get('KOYEB_RATE_LIMIT') or DEFAULT_RATE_LIMIT)
+            max_retries = int(os.environ.get('KOYEB_MAX_RETRIES') or DEFAULT_MAX_RETRIES)
+            _retrier = Retrier(TokenBucket(rate), max_retries=max_retries)
+            atexit.register(_report)
+        return _retrier
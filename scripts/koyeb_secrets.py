@@ -0,0 +1,160 @@
+"""Synchronization of many Koyeb secrets at once.
+
+The existing secrets are listed once, to tell which secrets must be created
+and which must be updated. Koyeb never returns the value of a secret, so the
+values written by a previous synchronization are remembered as keyed hashes
+in a local file or in the state cache (see koyeb_state): secrets whose value
+didn't change are not written again. Secrets are then created and updated
+concurrently.
+"""
+
+import concurrent.futures
+import hashlib
+import hmac
+import json
+import os
+import secrets as random_secrets
+import sys
+
+from koyeb_client import KoyebAlreadyExists, get_client
+from koyeb_service import parse_dotenv
+from koyeb_trace import traced
+
+
+def parse_secrets(content):
+    """Returns a dict {name: value} from a JSON object, or from a dotenv file
+    (see koyeb_service.parse_dotenv)."""
+    if content.lstrip().startswith('{'):
+        return {name: str(value) for name, value in json.loads(content).items()}
+    try:
+        return parse_dotenv(content)
+    except ValueError as exc:
+        raise ValueError(f'{exc} in the secrets file')
+
+
+def read_secrets_file(path):
+    """Reads the secrets of the file at `path`, or of stdin if `path` is
+    "-"."""
+    if path == '-':
+        return parse_secrets(sys.stdin.read())
+    with open(path) as f:
+        return parse_secrets(f.read())
+
+
+class SecretHashes:
+    """Hashes of the values of the secrets written by this action, stored in
+    the JSON file at `path`, or else in the state cache `state`. A secret is
+    unchanged if the hash of its value matches, and if it hasn't been modified
+    since it was written, according to its updated_at field.
+
+    The hashes are keyed with a random key stored in the same file, so the file
+    must be kept as private as the secrets. Without `path` nor an enabled
+    state cache, nothing is remembered and every secret is written."""
+
+    def __init__(self, path=None, *, state=None):
+        self.path = path
+        self.state = state if state is not None and state.enabled and not path else None
+        self.key = None
+        self.hashes = {}
+
+        content = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                content = json.load(f)
+        elif self.state:
+            # The hashes are checked against the updated_at of the secrets, so
+            # they never expire.
+            content = self.state.get('secrets', 'hashes', ttl=float('inf'))
+        if content:
+            self.key = bytes.fromhex(content['key'])
+            self.hashes = content['secrets']
+        if self.key is None:
+            self.key = random_secrets.token_bytes(32)
+
+    def digest(self, name, value):
+        return hmac.new(self.key, f'{name}\0{value}'.encode(), hashlib.sha256).hexdigest()
+
+    def unchanged(self, name, value, secret):
+        known = self.hashes.get(name)
+        return (
+            known is not None
+            and known['updated_at'] is not None
+            and known['updated_at'] == secret.get('updated_at')
+            and hmac.compare_digest(known['hash'], self.digest(name, value))
+        )
+
+    def record(self, name, value, secret):
+        self.hashes[name] = {'hash': self.digest(name, value), 'updated_at': secret.get('updated_at')}
+
+    def save(self):
+        if self.state:
+            self.state.put('secrets', 'hashes', {'key': self.key.hex(), 'secrets': self.hashes})
+        if not self.path:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({'key': self.key.hex(), 'secrets': self.hashes}, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def plan_secrets(secrets, existing, hashes):
+    """Returns three lists of names: the secrets to create, the secrets to
+    update and the unchanged secrets. `existing` maps the names of the secrets
+    of Koyeb to the secrets."""
+    create, update, unchanged = [], [], []
+    for name, value in secrets.items():
+        if name not in existing:
+            create.append(name)
+        elif hashes.unchanged(name, value, existing[name]):
+            unchanged.append(name)
+        else:
+            update.append(name)
+    return create, update, unchanged
+
+
+def write_secret(name, value, existing):
+    """Creates or updates the secret, and returns it. A secret created
+    concurrently by someone else is updated instead."""
+    client = get_client()
+    if existing is None:
+        try:
+            return client.secret_create(name, value)
+        except KoyebAlreadyExists:
+            pass
+    return client.secret_update(name, value, secret=existing)
+
+
+@traced()
+def sync_secrets(secrets, *, concurrency=8, hashes_path=None):
+    """Creates or updates the `secrets`, a dict {name: value}, at most
+    `concurrency` at a time. Raises an error listing the secrets which could
+    not be written."""
+    client = get_client()
+    existing = {secret['name']: secret for secret in client.secret_list()}
+    hashes = SecretHashes(hashes_path, state=client.state)
+    create, update, unchanged = plan_secrets(secrets, existing, hashes)
+    print(f'>> {len(create)} secrets to create, {len(update)} to update, {len(unchanged)} unchanged')
+
+    errors = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(write_secret, name, secrets[name], existing.get(name)): name
+            for name in create + update
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                response = future.result()
+            except Exception as exc:
+                errors[name] = exc
+                print(f'Error while writing the secret {name}:\n{exc}')
+                continue
+            # The CLI wraps the secret in an object, the API client doesn't.
+            secret = (response or {}).get('secret', response or {})
+            hashes.record(name, secrets[name], secret)
+            print(f'Secret {name} {"created" if name in create else "updated"}.')
+
+    hashes.save()
+    if errors:
+        raise RuntimeError(f'Some secrets could not be written: {", ".join(sorted(errors))}')
+    return create, update, unchanged
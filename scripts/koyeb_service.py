@@ -0,0 +1,654 @@
+"""Parsing of the service options of this action, and conversion to the
+arguments of the koyeb CLI or to a service definition of the Koyeb API.
+
+The environment, regions, ports, routes and healthchecks can also be read from
+a file set with --service-config, which doesn't suffer from the limits of the
+command line: a dotenv file, with the environment variables only, or a JSON or
+YAML file:
+
+    regions: [fra, was]
+    env:
+      PORT: "8000"
+      DATABASE_URL: "@DATABASE_URL"
+    ports: ["8000:http"]
+    routes: ["/:8000", {path: /api, port: 8000}]
+    checks: ["8000:http:/health"]
+
+Entries are strings with the syntax of the command line options, or objects
+with the fields of the service definition.
+"""
+
+import argparse
+import hashlib
+import json
+import shlex
+
+
+def argparse_to_subprocess_params(value):
+    """Given a string (e.g. 'cat -te "superfile with spaces.txt"), returns a
+    list of params that can be passed to subprocess."""
+    return shlex.split(value)
+
+
+def argparse_to_regions(value):
+    regions = []
+
+    for part in value.split(','):
+        if not part:
+            continue
+
+        regions.append(part)
+    return regions
+
+
+def argparse_to_paths(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def argparse_to_env(value):
+    env = []
+
+    for part in value.split(','):
+        if not part:
+            continue
+
+        name, _, value = part.partition('=')
+        env.append({'name': name, 'value': value})
+    return env
+
+
+def parse_dotenv(content):
+    """Returns a dict {name: value} from lines `NAME=value`, where blank
+    lines and lines starting with # are ignored, and values may be quoted."""
+    variables = {}
+    for number, line in enumerate(content.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('export '):
+            line = line[len('export '):]
+        name, sep, value = line.partition('=')
+        if not sep or not name.strip():
+            raise ValueError(f'Line {number} should be NAME=value')
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"':
+            value = value[1:-1]
+        variables[name.strip()] = value
+    return variables
+
+
+def argparse_to_ports(value):
+    errmsg = 'should be formed as <port>:http or <port>:http2 separated by commas'
+    ports = []
+
+    for r in value.split(','):
+        if not r:
+            continue
+
+        try:
+            port, protocol = r.split(':')
+        except ValueError:
+            raise argparse.ArgumentTypeError(errmsg)
+
+        if protocol not in ('http', 'http2', 'tcp'):
+            raise argparse.ArgumentTypeError(
+                f'{errmsg} and "{protocol}" is not a valid protocol')
+
+        ports.append({'port': port, 'protocol': protocol})
+    return ports
+
+
+def argparse_to_routes(value):
+    errmsg = 'should be formed as <PATH>:<port> separated by commas'
+    routes = []
+
+    for r in value.split(','):
+        if not r:
+            continue
+
+        try:
+            path, port = r.split(':')
+        except ValueError:
+            raise argparse.ArgumentTypeError(errmsg)
+
+        try:
+            port = int(port)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f'{errmsg} and "{port}" is not a valid port')
+
+        routes.append({'path': path, 'port': port})
+    return routes
+
+
+def argparse_to_healthchecks(value):
+    errmsg = 'should be formed as <port>:http:<path> or <port>:tcp separated by commas'
+    healthchecks = []
+
+    for r in value.split(','):
+        if not r:
+            continue
+
+        parts = r.split(':')
+
+        if (
+            len(parts) not in (2, 3)
+            or (len(parts) == 2 and parts[1] != 'tcp')
+            or (len(parts) == 3 and parts[1] != 'http')
+        ):
+            raise argparse.ArgumentTypeError(errmsg)
+
+        try:
+            port = int(parts[0])
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f'{errmsg} and "{parts[0]}" is not a valid port')
+
+        if parts[1] == 'http':
+            healthchecks.append(
+                {'port': port, 'protocol': 'http', 'path': parts[2]}
+            )
+        else:
+            healthchecks.append({'port': port, 'protocol': 'tcp'})
+    return healthchecks
+
+
+def argparse_to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif value.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
+def _config_entries(config, key, parse, to_option):
+    """Returns the entries of the list config[key], parsed with the parser
+    `parse` of the equivalent command line option. Objects are converted to
+    the syntax of the option with `to_option`."""
+    entries = config[key]
+    if not isinstance(entries, list):
+        raise ValueError(f'"{key}" should be a list')
+    parsed = []
+    for entry in entries:
+        try:
+            parsed += parse(to_option(entry) if isinstance(entry, dict) else str(entry))
+        except (KeyError, argparse.ArgumentTypeError) as exc:
+            raise ValueError(f'invalid entry {entry!r} of "{key}": {exc}')
+    return parsed
+
+
+def _config_env(env):
+    if isinstance(env, dict):
+        return [
+            {'name': str(name), 'value': str(value).lower() if isinstance(value, bool) else str(value)}
+            for name, value in env.items()
+        ]
+    if not isinstance(env, list):
+        raise ValueError('"env" should be an object or a list of "NAME=value"')
+    variables = []
+    for entry in env:
+        if isinstance(entry, dict):
+            if 'secret' in entry:
+                variables.append({'name': entry['key'], 'value': f'@{entry["secret"]}'})
+            else:
+                variables.append({'name': entry.get('key', entry.get('name')), 'value': str(entry.get('value', ''))})
+        else:
+            name, sep, value = str(entry).partition('=')
+            if not sep:
+                raise ValueError(f'invalid entry {entry!r} of "env": should be NAME=value')
+            variables.append({'name': name, 'value': value})
+    return variables
+
+
+def load_service_config(path):
+    """Returns the options of the service set by the file at `path`, as a
+    dict with the keys of the parsed command line options. Raises ValueError
+    if the file is invalid."""
+    with open(path) as f:
+        content = f.read()
+
+    if path.endswith('.json'):
+        config = json.loads(content)
+    elif path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(f'PyYAML is required to read {path}. Install it or use a JSON file.')
+        config = yaml.safe_load(content) or {}
+    else:
+        return {'service_env': [{'name': name, 'value': value} for name, value in parse_dotenv(content).items()]}
+
+    if not isinstance(config, dict):
+        raise ValueError('the file should contain an object')
+    unknown = set(config) - {'env', 'regions', 'ports', 'routes', 'checks'}
+    if unknown:
+        raise ValueError(f'unknown keys {", ".join(sorted(unknown))}')
+    return service_config_options(config)
+
+
+def service_config_options(config):
+    """Returns the options of the service set by the keys env, regions,
+    ports, routes and checks of `config`, as a dict with the keys of the
+    parsed command line options. Every entry of the lists is parsed on its
+    own, so the value of an environment variable may contain commas. Raises
+    ValueError if an entry is invalid."""
+    options = {}
+    if 'env' in config:
+        options['service_env'] = _config_env(config['env'])
+    if 'regions' in config:
+        options['service_regions'] = _config_entries(config, 'regions', argparse_to_regions, str)
+    if 'ports' in config:
+        options['service_ports'] = _config_entries(
+            config, 'ports', argparse_to_ports, lambda port: f'{port["port"]}:{port.get("protocol", "http")}')
+    if 'routes' in config:
+        options['service_routes'] = _config_entries(
+            config, 'routes', argparse_to_routes, lambda route: f'{route["path"]}:{route["port"]}')
+    if 'checks' in config:
+        options['service_checks'] = _config_entries(
+            config, 'checks', argparse_to_healthchecks,
+            lambda check: (
+                f'{check["port"]}:http:{check["path"]}' if check.get('protocol', 'http') == 'http' else f'{check["port"]}:tcp'
+            ),
+        )
+    return options
+
+
+def apply_service_config(parser, args):
+    """Merges the options of the file of --service-config into `args`. The
+    environment variables of the file are added to the ones of --service-env,
+    and replace them if they have the same name. The other sections replace
+    the corresponding command line options. The environment is deduplicated
+    by name, the last value winning."""
+    if args.service_config:
+        try:
+            config = load_service_config(args.service_config)
+        except (OSError, ValueError) as exc:
+            parser.error(f'--service-config {args.service_config}: {exc}')
+        if 'service_env' in config:
+            config['service_env'] = args.service_env + config['service_env']
+        for key, value in config.items():
+            setattr(args, key, value)
+
+    args.service_env = [
+        {'name': name, 'value': value}
+        for name, value in {env['name']: env['value'] for env in args.service_env}.items()
+    ]
+
+
+def service_common_args(
+    *,
+    service_instance_type, service_regions, service_env, service_ports, service_routes, service_checks, service_type,
+    docker, docker_entrypoint, docker_command, docker_private_registry_secret,
+    git_url, git_workdir, git_branch, git_sha,
+    git_build_command, git_run_command,
+    git_builder,
+    git_docker_command, git_docker_dockerfile, git_docker_entrypoint, git_docker_target,
+    privileged, skip_cache,
+    **kwargs
+):
+    """Arguments common to service create and service update."""
+    params = []
+
+    if docker:
+        params += [
+            '--docker', docker,
+        ]
+        if not docker_entrypoint:
+            params += ['--docker-entrypoint', '']
+        else:
+            for part in docker_entrypoint:
+                params += ['--docker-entrypoint', part]
+        if not docker_command:  # erase existing command and args
+            params += ['--docker-command', '']
+            params += ['--docker-args', '']
+        else:
+            params += ['--docker-command', docker_command[0]]
+            for part in docker_command[1:]:
+                params += ['--docker-args', part]
+        params += [
+            '--docker-private-registry-secret', docker_private_registry_secret
+        ]
+
+    else:
+        params += [
+            '--git', git_url,
+            '--git-workdir', git_workdir,
+            '--git-branch', git_branch,
+            '--git-sha', git_sha,
+            '--git-no-deploy-on-push',
+        ]
+        if git_builder == 'buildpack':
+            params += [
+                '--git-builder', 'buildpack',
+                '--git-build-command', git_build_command,
+                '--git-run-command', git_run_command,
+            ]
+        else:
+            params += ['--git-builder', 'docker']
+            if not git_docker_command:  # erase existing command and args
+                params += ['--git-docker-command', '']
+                params += ['--git-docker-args', '']
+            else:
+                params += ['--git-docker-command', git_docker_command[0]]
+                for part in git_docker_command[1:]:
+                    params += ['--git-docker-args', part]
+            params += ['--git-docker-dockerfile', git_docker_dockerfile]
+            params += ['--git-docker-target', git_docker_target]
+            if not git_docker_entrypoint:
+                params += ['--git-docker-entrypoint', '']
+            else:
+                for part in git_docker_entrypoint:
+                    params += ['--git-docker-entrypoint', part]
+
+    params += ['--type', service_type]
+    params += ['--instance-type', service_instance_type]
+    for region in service_regions:
+        params += ['--regions', region]
+    for env in service_env:
+        params += ['--env', f'{env["name"]}={env["value"]}']
+    for port in service_ports:
+        params += ['--ports', f'{port["port"]}:{port["protocol"]}']
+    for route in service_routes:
+        params += ['--routes', f'{route["path"]}:{route["port"]}']
+    for check in service_checks:
+        params += [
+            '--checks',
+            f'{check["port"]}:{check["protocol"]}:{check["path"]}' if check["protocol"] == 'http' else f'{check["port"]}:{check["protocol"]}'
+        ]
+    params += [f'--privileged={"true" if privileged else "false"}']
+    params += [f'--skip-cache={"true" if skip_cache else "false"}']
+    return params
+
+
+def service_definition(
+    *,
+    service_name,
+    service_instance_type, service_regions, service_env, service_ports, service_routes, service_checks, service_type,
+    docker, docker_entrypoint, docker_command, docker_private_registry_secret,
+    git_url, git_workdir, git_branch, git_sha,
+    git_build_command, git_run_command,
+    git_builder,
+    git_docker_command, git_docker_dockerfile, git_docker_entrypoint, git_docker_target,
+    privileged, skip_cache,
+    **kwargs
+):
+    """Same as service_common_args, but returns the service definition expected
+    by the Koyeb API."""
+    definition = {
+        'name': service_name,
+        'type': service_type.upper(),
+        'regions': list(service_regions),
+        'instance_types': [{'type': service_instance_type}],
+        'env': [],
+        'ports': [
+            {'port': int(port['port']), 'protocol': port['protocol']}
+            for port in service_ports
+        ],
+        'routes': [
+            {'path': route['path'], 'port': route['port']}
+            for route in service_routes
+        ],
+        'health_checks': [],
+        'skip_cache': bool(skip_cache),
+    }
+
+    # Like the CLI, a value starting with @ is a reference to a secret.
+    for env in service_env:
+        if env['value'].startswith('@'):
+            definition['env'].append({'key': env['name'], 'secret': env['value'][1:]})
+        else:
+            definition['env'].append({'key': env['name'], 'value': env['value']})
+
+    for check in service_checks:
+        if check['protocol'] == 'http':
+            definition['health_checks'].append({'http': {'port': check['port'], 'path': check['path']}})
+        else:
+            definition['health_checks'].append({'tcp': {'port': check['port']}})
+
+    if docker:
+        definition['docker'] = {
+            'image': docker,
+            'entrypoint': list(docker_entrypoint or []),
+            'command': docker_command[0] if docker_command else '',
+            'args': list(docker_command[1:]) if docker_command else [],
+            'image_registry_secret': docker_private_registry_secret or '',
+            'privileged': bool(privileged),
+        }
+    else:
+        definition['git'] = {
+            'repository': git_url,
+            'workdir': git_workdir or '',
+            'branch': git_branch,
+            'sha': git_sha or '',
+            'no_deploy_on_push': True,
+        }
+        if git_builder == 'buildpack':
+            definition['git']['buildpack'] = {
+                'build_command': git_build_command or '',
+                'run_command': git_run_command or '',
+                'privileged': bool(privileged),
+            }
+        else:
+            definition['git']['docker'] = {
+                'dockerfile': git_docker_dockerfile or '',
+                'entrypoint': list(git_docker_entrypoint or []),
+                'command': git_docker_command[0] if git_docker_command else '',
+                'args': list(git_docker_command[1:]) if git_docker_command else [],
+                'target': git_docker_target or '',
+                'privileged': bool(privileged),
+            }
+    return definition
+
+
+def _without_empty_values(value):
+    """Recursively removes the keys with an empty or false value, which the
+    API uses interchangeably with missing keys."""
+    if isinstance(value, dict):
+        value = {key: _without_empty_values(item) for key, item in value.items()}
+        return {key: item for key, item in value.items() if item not in (None, '', False, [], {})}
+    return value
+
+
+def normalize_definition(definition):
+    """Returns the fields of a service definition managed by this action, in a
+    form that doesn't depend on the order of the lists or on default values.
+    Lists are turned into dicts, so differences are reported per item."""
+    git = definition.get('git') or {}
+    docker = definition.get('docker') or {}
+
+    health_checks = {}
+    for check in definition.get('health_checks') or []:
+        if check.get('http'):
+            health_checks[str(check['http']['port'])] = f'http:{check["http"].get("path", "")}'
+        elif check.get('tcp'):
+            health_checks[str(check['tcp']['port'])] = 'tcp'
+
+    normalized = {
+        'type': definition.get('type'),
+        'regions': sorted(definition.get('regions') or []),
+        'instance_types': sorted(
+            instance_type['type'] for instance_type in definition.get('instance_types') or []
+        ),
+        'env': {
+            env['key']: f'@{env["secret"]}' if env.get('secret') else env.get('value', '')
+            for env in definition.get('env') or []
+        },
+        'ports': {
+            str(port['port']): port.get('protocol', 'http')
+            for port in definition.get('ports') or []
+        },
+        'routes': {
+            route['path']: int(route['port'])
+            for route in definition.get('routes') or []
+        },
+        'health_checks': health_checks,
+        'skip_cache': definition.get('skip_cache', False),
+        'git': {
+            'repository': git.get('repository'),
+            'branch': git.get('branch'),
+            'sha': git.get('sha'),
+            'workdir': git.get('workdir'),
+            'buildpack': git.get('buildpack'),
+            'docker': git.get('docker'),
+        },
+        'docker': docker,
+    }
+    return _without_empty_values(normalized)
+
+
+def _flatten(value, path=''):
+    if isinstance(value, dict) and value:
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f'{path}.{key}' if path else key))
+        return flat
+    return {path: value}
+
+
+def definition_diff(current, desired):
+    """Returns the differences between two service definitions, as a sorted
+    list of tuples (path, current value, desired value). A missing value is
+    None."""
+    current = _flatten(normalize_definition(current))
+    desired = _flatten(normalize_definition(desired))
+    return [
+        (path, current.get(path), desired.get(path))
+        for path in sorted(current.keys() | desired.keys())
+        if current.get(path) != desired.get(path)
+    ]
+
+
+def definition_hash(definition):
+    """Returns a hash of the fields of the definition managed by this
+    action, identical for definitions without differences."""
+    normalized = json.dumps(normalize_definition(definition), sort_keys=True)
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def is_pinned_source(definition):
+    """Returns True if deploying `definition` twice builds the same code: the
+    GIT commit or the docker image digest is explicitly set. Otherwise, the
+    branch or the tag may point to new code even if the definition didn't
+    change."""
+    if definition.get('git'):
+        return bool(definition['git'].get('sha'))
+    return '@sha256:' in (definition.get('docker') or {}).get('image', '')
+
+
+def add_service_arguments(parser):
+    """Adds the options of the service to create or update to `parser`."""
+    parser.add_argument("--privileged", type=argparse_to_bool, nargs='?',
+                        const=True, default=False,
+                        help="Whether to run the container in privileged mode or not")
+    parser.add_argument("--skip-cache", type=argparse_to_bool, nargs='?',
+                        const=True, default=False,
+                        help="Whether to skip the cache when building the application")
+    parser.add_argument("--service-type", choices=('web', 'worker'), required=True, help="Service type")
+    parser.add_argument("--force", type=argparse_to_bool, nargs='?',
+                        const=True, default=False,
+                        help="Whether to update the service even if its definition didn't change")
+    parser.add_argument("--cancel-superseded", type=argparse_to_bool, nargs='?',
+                        const=True, default=False,
+                        help="Once the service is updated, cancel its deployments still waiting or building an older source")
+
+    # Docker deployment
+    parser.add_argument('--docker', required=False,
+                        help='Docker image (only for docker deployments)')
+    parser.add_argument('--docker-entrypoint', required=False,
+                        help='Docker entrypoint (only for docker deployments)',
+                        type=argparse_to_subprocess_params)
+    parser.add_argument('--docker-command', required=False,
+                        help='Docker CMD (only for docker deployments)',
+                        type=argparse_to_subprocess_params)
+    parser.add_argument('--docker-private-registry-secret', required=False,
+                        default='',
+                        help='Docker secret in case you are using a private registry (only for docker deployments)')
+
+    # Git deployment
+    parser.add_argument('--git-url', required=False,
+                        help='URL of the GIT repository to deploy')
+    parser.add_argument('--git-workdir', required=False,
+                        help='Workdir, if the application to build is not in the root directory of the repository')
+    parser.add_argument('--git-branch', required=False,
+                        help='GIT branch to deploy')
+    parser.add_argument('--git-sha', required=False,
+                        help='GIT SHA to deploy')
+    parser.add_argument('--git-builder', required=False, choices=('buildpack', 'docker'),
+                        help='Type of builder to use')
+    parser.add_argument('--skip-unchanged-source', type=argparse_to_bool, nargs='?',
+                        const=True, default=False,
+                        help='Skip the deployment if only the GIT sha changed, and the files of the workdir and of --watch-paths are the same at both commits, according to the local clone')
+    parser.add_argument('--watch-paths', required=False, type=argparse_to_paths, default=[],
+                        help='Comma separated list of paths of the repository, outside of the workdir, the build depends on')
+
+    # Git deployment: buildpack builder options
+    parser.add_argument('--git-build-command', required=False,
+                        help='Command to build the application (only for git deployments with the buildpack builder)')
+    parser.add_argument('--git-run-command', required=False,
+                        help='Command to run the application (only for git deployments with the buildpack builder)')
+
+    # Git deployment: docker builder options
+    parser.add_argument('--git-docker-command', required=False,
+                        help='Docker CMD (only for git deployments with the docker builder)',
+                        type=argparse_to_subprocess_params)
+    parser.add_argument('--git-docker-dockerfile', required=False,
+                        help='Dockerfile path (only for git deployments with the docker builder)')
+    parser.add_argument('--git-docker-entrypoint', required=False,
+                        help='Docker entrypoint (only for git deployments with the docker builder)',
+                        type=argparse_to_subprocess_params)
+    parser.add_argument('--git-docker-target', required=False,
+                        help='Docker target (only for git deployments with the docker builder)')
+
+    # Service options
+    parser.add_argument('--service-instance-type', required=True,
+                        help='Type of instance to use to run the service')
+    parser.add_argument('--service-regions', required=True,
+                        help='Comma separated list of region identifiers to specify where the service should be deployed',
+                        type=argparse_to_regions)
+    parser.add_argument('--service-env', required=True,
+                        help='Comma separated list of <KEY>=<value> to specify the application environment',
+                        type=argparse_to_env)
+    parser.add_argument('--service-ports', required=True,
+                        help='Comma separated list of <KEY>=<value> to specify the ports to expose',
+                        type=argparse_to_ports)
+    parser.add_argument('--service-routes', required=True,
+                        help='Comma separated list of <path>:<port> to specify the routes to expose',
+                        type=argparse_to_routes)
+    parser.add_argument('--service-checks', required=True,
+                        help='Comma separated list of <port>:http:<path> or <port>:tcp to specify the service healthchecks',
+                        type=argparse_to_healthchecks)
+    parser.add_argument('--service-config', required=False,
+                        help='Dotenv file of environment variables, or JSON or YAML file of the env, regions, ports, routes and checks of the service')
+
+
+def check_mutual_exclusive_options(parser, args):
+    # If --docker-* options are set, --git-* options must not be set
+    if (
+        any([True for key, value in vars(args).items()
+            if key.startswith('docker') and value])
+        and
+        any([True for key, value in vars(args).items()
+            if key.startswith('git') and value])
+    ):
+        parser.error(
+            'Docker and GIT options are mutually exclusive. Set either --docker-* or --git-* options, not both.')
+
+    if args.git_builder == 'docker' and (
+        args.git_build_command or
+        args.git_run_command
+    ):
+        parser.error(
+            '--git-build-command and --git-run-command are only valid with the buildpack builder.'
+        )
+    elif args.git_builder == 'buildpack' and (
+        any([True for key, value in vars(args).items()
+            if key.startswith('git_docker') and value])
+    ):
+        parser.error(
+            '--git-docker-* arguments are only valid with the docker builder.'
+        )
+
+
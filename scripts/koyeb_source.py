@@ -0,0 +1,53 @@
+"""Hash of the sources of a service deployed from a GIT repository.
+
+The hash combines the GIT tree hashes of the workdir of the service and of the
+other paths its build depends on, read from the local clone of the repository.
+It only changes when a file under one of these paths changes, so a commit
+touching another service of a monorepo doesn't change it.
+"""
+
+import hashlib
+import subprocess
+
+
+class SourceHashError(Exception):
+    pass
+
+
+def _git(args, *, cwd=None):
+    try:
+        return subprocess.run(['git', *args], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise SourceHashError('git is not installed')
+
+
+def source_hash(rev, paths, *, cwd=None):
+    """Returns the hash of the trees of `paths` at the commit `rev`. Paths
+    are relative to the root of the repository, and "" is the root itself. A
+    missing path is part of the hash, so creating it changes the hash. Raises
+    SourceHashError if the commit is not available locally."""
+    proc = _git(['rev-parse', '--verify', '--quiet', f'{rev}^{{commit}}'], cwd=cwd)
+    if proc.returncode != 0:
+        raise SourceHashError(
+            f'the commit {rev} is not available in the local clone: {proc.stderr.decode().strip() or "unknown revision"}'
+        )
+    commit = proc.stdout.decode().strip()
+
+    digest = hashlib.sha256()
+    for path in sorted({path.strip('/') for path in paths}):
+        proc = _git(['rev-parse', '--verify', '--quiet', f'{commit}:{path}'], cwd=cwd)
+        tree = proc.stdout.decode().strip() if proc.returncode == 0 else 'missing'
+        digest.update(f'{path}\0{tree}\n'.encode())
+    return digest.hexdigest()
+
+
+def is_ancestor(rev, descendant, *, cwd=None):
+    """Returns True if the commit `rev` is an ancestor of the commit
+    `descendant`, or the same commit. Raises SourceHashError if one of them
+    is not available locally."""
+    proc = _git(['merge-base', '--is-ancestor', rev, descendant], cwd=cwd)
+    if proc.returncode not in (0, 1):
+        raise SourceHashError(
+            f'unable to compare the commits {rev} and {descendant}: {proc.stderr.decode().strip() or "unknown revision"}'
+        )
+    return proc.returncode == 0
@@ -0,0 +1,91 @@
+"""Cache of the state of Koyeb resources, kept between runs.
+
+The cache is a JSON file, enabled by setting KOYEB_STATE_CACHE to its path,
+for example to store it with actions/cache. It remembers the applications and
+services known to exist, the last definition deployed on each service and
+the domains of the applications, so that most lookups are skipped when the
+same environment is deployed again.
+
+Entries expire after KOYEB_STATE_CACHE_TTL seconds (6 hours by default), and
+callers drop them as soon as an API call contradicts them. Entries are stored
+per namespace, derived from the API URL and token, so organizations don't
+share entries.
+"""
+
+import json
+import os
+import threading
+import time
+
+DEFAULT_TTL = 6 * 60 * 60
+
+
+class StateCache:
+    """Entries grouped by kind ("apps", "services"...) and key. Every change
+    is written to the file at `path` right away. Without `path`, the cache is
+    always empty."""
+
+    def __init__(self, path=None, *, namespace='default', ttl=DEFAULT_TTL):
+        self.path = path or None
+        self.namespace = namespace
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._content = {'version': 1, 'namespaces': {}}
+        if self.path:
+            try:
+                with open(self.path) as f:
+                    content = json.load(f)
+                if content.get('version') == 1:
+                    self._content = content
+            except (FileNotFoundError, ValueError):
+                pass
+
+    @classmethod
+    def from_environment(cls, *, namespace):
+        ttl = float(os.environ.get('KOYEB_STATE_CACHE_TTL') or DEFAULT_TTL)
+        return cls(os.environ.get('KOYEB_STATE_CACHE'), namespace=namespace, ttl=ttl)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def _entries(self, kind):
+        namespace = self._content['namespaces'].setdefault(self.namespace, {})
+        return namespace.setdefault(kind, {})
+
+    def get(self, kind, key, *, ttl=None):
+        """Returns the entry, or None if it is unknown or older than `ttl`
+        seconds (by default, the TTL of the cache)."""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            entry = self._entries(kind).get(key)
+            if entry is None or time.time() - entry['at'] > ttl:
+                return None
+            return entry['value']
+
+    def put(self, kind, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries(kind)[key] = {'at': time.time(), 'value': value}
+            self._save()
+
+    def update(self, kind, key, **values):
+        """Updates some values of an entry that is still fresh. Does nothing
+        otherwise."""
+        value = self.get(kind, key)
+        if value is not None:
+            self.put(kind, key, {**value, **values})
+
+    def invalidate(self, kind, key):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._entries(kind).pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        tmp = f'{self.path}.tmp'
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(self._content, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
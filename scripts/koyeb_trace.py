@@ -0,0 +1,209 @@
+"""Timing of the stages of the action and of the calls made to Koyeb.
+
+Set KOYEB_TRACE to the path of a file to enable it. Every stage, every call
+to the API, every run of the koyeb CLI, every wait before a retry and every
+hedged call is recorded as a span, with its duration and its result. When the
+process exits, the spans are appended to the file in the Chrome trace event
+format (open it with https://ui.perfetto.dev or chrome://tracing), and a table
+of the time spent per operation is added to the summary of the job. Several
+scripts can append to the same file.
+"""
+
+import asyncio
+import atexit
+import contextlib
+import functools
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from koyeb_github import github_step_summary, markdown_table
+
+IDS = re.compile(r'/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def process_start_time():
+    """Returns the time at which the current process started, or None if it
+    is unknown. Only implemented on Linux."""
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def api_operation(method, path):
+    """Returns the name of the span of an API call: the IDs and the query
+    string are removed from the path, so calls to the same endpoint are
+    grouped together."""
+    return f'{method} {IDS.sub("/{id}", path.split("?", 1)[0])}'
+
+
+def is_error(args):
+    """Returns True if the arguments of a span report a failure: an
+    exception, a non-zero exit status or an HTTP error."""
+    return 'error' in args or args.get('exit_status', 0) != 0 or args.get('status', 0) >= 400
+
+
+class Tracer:
+    """Records spans, and writes them to the trace file at `path` when
+    flushed. Without `path`, nothing is recorded."""
+
+    def __init__(self, path=None):
+        self.path = path or None
+        self.pid = os.getpid()
+        self.process_name = os.path.basename(sys.argv[0]) or 'python'
+        self.events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+        self.start = process_start_time()
+
+        if self.enabled:
+            self._metadata('process_name', 0, self.process_name)
+            if self.start is not None:
+                self._record('process startup', 'process', self.start, time.time() - self.start, {})
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def _metadata(self, name, tid, value):
+        self.events.append({'name': name, 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': value}})
+
+    def _thread_id(self):
+        # Concurrent asyncio tasks run in the same thread, but their spans
+        # overlap: each task gets its own track.
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = task if task is not None else threading.current_thread()
+        if key not in self._threads:
+            self._threads[key] = len(self._threads) + 1
+            self._metadata('thread_name', self._threads[key], key.get_name() if task is not None else key.name)
+        return self._threads[key]
+
+    def _record(self, name, category, start, duration, args):
+        with self._lock:
+            self.events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': int(start * 1e6),
+                'dur': int(duration * 1e6),
+                'pid': self.pid,
+                'tid': self._thread_id(),
+                'args': args,
+            })
+
+    @contextlib.contextmanager
+    def span(self, name, category='stage', **args):
+        """Records the duration of the block. The block receives the dict of
+        the arguments of the span, to add its results. An exception raised by
+        the block is recorded as the "error" argument."""
+        if not self.enabled:
+            yield args
+            return
+
+        start = time.time()
+        begin = time.perf_counter()
+        try:
+            yield args
+        except BaseException as exc:
+            args.setdefault('error', type(exc).__name__)
+            raise
+        finally:
+            self._record(name, category, start, time.perf_counter() - begin, args)
+
+    def summary(self):
+        """Returns a markdown table of the time spent per operation."""
+        operations = {}
+        for event in self.events:
+            if event['ph'] != 'X':
+                continue
+            stats = operations.setdefault((event['cat'], event['name']), {'count': 0, 'errors': 0, 'total': 0, 'max': 0})
+            stats['count'] += 1
+            stats['errors'] += is_error(event['args'])
+            stats['total'] += event['dur'] / 1e6
+            stats['max'] = max(stats['max'], event['dur'] / 1e6)
+
+        rows = [
+            (
+                category, name, stats['count'], stats['errors'], f'{stats["total"]:.2f}s',
+                f'{stats["total"] / stats["count"]:.3f}s', f'{stats["max"]:.3f}s',
+            )
+            for (category, name), stats in sorted(operations.items(), key=lambda item: -item[1]['total'])
+        ]
+        table = markdown_table(['Type', 'Operation', 'Calls', 'Errors', 'Total', 'Mean', 'Max'], rows)
+        return f'### Timings of {self.process_name}\n\n{table}'
+
+    def flush(self):
+        """Appends the spans to the trace file, and their summary to the
+        summary of the job."""
+        if not self.enabled or not self.events:
+            return
+
+        if self.start is not None:
+            self._record(self.process_name, 'process', self.start, time.time() - self.start, {})
+        with self._lock:
+            events = []
+            try:
+                with open(self.path) as f:
+                    events = json.load(f)['traceEvents']
+            except (FileNotFoundError, ValueError, KeyError):
+                pass
+            events.extend(self.events)
+
+            tmp = f'{self.path}.{self.pid}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+            os.replace(tmp, self.path)
+
+        github_step_summary(self.summary())
+        self.events = []
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """Returns the tracer of the process, enabled if KOYEB_TRACE is set. The
+    spans are written when the process exits."""
+    global _tracer
+
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(os.environ.get('KOYEB_TRACE'))
+            atexit.register(_tracer.flush)
+        return _tracer
+
+
+def traced(name=None, category='stage'):
+    """Decorator recording a span for every call of the decorated function
+    or coroutine function."""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with get_tracer().span(span_name, category):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_tracer().span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
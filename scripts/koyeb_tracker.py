@@ -0,0 +1,169 @@
+"""Tracks the status of many deployments with few calls to Koyeb.
+
+Following every deployment on its own costs one `deployment get` call per
+deployment every few seconds, so deploying a manifest of dozens of services
+multiplies the calls. A single DeploymentTracker per event loop watches all
+the deployments followed, and refreshes all the deployments of the same
+application with one call listing its latest deployments: the number of
+calls grows with the number of applications, not of deployments.
+
+Every deployment keeps its own polling delay, given by its strategy (see
+koyeb_wait) from its status, so a deployment STARTING is still checked more
+often than one building. A tick lists the applications with a deployment
+due, and every deployment of the application found in the list is refreshed
+along the way. A deployment alone in its application, whose application is
+not known yet, or missing from the latest deployments of its application, is
+checked with `deployment get`.
+
+Only the changes of status are dispatched to the callback of the deployment.
+"""
+
+import asyncio
+import time
+import weakref
+
+from koyeb_client import get_client
+from koyeb_executor import get_executor
+from koyeb_wait import FAILED_STATUSES, AdaptiveBackoff
+
+# Latest deployments of an application listed on every tick.
+LIST_LIMIT = 100
+
+
+class Watch:
+    """A deployment watched by the tracker."""
+
+    def __init__(self, deployment_id, on_change, on_error, strategy):
+        self.deployment_id = deployment_id
+        self.on_change = on_change
+        self.on_error = on_error
+        self.strategy = strategy
+        self.app_id = None
+        self.info = None
+        self.polls_in_status = 0
+        self.due_at = 0
+
+
+class DeploymentTracker:
+    """Watches deployments until they are healthy or have failed. The
+    tracker runs in the event loop as long as deployments are watched."""
+
+    def __init__(self):
+        self._watches = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def watch(self, deployment_id, on_change, *, on_error=None, strategy=None):
+        """Calls `on_change` with the info of the deployment every time its
+        status changes, starting with its current status. If the deployment
+        can't be refreshed, `on_error` is called with the exception and the
+        deployment is no longer watched. Returns the Watch, to pass to
+        unwatch()."""
+        watch = Watch(deployment_id, on_change, on_error, strategy or AdaptiveBackoff())
+        self._watches.append(watch)
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return watch
+
+    def unwatch(self, watch):
+        if watch in self._watches:
+            self._watches.remove(watch)
+
+    def notify(self, deployment_id):
+        """Refreshes the deployment as soon as possible."""
+        for watch in self._watches:
+            if watch.deployment_id == deployment_id:
+                watch.due_at = 0
+                self._wakeup.set()
+
+    async def _run(self):
+        while self._watches:
+            self._wakeup.clear()
+            now = time.monotonic()
+            due = [watch for watch in self._watches if watch.due_at <= now]
+            if due:
+                await self._refresh(due)
+            if not self._watches:
+                return
+            delay = min(watch.due_at for watch in self._watches) - time.monotonic()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0, delay))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refresh(self, due):
+        by_app = {}
+        for watch in due:
+            by_app.setdefault(watch.app_id, []).append(watch)
+
+        refreshes = []
+        for app_id, watches in by_app.items():
+            if app_id is not None and sum(watch.app_id == app_id for watch in self._watches) > 1:
+                refreshes.append(self._refresh_app(app_id, watches))
+            else:
+                refreshes.extend(self._refresh_one(watch) for watch in watches)
+        await asyncio.gather(*refreshes)
+
+    async def _refresh_one(self, watch):
+        try:
+            info = await get_executor().run(
+                get_client().deployment_get, watch.deployment_id, operation='deployment get', hedge=True,
+            )
+        except Exception as exc:
+            self._fail(watch, exc)
+            return
+        self._update(watch, info)
+
+    async def _refresh_app(self, app_id, due):
+        try:
+            deployments = await get_executor().run(
+                get_client().app_deployments, app_id, LIST_LIMIT, operation='app deployments', hedge=True,
+            )
+        except Exception as exc:
+            for watch in due:
+                self._fail(watch, exc)
+            return
+
+        listed = {deployment['id']: deployment for deployment in deployments}
+        missing = []
+        for watch in [watch for watch in self._watches if watch.app_id == app_id]:
+            if watch.deployment_id in listed:
+                self._update(watch, listed[watch.deployment_id])
+            elif watch in due:
+                missing.append(watch)
+        await asyncio.gather(*(self._refresh_one(watch) for watch in missing))
+
+    def _update(self, watch, info):
+        if watch not in self._watches:
+            return
+        watch.app_id = info.get('app_id') or watch.app_id
+        if watch.info is None or info['status'] != watch.info['status']:
+            watch.polls_in_status = 0
+            watch.info = info
+            watch.on_change(info)
+        else:
+            watch.polls_in_status += 1
+
+        if info['status'] == 'HEALTHY' or info['status'] in FAILED_STATUSES:
+            self.unwatch(watch)
+        else:
+            watch.due_at = time.monotonic() + watch.strategy.next_delay(info['status'], watch.polls_in_status)
+
+    def _fail(self, watch, exc):
+        if watch not in self._watches:
+            return
+        self.unwatch(watch)
+        if watch.on_error:
+            watch.on_error(exc)
+
+
+_trackers = weakref.WeakKeyDictionary()
+
+
+def get_tracker():
+    """Returns the tracker of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _trackers:
+        _trackers[loop] = DeploymentTracker()
+    return _trackers[loop]
@@ -0,0 +1,22 @@
+"""Helpers shared by the modules of this directory, which don't depend on
+Koyeb."""
+
+import datetime
+import math
+import re
+
+
+def percentile(values, p):
+    """Returns the `p`th percentile of `values`, with the nearest-rank
+    method."""
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def parse_time(value):
+    """Returns the timestamp of a date of the API (RFC 3339, possibly with
+    nanoseconds), or None if it is not set."""
+    if not value:
+        return None
+    value = re.sub(r'(\.\d{6})\d+', r'\1', value.replace('Z', '+00:00'))
+    return datetime.datetime.fromisoformat(value).timestamp()
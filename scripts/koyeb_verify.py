@@ -0,0 +1,241 @@
+"""Verification of the endpoints of a deployed application.
+
+Once the deployment is healthy, the requests of an optional warm-up list are
+replayed, so the caches of the application are filled and its code is loaded
+before the first real user arrives. Then every route is probed concurrently on
+every domain of the application, and the latency percentiles of each route are
+compared to thresholds.
+
+The warm-up list is a text file with one request per line, "/path" or
+"METHOD /path", where blank lines and lines starting with # are ignored, or a
+JSON list of such strings.
+"""
+
+import concurrent.futures
+import http.client
+import json
+import time
+
+from koyeb_client import ConnectionPool
+from koyeb_github import github_step_summary, markdown_table
+from koyeb_service import argparse_to_bool
+from koyeb_trace import traced
+from koyeb_utils import percentile
+
+HEADERS = {'User-Agent': 'koyeb-action-git-deploy'}
+
+
+def parse_warmup(content):
+    """Returns the list of requests (method, path) of a warm-up list."""
+    if content.lstrip().startswith('['):
+        lines = json.loads(content)
+    else:
+        lines = [line.strip() for line in content.splitlines()]
+
+    requests = []
+    for line in lines:
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split(None, 1)
+        method, path = (parts[0].upper(), parts[1]) if len(parts) == 2 else ('GET', parts[0])
+        if not path.startswith('/'):
+            raise ValueError(f'The path of the warm-up request "{line}" should start with /')
+        requests.append((method, path))
+    return requests
+
+
+def read_warmup_file(path):
+    with open(path) as f:
+        return parse_warmup(f.read())
+
+
+class RouteStats:
+    """Latencies and errors of the requests sent to a route."""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+        self.first = None
+
+    def record(self, latency, status):
+        if self.first is None:
+            self.first = latency
+        if status is None or status >= 500:
+            self.errors += 1
+        else:
+            self.latencies.append(latency)
+        key = str(status) if status is not None else 'error'
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    @property
+    def count(self):
+        return len(self.latencies) + self.errors
+
+    @property
+    def error_rate(self):
+        return self.errors / self.count if self.count else 0
+
+    def percentile(self, p):
+        return percentile(self.latencies, p) if self.latencies else None
+
+
+class EndpointChecker:
+    """Sends requests to the base URLs, over one pool of keep-alive
+    connections per URL."""
+
+    def __init__(self, urls, *, concurrency=8, timeout=10):
+        self.pools = {url: ConnectionPool(url, maxsize=concurrency, timeout=timeout) for url in urls}
+        self.concurrency = concurrency
+
+    def send(self, url, method, path):
+        """Returns a tuple (latency in seconds, HTTP status), with a None
+        status if the request failed."""
+        start = time.perf_counter()
+        try:
+            status, _, _ = self.pools[url].request(method, path, headers=HEADERS)
+        except (http.client.HTTPException, OSError):
+            status = None
+        return time.perf_counter() - start, status
+
+    def run(self, requests, *, rounds=1):
+        """Sends every request of `requests`, a list of (url, method, path),
+        `rounds` times, and returns the RouteStats of each request. The first
+        round is sent before the others, so its latency is the cold one."""
+        stats = {request: RouteStats(f'{request[1]} {request[0]}{request[2]}') for request in requests}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for batch in ([requests], [requests] * (rounds - 1)):
+                futures = {
+                    pool.submit(self.send, *request): request
+                    for round_requests in batch for request in round_requests
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    stats[futures[future]].record(*future.result())
+        return list(stats.values())
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+
+def format_ms(seconds):
+    return f'{seconds * 1000:.0f}ms' if seconds is not None else '-'
+
+
+def report_table(stats):
+    """Returns the latencies of the routes as a markdown table."""
+    rows = []
+    for route in stats:
+        statuses = ', '.join(f'{status}: {count}' for status, count in sorted(route.statuses.items()))
+        rows.append((
+            route.name, route.count, route.errors, statuses, format_ms(route.first),
+            format_ms(route.percentile(50)), format_ms(route.percentile(95)),
+            format_ms(route.percentile(99)), format_ms(max(route.latencies, default=None)),
+        ))
+    return markdown_table(['Request', 'Count', 'Errors', 'Statuses', 'First', 'p50', 'p95', 'p99', 'Max'], rows)
+
+
+def check_thresholds(stats, *, max_p95=None, max_p99=None, max_error_rate=None):
+    """Returns the list of the thresholds exceeded by the routes. Latencies
+    are in seconds."""
+    problems = []
+    for route in stats:
+        if max_error_rate is not None and route.error_rate > max_error_rate:
+            problems.append(f'{route.name}: {route.error_rate:.0%} of errors (maximum {max_error_rate:.0%})')
+        for p, maximum in ((95, max_p95), (99, max_p99)):
+            value = route.percentile(p)
+            if maximum is not None and value is not None and value > maximum:
+                problems.append(f'{route.name}: p{p} is {format_ms(value)} (maximum {format_ms(maximum)})')
+    return problems
+
+
+def argparse_to_optional_float(value):
+    """Same as float, but an empty value, such as an unset input of the
+    action, is None."""
+    return float(value) if value else None
+
+
+def add_verify_arguments(parser):
+    """Adds the options of verify_endpoints to `parser`."""
+    parser.add_argument('--verify-requests', required=False, type=int, default=10,
+                        help='Number of requests sent to every route of every domain')
+    parser.add_argument('--verify-concurrency', required=False, type=int, default=8,
+                        help='Maximum number of requests sent at the same time')
+    parser.add_argument('--verify-timeout', required=False, type=float, default=10,
+                        help='Timeout of every request, in seconds')
+    parser.add_argument('--warmup-file', required=False,
+                        help='File of requests to send before probing the routes, one "/path" or "METHOD /path" per line')
+    parser.add_argument('--verify-max-p95', required=False, type=argparse_to_optional_float,
+                        help='Maximum 95th percentile of the latency of every route, in milliseconds')
+    parser.add_argument('--verify-max-p99', required=False, type=argparse_to_optional_float,
+                        help='Maximum 99th percentile of the latency of every route, in milliseconds')
+    parser.add_argument('--verify-max-error-rate', required=False, type=argparse_to_optional_float,
+                        help='Maximum share of the requests of every route failing or returning a 5xx, between 0 and 1')
+    parser.add_argument('--verify-strict', type=argparse_to_bool, nargs='?', const=True, default=False,
+                        help='Fail if a threshold is exceeded, instead of only reporting it')
+
+
+def verify_options(args):
+    """Returns the keyword arguments of verify_endpoints from the options
+    added by add_verify_arguments."""
+    return {
+        'warmup': read_warmup_file(args.warmup_file) if args.warmup_file else (),
+        'requests_per_route': args.verify_requests,
+        'concurrency': args.verify_concurrency,
+        'timeout': args.verify_timeout,
+        'max_p95': args.verify_max_p95 / 1000 if args.verify_max_p95 is not None else None,
+        'max_p99': args.verify_max_p99 / 1000 if args.verify_max_p99 is not None else None,
+        'max_error_rate': args.verify_max_error_rate,
+        'strict': args.verify_strict,
+    }
+
+
+def domain_urls(app):
+    return [f'https://{domain["name"]}' for domain in app['domains']]
+
+
+@traced()
+def verify_endpoints(urls, routes, *, warmup=(), requests_per_route=10, concurrency=8, timeout=10,
+                     max_p95=None, max_p99=None, max_error_rate=None, strict=False):
+    """Replays the `warmup` requests, a list of (method, path), on every base
+    URL of `urls`, then sends `requests_per_route` GET requests to every path
+    of `routes` on every URL. The latencies of each route are reported, and
+    compared to the thresholds `max_p95` and `max_p99` (in seconds) and
+    `max_error_rate` (between 0 and 1). Exceeded thresholds raise an error if
+    `strict` is set, and are only reported otherwise."""
+    paths = list(dict.fromkeys(route['path'] for route in routes))
+    if not urls or not paths:
+        print('>> No domain or route to verify. Skip.')
+        return []
+
+    checker = EndpointChecker(urls, concurrency=concurrency, timeout=timeout)
+    try:
+        sections = []
+        if warmup:
+            print(f'>> Warm-up: {len(warmup)} requests on {len(urls)} domains')
+            warmup_stats = checker.run([(url, method, path) for url in urls for method, path in warmup])
+            warmup_table = report_table(warmup_stats)
+            print(warmup_table)
+            sections.append(f'#### Warm-up\n\n{warmup_table}')
+
+        print(f'>> Probing {len(paths)} routes on {len(urls)} domains, {requests_per_route} requests each')
+        stats = checker.run([(url, 'GET', path) for url in urls for path in paths], rounds=requests_per_route)
+    finally:
+        checker.close()
+
+    table = report_table(stats)
+    print(table)
+    sections.append(f'#### Routes\n\n{table}')
+
+    problems = check_thresholds(stats, max_p95=max_p95, max_p99=max_p99, max_error_rate=max_error_rate)
+    if problems:
+        sections.append('#### Thresholds exceeded\n\n' + '\n'.join(f'- {problem}' for problem in problems))
+    github_step_summary('### Endpoints verification\n\n' + '\n\n'.join(sections))
+
+    if problems:
+        message = 'Thresholds exceeded:\n' + '\n'.join(f'  {problem}' for problem in problems)
+        if strict:
+            raise RuntimeError(message)
+        print(f'Warning: {message}')
+    return stats
@@ -0,0 +1,183 @@
+"""Strategies to wait for a deployment to reach a given status.
+
+A strategy decides how long to wait before checking the status of the
+deployment again. Every strategy can be woken up early by calling notify(),
+for example when a streaming source reports activity on the deployment.
+"""
+
+import random
+import shutil
+import threading
+import time
+
+from koyeb_client import get_client
+from koyeb_executor import get_executor
+
+FAILED_STATUSES = ('CANCELING', 'CANCELED', 'STOPPING', 'STOPPED', 'ERRORING', 'ERROR')
+
+
+class Deadline:
+    """Deadline measured with a monotonic clock, shared by all the strategies
+    used to wait for a deployment."""
+
+    def __init__(self, timeout):
+        self.start = time.monotonic()
+        self.timeout = timeout
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def remaining(self):
+        return max(0, self.timeout - self.elapsed())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class FixedInterval:
+    """Checks the status at a fixed interval."""
+
+    def __init__(self, interval=3):
+        self.interval = interval
+        self._wakeup = threading.Event()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def next_delay(self, status, polls_in_status):
+        return self.interval
+
+    def notify(self):
+        self._wakeup.set()
+
+    def sleep(self, status, polls_in_status, deadline):
+        """Waits until the status should be checked again. Returns early if
+        notify() is called."""
+        delay = min(self.next_delay(status, polls_in_status), deadline.remaining())
+        self._wakeup.wait(delay)
+        self._wakeup.clear()
+
+
+class AdaptiveBackoff(FixedInterval):
+    """Checks the status often right after it changed, then backs off
+    exponentially. The bounds depend on the status: long phases such as the
+    build are polled slowly, short transitions such as STARTING are polled
+    often. A random jitter avoids synchronizing concurrent jobs."""
+
+    # status: (delay after a status change, maximum delay), in seconds
+    PHASES = {
+        'PENDING': (2, 10),
+        'PROVISIONING': (2, 10),
+        'SCHEDULED': (1, 5),
+        'ALLOCATING': (1, 3),
+        'STARTING': (0.5, 2),
+        'UNHEALTHY': (1, 5),
+    }
+    DEFAULT_PHASE = (1, 5)
+
+    def __init__(self, *, phases=None, factor=1.5, jitter=0.2):
+        super().__init__()
+        self.phases = {**self.PHASES, **(phases or {})}
+        self.factor = factor
+        self.jitter = jitter
+
+    def next_delay(self, status, polls_in_status):
+        initial, maximum = self.phases.get(status, self.DEFAULT_PHASE)
+        delay = min(maximum, initial * self.factor ** polls_in_status)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class LogActivity:
+    """Wraps a strategy, and wakes it up whenever the runtime logs of the
+    deployment show activity: the first lines written by an instance usually
+    mean that its status is about to change. The strategy is woken up at most
+    once per `min_interval` seconds, so chatty applications don't turn the wait
+    into a busy loop."""
+
+    def __init__(self, strategy, deployment_id, *, min_interval=1):
+        self.strategy = strategy
+        self.deployment_id = deployment_id
+        self.min_interval = min_interval
+        self._proc = None
+
+    @staticmethod
+    def available():
+        return shutil.which('koyeb') is not None
+
+    def start(self):
+        self._proc = get_client().deployment_logs(self.deployment_id, 'runtime')
+        threading.Thread(target=self._follow, daemon=True).start()
+
+    def _follow(self):
+        last_notify = 0
+        for _ in iter(self._proc.stdout.readline, b''):
+            if time.monotonic() - last_notify >= self.min_interval:
+                last_notify = time.monotonic()
+                self.strategy.notify()
+
+    def stop(self):
+        if self._proc is not None:
+            self._proc.kill()
+
+    def notify(self):
+        self.strategy.notify()
+
+    def sleep(self, status, polls_in_status, deadline):
+        self.strategy.sleep(status, polls_in_status, deadline)
+
+
+def make_strategy(name, deployment_id):
+    """Returns the strategy named `name`: "fixed", "adaptive" or "logs". The
+    "logs" strategy falls back to "adaptive" if logs can't be streamed."""
+    if name == 'fixed':
+        return FixedInterval()
+    if name == 'logs' and LogActivity.available():
+        return LogActivity(AdaptiveBackoff(), deployment_id)
+    return AdaptiveBackoff()
+
+
+def koyeb_wait_status(*, deployment_id, statuses, deadline, strategy, on_change=None):
+    """Waits for the deployment to reach one of `statuses`, and returns its
+    info. Raises an error if the deployment fails or if the deadline expires.
+    `on_change` is called with the info of the deployment every time its status
+    changes."""
+    client = get_client()
+    previous_status = None
+    polls_in_status = 0
+    last_report = 0
+
+    while True:
+        info = get_executor().call(client.deployment_get, deployment_id, operation='deployment get', hedge=True)
+        status = info['status']
+
+        if status != previous_status:
+            polls_in_status = 0
+            previous_status = status
+            if on_change:
+                on_change(info)
+        else:
+            polls_in_status += 1
+
+        if status in statuses:
+            return info
+        elif status in FAILED_STATUSES:
+            raise RuntimeError(
+                f'Deployment {deployment_id} is in status {status}.'
+            )
+
+        if deadline.expired():
+            raise RuntimeError(
+                f'Timeout reached while waiting for deployment {deployment_id} to be {" or ".join(statuses)}'
+            )
+
+        elapsed = int(deadline.elapsed())
+        if elapsed - last_report >= 30:
+            last_report = elapsed
+            print(
+                f'[{elapsed}s] Still waiting for deployment {deployment_id} to be {" or ".join(statuses)}. Currently in status {status}.'
+            )
+
+        strategy.sleep(status, polls_in_status, deadline)
@@ -1,68 +1,59 @@
 #!/usr/bin/env python
 
 import argparse
-import subprocess
 
+from koyeb_client import KoyebAlreadyExists, get_client
+from koyeb_secrets import read_secrets_file, sync_secrets
 
-class KoyebSecretAlreadyExists(Exception):
-    pass
+# Kept for backward compatibility: koyeb_secret_create raises this exception,
+# which is now provided by koyeb_client.
+KoyebSecretAlreadyExists = KoyebAlreadyExists
 
 
 def koyeb_secret_create(*, secret_name, secret_value):
-    """Wrapper around koyeb CLI to create a secret. If the service already
-    exists, it raises an error. Assumes that the koyeb CLI is installed and
-    configured."""
-    args = [
-        'koyeb', 'secret', 'create',
-        secret_name,
-        '--value', secret_value,
-    ]
-    args += ['-o', 'json', '-d']
-
-    proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if proc.returncode != 0:
-        # If the secret already exists, koyeb-cli displays an error containing the
-        # strings "400 Bad request" and "Name already exists".
-        stderr = proc.stderr.decode()
-        if '400 Bad request'.lower() in stderr.lower() and 'already exists' in stderr.lower():
-            raise KoyebSecretAlreadyExists(
-                f'Secret {secret_name} already exists. Skip.')
-        raise RuntimeError(
-            f'Error while creating the service {secret_name}\n{"v" * 100}\n{stderr.strip()}\n{"^" * 100}')
+    """Creates a secret. If the secret already exists, it raises
+    KoyebSecretAlreadyExists."""
+    get_client().secret_create(secret_name, secret_value)
 
 
 def koyeb_secret_update(*, secret_name, secret_value):
-    """Wrapper around koyeb CLI to update the definition of an existing secret.
-    Assumes that the koyeb CLI is installed and configured."""
-    args = [
-        'koyeb', 'secret', 'update',
-        secret_name,
-        '--value', secret_value,
-    ]
-    args += ['-o', 'json']
-
-    proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    if proc.returncode != 0:
-        stderr = proc.stderr.decode()
-        raise RuntimeError(
-            f'Error while updating the secret {secret_name}\n{"v" * 100}\n{stderr.strip()}\n{"^" * 100}')
+    """Updates the value of an existing secret."""
+    get_client().secret_update(secret_name, secret_value)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--secret-name', required=True,
+    parser.add_argument('--secret-name', required=False,
                         help='Name of the Koyeb secret to create')
-    parser.add_argument('--secret-value', required=True,
+    parser.add_argument('--secret-value', required=False,
                         help='Value of the Koyeb secret to create')
+    parser.add_argument('--secrets-file', required=False,
+                        help='File of secrets to create or update, with one NAME=value per line or a JSON object. Use - to read stdin')
+    parser.add_argument('--concurrency', required=False, type=int, default=8,
+                        help='Maximum number of secrets of --secrets-file written at the same time')
+    parser.add_argument('--hashes-file', required=False,
+                        help='File remembering the hashes of the values written, to skip the secrets of --secrets-file which did not change')
     args = parser.parse_args()
 
+    if args.secrets_file:
+        if args.secret_name or args.secret_value:
+            parser.error('--secrets-file cannot be used with --secret-name and --secret-value')
+        sync_secrets(
+            read_secrets_file(args.secrets_file),
+            concurrency=args.concurrency,
+            hashes_path=args.hashes_file,
+        )
+        return
+
+    # The action passes its unset inputs as empty strings.
+    if not args.secret_name or not args.secret_value:
+        parser.error('--secret-name and --secret-value are required without --secrets-file')
+
     try:
-        koyeb_secret_create(**vars(args))
+        koyeb_secret_create(secret_name=args.secret_name, secret_value=args.secret_value)
     except KoyebSecretAlreadyExists:
         print('Secret already exists. Triggering an update instead.')
-        koyeb_secret_update(**vars(args))
+        koyeb_secret_update(secret_name=args.secret_name, secret_value=args.secret_value)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,96 @@
+import http.server
+import json
+import os
+import subprocess
+import sys
+import threading
+import urllib.parse
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+
+class StubServer:
+    """Local HTTP/1.1 server answering with the handlers of `routes`, by
+    (method, path). A handler is called with the query and the decoded body
+    of the request, and returns a tuple (status, body) or (status, body,
+    headers). Every request is recorded with the port of the client, to tell
+    connections apart."""
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle_request(self):
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                stub.requests.append({'method': self.command, 'path': url.path, 'query': query,
+                                      'port': self.client_address[1]})
+
+                handler = stub.routes.get((self.command, url.path))
+                result = handler(query, body) if handler else (404, {'message': 'not found'})
+                status, response, headers = (result + ({},))[:3]
+                data = json.dumps(response).encode() if not isinstance(response, bytes) else response
+                self.send_response(status)
+                for name, value in {'Content-Type': 'application/json', **headers}.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+class GitRepository:
+    """GIT repository in a temporary directory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.git('init', '-q')
+
+    def git(self, *args):
+        return subprocess.run(
+            ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+            cwd=self.path, check=True, stdout=subprocess.PIPE,
+        ).stdout.decode().strip()
+
+    def commit(self, files):
+        """Writes the `files`, a dict {path: content}, and commits them.
+        Returns the sha of the commit."""
+        for path, content in files.items():
+            os.makedirs(os.path.join(self.path, os.path.dirname(path)), exist_ok=True)
+            with open(os.path.join(self.path, path), 'w') as f:
+                f.write(content)
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', 'commit')
+        return self.git('rev-parse', 'HEAD')
+
+
+@pytest.fixture
+def git_repo(tmp_path):
+    return GitRepository(str(tmp_path))
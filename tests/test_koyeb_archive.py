@@ -0,0 +1,63 @@
+import gzip
+import json
+
+from koyeb_archive import LogArchive, failure_context, index_path
+
+
+def archive(tmp_path, chunks, **kwargs):
+    path = str(tmp_path / 'build.log.gz')
+    partial = 0
+    with LogArchive(path, **kwargs) as log:
+        for chunk in chunks:
+            log.feed(chunk)
+            partial = max(partial, len(log._partial))
+    with open(index_path(path)) as f:
+        return path, json.load(f), partial
+
+
+LOG = (
+    b'Cloning the repository\n'
+    b'Step 1/3 : FROM node:20\n'
+    b' ---> 1234\n'
+    b'Step 2/3 : RUN npm ci\n'
+    b'npm ERR! code ERESOLVE\n'
+    b'Step 3/3 : RUN npm run build failed\n'
+    b'#8 [3/4] RUN make ERROR\n'
+    b'done\n'
+)
+
+
+def test_steps_and_errors_are_indexed_whatever_the_chunks(tmp_path):
+    for size in (1, 7, len(LOG)):
+        chunks = [LOG[i:i + size] for i in range(0, len(LOG), size)]
+        path, index, _ = archive(tmp_path, chunks)
+
+        assert index['lines'] == 8
+        assert [(step['name'], step['line']) for step in index['steps']] == [
+            ('Step 1/3 : FROM node:20', 2),
+            ('Step 2/3 : RUN npm ci', 4),
+            ('Step 3/3 : RUN npm run build failed', 6),
+            ('#8 [3/4] RUN make ERROR', 7),
+        ]
+        assert [error['line'] for error in index['errors']] == [5, 6, 7]
+        with gzip.open(path) as f:
+            assert f.read() == LOG
+
+
+def test_failure_context_reads_the_lines_of_the_last_error(tmp_path):
+    path, _, _ = archive(tmp_path, [LOG])
+    assert failure_context(path, context=1) == ('#8 [3/4] RUN make ERROR', 7, ['#8 [3/4] RUN make ERROR', 'done'])
+
+
+def test_long_lines_are_written_as_they_come(tmp_path):
+    progress = b''.join(b'\rDownloading %d%%' % (number % 100) for number in range(20000))
+    chunks = [progress[i:i + 4096] for i in range(0, len(progress), 4096)]
+    path, index, partial = archive(tmp_path, chunks + [b' failed\nStep 2/2 : RUN true\n'], max_member_bytes=64 * 1024)
+
+    assert partial < 64 * 1024
+    assert index['lines'] == 2
+    # The rest of the long line doesn't start a step.
+    assert [step['line'] for step in index['steps']] == [2]
+    assert [error['line'] for error in index['errors']] == [1]
+    with gzip.open(path) as f:
+        assert f.read() == progress + b' failed\nStep 2/2 : RUN true\n'
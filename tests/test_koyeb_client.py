@@ -0,0 +1,164 @@
+import pytest
+
+import koyeb_client
+from koyeb_client import (
+    ConnectionPool, KoyebAlreadyExists, KoyebAPIClient, KoyebCLIClient, KoyebError, KoyebNotFound, get_client,
+    is_not_found_error,
+)
+
+
+@pytest.fixture
+def client(stub_server):
+    client = KoyebAPIClient('token', url=stub_server.url)
+    yield client
+    client.pool.close()
+
+
+def test_connection_pool_reuses_connections(stub_server):
+    stub_server.routes[('GET', '/ping')] = lambda query, body: (200, {'pong': True})
+    pool = ConnectionPool(stub_server.url)
+    try:
+        for _ in range(3):
+            status, _, data = pool.request('GET', '/ping')
+            assert status == 200
+            assert data == b'{"pong": true}'
+    finally:
+        pool.close()
+    assert len({request['port'] for request in stub_server.requests}) == 1
+
+
+def test_connection_pool_opens_a_connection_per_concurrent_request(stub_server):
+    stub_server.routes[('GET', '/ping')] = lambda query, body: (200, {})
+    pool = ConnectionPool(stub_server.url)
+    try:
+        first, _ = pool._get()
+        second, _ = pool._get()
+        assert first is not second
+        pool._put(first)
+        pool._put(second)
+        assert pool._get() == (second, True)
+    finally:
+        pool.close()
+
+
+def test_not_found_raises_koyeb_not_found(client, stub_server):
+    stub_server.routes[('GET', '/v1/deployments/missing')] = lambda query, body: (404, {'message': 'Deployment not found'})
+    with pytest.raises(KoyebNotFound) as excinfo:
+        client.deployment_get('missing')
+    assert excinfo.value.status == 404
+
+
+def test_not_found_errors_of_the_cli():
+    assert is_not_found_error('Error: 404 Not Found: app bench not found')
+    assert not is_not_found_error('Error: 500 Internal Server Error: deployment 4041c2e0-5d1f failed')
+    assert not is_not_found_error('Error: 502 Bad Gateway: route not found')
+
+
+def test_already_exists_raises_koyeb_already_exists(client, stub_server):
+    stub_server.routes[('POST', '/v1/secrets')] = lambda query, body: (400, {
+        'status': 400, 'code': 'invalid_argument', 'message': 'Validation error',
+        'fields': [{'field': 'name', 'description': 'already exists'}],
+    })
+    with pytest.raises(KoyebAlreadyExists) as excinfo:
+        client.secret_create('TOKEN', 'value')
+    assert excinfo.value.status == 400
+
+
+def test_other_client_errors_raise_koyeb_error(client, stub_server):
+    stub_server.routes[('POST', '/v1/secrets')] = lambda query, body: (400, {'message': 'Invalid value'})
+    with pytest.raises(KoyebError) as excinfo:
+        client.secret_create('TOKEN', 'value')
+    assert type(excinfo.value) is KoyebError
+    assert excinfo.value.status == 400
+    # Client errors are not retried.
+    assert len(stub_server.requests) == 1
+
+
+def test_list_fetches_every_page(client, stub_server):
+    secrets = [{'id': str(number), 'name': f'SECRET_{number}'} for number in range(250)]
+
+    def list_secrets(query, body):
+        offset, limit = int(query['offset']), int(query['limit'])
+        return 200, {'secrets': secrets[offset:offset + limit]}
+
+    stub_server.routes[('GET', '/v1/secrets')] = list_secrets
+    assert client.secret_list() == secrets
+    assert [request['query']['offset'] for request in stub_server.requests] == ['0', '100', '200']
+
+
+def test_list_stops_on_a_full_last_page_followed_by_an_empty_one(client, stub_server):
+    secrets = [{'id': str(number), 'name': f'SECRET_{number}'} for number in range(100)]
+    stub_server.routes[('GET', '/v1/secrets')] = lambda query, body: (
+        200, {'secrets': secrets[int(query['offset']):int(query['offset']) + int(query['limit'])]},
+    )
+    assert client.secret_list() == secrets
+    assert len(stub_server.requests) == 2
+
+
+def test_find_matches_the_exact_name(client, stub_server):
+    stub_server.routes[('GET', '/v1/apps')] = lambda query, body: (200, {'apps': [
+        {'id': '1', 'name': f'{query["name"]}-preview'},
+        {'id': '2', 'name': query['name']},
+    ]})
+    assert client.app_get('bench')['id'] == '2'
+
+    stub_server.routes[('GET', '/v1/apps')] = lambda query, body: (200, {'apps': [{'id': '1', 'name': 'bench-preview'}]})
+    with pytest.raises(KoyebNotFound):
+        client._find('apps', 'bench', error_title='Error')
+
+
+@pytest.fixture
+def environment(monkeypatch):
+    for name in ('KOYEB_CLIENT', 'KOYEB_TOKEN', 'KOYEB_API_URL', 'KOYEB_STATE_CACHE'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(koyeb_client, '_client', None)
+    monkeypatch.setattr(koyeb_client, 'read_cli_config', lambda: {})
+    return monkeypatch
+
+
+def test_get_client_falls_back_to_the_cli_without_token(environment):
+    assert isinstance(get_client(), KoyebCLIClient)
+
+
+def test_get_client_uses_the_api_with_a_token(environment):
+    environment.setenv('KOYEB_TOKEN', 'token')
+    assert isinstance(get_client(), KoyebAPIClient)
+
+
+def test_get_client_uses_the_token_of_the_cli_configuration(environment):
+    environment.setattr(koyeb_client, 'read_cli_config', lambda: {'token': 'token', 'url': 'http://localhost:1'})
+    client = get_client()
+    assert isinstance(client, KoyebAPIClient)
+    assert client.url == 'http://localhost:1'
+
+
+def test_get_client_requires_a_token_for_the_api(environment):
+    environment.setenv('KOYEB_CLIENT', 'api')
+    with pytest.raises(KoyebError):
+        get_client()
+
+
+def test_server_errors_of_reads_are_retried(client, stub_server, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    responses = iter([(500, {'message': 'Internal error'}), (200, {'deployment': {'id': 'id', 'status': 'HEALTHY'}})])
+    stub_server.routes[('GET', '/v1/deployments/id')] = lambda query, body: next(responses)
+    assert client.deployment_get('id')['status'] == 'HEALTHY'
+    assert len(stub_server.requests) == 2
+
+
+def test_server_errors_of_service_updates_are_not_retried(client, stub_server, monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    stub_server.routes[('PUT', '/v1/services/id')] = lambda query, body: (500, {'message': 'Internal error'})
+    service = {'id': 'id', 'name': 'api'}
+    spec = {
+        **dict.fromkeys((
+            'docker_entrypoint', 'docker_command', 'docker_private_registry_secret', 'git_url', 'git_workdir',
+            'git_branch', 'git_sha', 'git_build_command', 'git_run_command', 'git_builder', 'git_docker_command',
+            'git_docker_dockerfile', 'git_docker_entrypoint', 'git_docker_target', 'privileged', 'skip_cache',
+        )),
+        'service_type': 'web', 'service_instance_type': 'nano', 'service_regions': ['fra'], 'service_env': [],
+        'service_ports': [], 'service_routes': [], 'service_checks': [], 'docker': 'nginx',
+    }
+    with pytest.raises(KoyebError):
+        client.service_update('bench', 'api', spec, current=(service, None))
+    assert len(stub_server.requests) == 1
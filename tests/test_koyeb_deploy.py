@@ -0,0 +1,233 @@
+import pytest
+
+import koyeb_deploy
+from koyeb_client import KoyebNotFound
+from koyeb_deploy import is_superseded, koyeb_cancel_superseded, koyeb_resume, koyeb_service_upsert
+from koyeb_journal import Journal
+from koyeb_service import definition_hash, service_definition
+from koyeb_state import StateCache
+
+SPEC = {
+    **dict.fromkeys((
+        'docker_entrypoint', 'docker_command', 'docker_private_registry_secret', 'git_url', 'git_workdir',
+        'git_branch', 'git_sha', 'git_build_command', 'git_run_command', 'git_builder', 'git_docker_command',
+        'git_docker_dockerfile', 'git_docker_entrypoint', 'git_docker_target', 'privileged', 'skip_cache',
+    )),
+    'service_type': 'web', 'service_instance_type': 'nano', 'service_regions': ['fra'], 'service_env': [],
+    'service_ports': [{'port': '80', 'protocol': 'http'}], 'service_routes': [{'path': '/', 'port': 80}],
+    'service_checks': [], 'docker': 'nginx@sha256:0123',
+}
+
+
+class FakeClient:
+    """Client recording the calls of the stages, with a single service."""
+
+    def __init__(self, *, service_update_needs_current=True, deployment=None, state=None):
+        self.service_update_needs_current = service_update_needs_current
+        self.deployment = deployment
+        self.state = state or StateCache()
+        self.calls = []
+
+    def service_get(self, app_name, service_name):
+        self.calls.append('service_get')
+        if self.deployment is None:
+            raise KoyebNotFound('not found')
+        return {'id': 'service', 'name': service_name, 'latest_deployment_id': self.deployment['id']}
+
+    def deployment_get(self, deployment_id):
+        self.calls.append('deployment_get')
+        if self.deployment is None:
+            raise KoyebNotFound('not found')
+        return self.deployment
+
+    def service_create(self, app_name, service_name, spec):
+        self.calls.append('service_create')
+        return {'id': 'service', 'name': service_name, 'latest_deployment_id': 'created'}
+
+    def service_update(self, app_name, service_name, spec, *, current=None):
+        self.calls.append('service_update')
+        if self.deployment is None:
+            raise KoyebNotFound('not found')
+        return {'id': 'service', 'name': service_name, 'latest_deployment_id': 'updated'}
+
+
+def deployment(spec=SPEC, *, status='HEALTHY'):
+    return {
+        'id': 'deployed', 'service_id': 'service', 'status': status,
+        'definition': service_definition(**dict(spec, service_name='api')),
+    }
+
+
+@pytest.fixture
+def use_client(monkeypatch):
+    monkeypatch.delenv('KOYEB_JOURNAL', raising=False)
+
+    def use(client):
+        monkeypatch.setattr(koyeb_deploy, 'get_client', lambda: client)
+        return client
+    return use
+
+
+def test_upsert_skips_an_unchanged_healthy_service(use_client):
+    client = use_client(FakeClient(deployment=deployment()))
+    service, updated = koyeb_service_upsert('bench', 'api', SPEC)
+    assert (service['latest_deployment_id'], updated) == ('deployed', False)
+    assert client.calls == ['service_get', 'deployment_get']
+
+
+def test_upsert_updates_first_when_the_update_cant_be_skipped(use_client):
+    client = use_client(FakeClient(service_update_needs_current=False, deployment=deployment()))
+    service, updated = koyeb_service_upsert('bench', 'api', dict(SPEC, force=True))
+    assert (service['latest_deployment_id'], updated) == ('updated', True)
+    assert client.calls == ['service_update']
+
+    client = use_client(FakeClient(service_update_needs_current=False))
+    service, updated = koyeb_service_upsert('bench', 'api', dict(SPEC, docker='nginx'))
+    assert (service['latest_deployment_id'], updated) == ('created', True)
+    assert client.calls == ['service_update', 'service_create']
+
+
+def test_upsert_fetches_the_service_when_the_update_needs_it(use_client):
+    client = use_client(FakeClient(deployment=deployment()))
+    service, updated = koyeb_service_upsert('bench', 'api', dict(SPEC, force=True))
+    assert (service['latest_deployment_id'], updated) == ('updated', True)
+    assert client.calls == ['service_get', 'deployment_get', 'service_update']
+
+
+@pytest.mark.parametrize('spec, status', [
+    (dict(SPEC, force=True), 'HEALTHY'),
+    (SPEC, 'ERROR'),
+    (dict(SPEC, docker='nginx:latest'), 'HEALTHY'),
+    (dict(SPEC, service_regions=['was']), 'HEALTHY'),
+])
+def test_upsert_updates_unless_the_deployment_is_up_to_date(use_client, spec, status):
+    client = use_client(FakeClient(deployment=deployment(dict(SPEC, docker=spec['docker']), status=status)))
+    service, updated = koyeb_service_upsert('bench', 'api', spec)
+    assert (service['latest_deployment_id'], updated) == ('updated', True)
+    assert client.calls == ['service_get', 'deployment_get', 'service_update']
+
+
+def test_upsert_skips_a_service_up_to_date_in_the_state_cache(use_client, tmp_path):
+    state = StateCache(str(tmp_path / 'state.json'))
+    client = use_client(FakeClient(deployment=deployment(), state=state))
+    assert koyeb_service_upsert('bench', 'api', SPEC) == (
+        {'id': 'service', 'name': 'api', 'latest_deployment_id': 'deployed'}, False,
+    )
+    client.calls.clear()
+
+    assert koyeb_service_upsert('bench', 'api', SPEC)[1] is False
+    assert client.calls == []
+    assert koyeb_service_upsert('bench', 'api', dict(SPEC, service_regions=['was']))[1] is True
+
+
+SPEC_HASH = definition_hash(service_definition(**dict(SPEC, service_name='api')))
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setenv('KOYEB_JOURNAL', str(tmp_path / 'journal.json'))
+    monkeypatch.setenv('GITHUB_RUN_ID', '42')
+    journal = Journal.from_environment()
+    journal.record('bench', 'api', 'deployed', deployment_id='deployed', definition_hash=SPEC_HASH)
+    return journal
+
+
+@pytest.mark.parametrize('status, expected', [
+    ('HEALTHY', ({'id': 'service', 'name': 'api', 'latest_deployment_id': 'deployed'}, False)),
+    ('PROVISIONING', ({'id': 'service', 'name': 'api', 'latest_deployment_id': 'deployed'}, True)),
+    ('ERROR', None),
+    (None, None),
+])
+def test_resume(use_client, journal, status, expected):
+    use_client(FakeClient(deployment=status and deployment(status=status)))
+    assert koyeb_resume(journal, 'bench', 'api', SPEC_HASH) == expected
+    assert koyeb_resume(journal, 'bench', 'api', 'other definition') is None
+
+
+def test_upsert_resumes_the_deployment_of_a_previous_attempt(use_client, journal):
+    client = use_client(FakeClient(deployment=deployment(status='PROVISIONING')))
+    service, updated = koyeb_service_upsert('bench', 'api', dict(SPEC, force=True))
+    assert (service['latest_deployment_id'], updated) == ('deployed', True)
+    assert client.calls == ['deployment_get']
+
+
+def test_upsert_records_the_deployment_it_triggers(use_client, journal):
+    client = use_client(FakeClient(deployment=deployment(status='ERROR')))
+    service, updated = koyeb_service_upsert('bench', 'api', SPEC)
+    assert (service['latest_deployment_id'], updated) == ('updated', True)
+    assert client.calls == ['deployment_get', 'service_get', 'deployment_get', 'service_update']
+    assert journal.get('bench', 'api', definition_hash=SPEC_HASH)['deployment_id'] == 'updated'
+
+
+def git_spec(sha):
+    return dict(
+        SPEC, docker=None, git_url='github.com/org/repo', git_branch='main', git_sha=sha, git_workdir='api',
+        git_builder='buildpack', skip_unchanged_source=True,
+    )
+
+
+def test_upsert_skips_when_the_sources_of_the_workdir_are_unchanged(use_client, git_repo, monkeypatch):
+    monkeypatch.chdir(git_repo.path)
+    first = git_repo.commit({'api/main.py': 'v1', 'web/index.js': 'v1'})
+    web_changed = git_repo.commit({'web/index.js': 'v2'})
+    api_changed = git_repo.commit({'api/main.py': 'v2'})
+
+    client = use_client(FakeClient(deployment=deployment(git_spec(first))))
+    assert koyeb_service_upsert('bench', 'api', git_spec(web_changed))[1] is False
+    assert koyeb_service_upsert('bench', 'api', git_spec(api_changed))[1] is True
+    assert koyeb_service_upsert('bench', 'api', dict(git_spec(web_changed), skip_unchanged_source=False))[1] is True
+    # Only the GIT sha may differ.
+    assert koyeb_service_upsert('bench', 'api', dict(git_spec(web_changed), service_regions=['was']))[1] is True
+    assert client.calls.count('service_update') == 3
+
+
+def git_deployment(deployment_id, sha, created_at, status='PROVISIONING'):
+    return {
+        'id': deployment_id, 'status': status, 'created_at': created_at,
+        'definition': service_definition(**dict(git_spec(sha), service_name='api')),
+    }
+
+
+def test_is_superseded(git_repo, monkeypatch):
+    monkeypatch.chdir(git_repo.path)
+    old = git_repo.commit({'api/main.py': 'v1'})
+    new = git_repo.commit({'api/main.py': 'v2'})
+    desired = service_definition(**dict(git_spec(new), service_name='api'))
+    latest = git_deployment('latest', new, '2026-01-01T10:00:00Z')
+
+    assert is_superseded(git_deployment('old', old, '2026-01-01T09:00:00Z'), latest, desired)
+    # A deployment created after the latest one is never superseded by it.
+    assert not is_superseded(git_deployment('newer', old, '2026-01-01T11:00:00Z'), latest, desired)
+    # An older deployment of a newer commit, when an older commit is redeployed.
+    rollback = service_definition(**dict(git_spec(old), service_name='api'))
+    assert not is_superseded(git_deployment('new', new, '2026-01-01T09:00:00Z'), latest, rollback)
+    # Commits missing from the clone: the deployment created first is older.
+    assert is_superseded(git_deployment('unknown', '0' * 40, '2026-01-01T09:00:00Z'), latest, desired)
+
+
+class SupersedeClient:
+    def __init__(self, deployments):
+        self.deployments = deployments
+        self.cancelled = []
+
+    def deployment_list(self, service_id, *, statuses=None):
+        return [deployment for deployment in self.deployments if deployment['status'] in statuses]
+
+    def deployment_cancel(self, deployment_id):
+        self.cancelled.append(deployment_id)
+
+
+def test_cancel_superseded_cancels_the_older_deployments_still_building(use_client, git_repo, monkeypatch):
+    monkeypatch.chdir(git_repo.path)
+    old = git_repo.commit({'api/main.py': 'v1'})
+    new = git_repo.commit({'api/main.py': 'v2'})
+    client = use_client(SupersedeClient([
+        git_deployment('old', old, '2026-01-01T09:00:00Z'),
+        git_deployment('running', old, '2026-01-01T08:00:00Z', status='STARTING'),
+        git_deployment('latest', new, '2026-01-01T10:00:00Z', status='PENDING'),
+        git_deployment('newer', new, '2026-01-01T11:00:00Z', status='PENDING'),
+    ]))
+    desired = service_definition(**dict(git_spec(new), service_name='api'))
+
+    cancelled = koyeb_cancel_superseded({'id': 'service', 'name': 'api', 'latest_deployment_id': 'latest'}, desired)
+    assert cancelled == client.cancelled == ['old']
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from koyeb_executor import KoyebExecutor
+
+
+@pytest.fixture
+def executor():
+    return KoyebExecutor(max_workers=2, min_hedge_delay=0.05, default_hedge_delay=0.05)
+
+
+def slow_first_call(seconds):
+    calls = []
+    lock = threading.Lock()
+
+    def get(value):
+        with lock:
+            calls.append(value)
+            first = len(calls) == 1
+        if first:
+            time.sleep(seconds)
+            return 'first'
+        return 'hedge'
+    return get, calls
+
+
+def test_call_reuses_the_threads_of_the_pool(executor):
+    threads = set()
+
+    def get(value):
+        threads.add(threading.current_thread())
+        return value * 2
+
+    assert [executor.call(get, number, operation='get') for number in range(10)] == list(range(0, 20, 2))
+    assert len(threads) <= 2
+    assert executor.counters == {'calls': 10, 'hedged': 0, 'hedge_wins': 0}
+
+
+def test_call_raises_the_error_of_the_call(executor):
+    def get():
+        raise KeyError('missing')
+
+    with pytest.raises(KeyError):
+        executor.call(get, operation='get')
+
+
+def test_call_hedges_a_slow_call(executor):
+    get, calls = slow_first_call(0.5)
+    assert executor.call(get, 'id', operation='get', hedge=True) == 'hedge'
+    assert calls == ['id', 'id']
+    assert executor.counters == {'calls': 2, 'hedged': 1, 'hedge_wins': 1}
+
+
+def test_run_hedges_a_slow_call(executor):
+    get, calls = slow_first_call(0.5)
+    assert asyncio.run(executor.run(get, 'id', operation='get', hedge=True)) == 'hedge'
+    assert executor.counters == {'calls': 2, 'hedged': 1, 'hedge_wins': 1}
+
+
+def test_hedged_call_fails_when_both_calls_fail(executor):
+    def get():
+        time.sleep(0.1)
+        raise KeyError('missing')
+
+    with pytest.raises(KeyError):
+        executor.call(get, operation='get', hedge=True)
+    assert executor.counters['hedged'] == 1
@@ -0,0 +1,79 @@
+import pytest
+
+import koyeb_fatal
+from koyeb_client import KoyebError
+from koyeb_fatal import MAX_LINES, FatalErrors, cancel_failed_build
+
+LOG = (
+    b'#8 [3/4] RUN npm ci\n'
+    b'#8 12.3 npm ERR! code ERESOLVE\n'
+    b'#8 12.3 npm ERR! ERESOLVE unable to resolve dependency tree\n'
+    b'#8 ERROR: process "/bin/sh -c npm ci" did not complete successfully: exit code: 1\n'
+    b'\x1b[31mERROR: failed to solve: process did not complete successfully: exit code: 1\x1b[0m\n'
+)
+EXPECTED = [
+    '#8 12.3 npm ERR! code ERESOLVE',
+    '#8 ERROR: process "/bin/sh -c npm ci" did not complete successfully: exit code: 1',
+    'ERROR: failed to solve: process did not complete successfully: exit code: 1',
+]
+
+
+@pytest.mark.parametrize('size', [1, 5, 13, len(LOG)])
+def test_matches_across_chunk_boundaries(size):
+    matches = []
+    detector = FatalErrors(on_match=matches.append)
+    for i in range(0, len(LOG), size):
+        detector.feed(LOG[i:i + size])
+    # A line matching several signatures is reported once, in the order of the
+    # logs.
+    assert detector.lines == EXPECTED
+    assert matches == EXPECTED[:1]
+
+
+def test_ignores_the_lines_without_signatures():
+    detector = FatalErrors()
+    detector.feed(b'npm WARN deprecated\nnpm ERR! code is incomplete until the newline')
+    assert not detector.matched
+
+
+def test_reports_at_most_max_lines():
+    detector = FatalErrors()
+    detector.feed(b'npm ERR! code E1\n' * (MAX_LINES + 5))
+    assert len(detector.lines) == MAX_LINES
+
+
+def test_signatures_of_the_environment(monkeypatch):
+    monkeypatch.setenv('KOYEB_FATAL_BUILD_ERRORS', 'FAILED tests/\n\n  Segmentation fault  \n')
+    detector = FatalErrors.from_environment()
+    detector.feed(b'FAILED tests/test_app.py::test_index\nok\nSegmentation fault (core dumped)\n')
+    assert detector.lines == ['FAILED tests/test_app.py::test_index', 'Segmentation fault (core dumped)']
+
+
+class FakeClient:
+    def __init__(self, error=None):
+        self.error = error
+        self.cancelled = []
+
+    def deployment_cancel(self, deployment_id):
+        self.cancelled.append(deployment_id)
+        if self.error:
+            raise self.error
+
+
+@pytest.mark.parametrize('value, cancelled', [(None, False), ('false', False), ('true', True)])
+def test_cancel_failed_build_is_opt_in(monkeypatch, value, cancelled):
+    if value is None:
+        monkeypatch.delenv('KOYEB_CANCEL_FAILED_BUILDS', raising=False)
+    else:
+        monkeypatch.setenv('KOYEB_CANCEL_FAILED_BUILDS', value)
+    client = FakeClient()
+    monkeypatch.setattr(koyeb_fatal, 'get_client', lambda: client)
+    assert cancel_failed_build('id') is cancelled
+    assert client.cancelled == (['id'] if cancelled else [])
+
+
+def test_cancel_failed_build_reports_a_failure_to_cancel(monkeypatch, capsys):
+    monkeypatch.setenv('KOYEB_CANCEL_FAILED_BUILDS', 'true')
+    monkeypatch.setattr(koyeb_fatal, 'get_client', lambda: FakeClient(KoyebError('already stopped')))
+    assert cancel_failed_build('id') is False
+    assert 'unable to cancel deployment id' in capsys.readouterr().err
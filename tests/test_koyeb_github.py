@@ -0,0 +1,14 @@
+from koyeb_github import markdown_table
+
+
+def test_markdown_table():
+    assert markdown_table(['Service', 'Status'], [('api', 'HEALTHY'), ('web', 2)]) == (
+        '| Service | Status |\n'
+        '|---|---|\n'
+        '| api | HEALTHY |\n'
+        '| web | 2 |'
+    )
+
+
+def test_markdown_table_escapes_the_values():
+    assert markdown_table(['Details'], [('exit 1 | tee\nlog',)]).splitlines()[-1] == '| exit 1 \\| tee log |'
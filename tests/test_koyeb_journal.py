@@ -0,0 +1,47 @@
+import json
+
+from koyeb_journal import MAX_AGE, Journal
+
+
+def test_entries_are_keyed_by_run_service_and_definition(tmp_path):
+    path = str(tmp_path / 'journal.json')
+    journal = Journal(path, run_id='42')
+    journal.record('app', 'api', 'deployed', deployment_id='d1', definition_hash='h1')
+
+    assert journal.get('app', 'api', definition_hash='h1')['deployment_id'] == 'd1'
+    assert journal.get('app', 'api', definition_hash='h2') is None
+    assert journal.get('app', 'web', definition_hash='h1') is None
+    assert Journal(path, run_id='43').get('app', 'api', definition_hash='h1') is None
+
+
+def test_stages_of_the_same_deployment(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.json'), run_id='42')
+    journal.record('app', 'api', 'deployed', deployment_id='d1', definition_hash='h1')
+    journal.record('app', 'web', 'deployed', deployment_id='d2', definition_hash='h2')
+    journal.record_healthy('d1')
+    assert journal.get('app', 'api', definition_hash='h1')['stages'] == ['deployed', 'healthy']
+    assert journal.get('app', 'web', definition_hash='h2')['stages'] == ['deployed']
+
+    # A new deployment of the service replaces the entry.
+    journal.record('app', 'api', 'deployed', deployment_id='d3', definition_hash='h3')
+    assert journal.get('app', 'api', definition_hash='h3')['stages'] == ['deployed']
+
+
+def test_old_entries_are_dropped(tmp_path):
+    path = tmp_path / 'journal.json'
+    journal = Journal(str(path), run_id='42')
+    journal.record('app', 'api', 'deployed', deployment_id='d1', definition_hash='h1')
+    content = json.loads(path.read_text())
+    content['entries']['42/app/api']['at'] -= MAX_AGE
+    path.write_text(json.dumps(content))
+
+    journal.record('app', 'web', 'deployed', deployment_id='d2', definition_hash='h2')
+    assert list(json.loads(path.read_text())['entries']) == ['42/app/web']
+
+
+def test_disabled_without_path(tmp_path, monkeypatch):
+    monkeypatch.delenv('KOYEB_JOURNAL', raising=False)
+    journal = Journal.from_environment()
+    journal.record('app', 'api', 'deployed', deployment_id='d1', definition_hash='h1')
+    assert not journal.enabled
+    assert journal.get('app', 'api', definition_hash='h1') is None
@@ -0,0 +1,51 @@
+import pytest
+
+from koyeb_manifest import ManifestError, manifest_to_argv, parse_manifest
+
+
+def service(**options):
+    return {'service-name': 'api', 'app-name': 'bench', 'docker': 'nginx', **options}
+
+
+def test_manifest_to_argv_joins_commands_like_a_shell():
+    argv, config = manifest_to_argv({'docker-command': ['npm', 'run', 'my script'], 'privileged': True})
+    assert argv == ["--docker-command=npm run 'my script'", '--privileged=true']
+    assert config == {}
+
+
+def test_manifest_to_argv_keeps_the_entries_of_lists():
+    argv, config = manifest_to_argv({'service-env': ['A=1,2', 'B=3'], 'service-ports': ['8000:http']})
+    assert argv == ['--service-env=', '--service-ports=']
+    assert config == {'env': ['A=1,2', 'B=3'], 'ports': ['8000:http']}
+
+
+def test_parse_manifest_reads_lists_entry_by_entry():
+    [api] = parse_manifest({'services': [service(**{
+        'docker-entrypoint': ['/bin/sh', '-c'],
+        'docker-command': ['npm', 'start'],
+        'service-env': ['GREETING=Hello, world', 'PORT=8000'],
+        'service-ports': ['8000:http', '8001:http2'],
+        'service-routes': ['/:8000', '/grpc:8001'],
+        'service-checks': ['8000:http:/health'],
+    })]})
+
+    assert api.spec['docker_entrypoint'] == ['/bin/sh', '-c']
+    assert api.spec['docker_command'] == ['npm', 'start']
+    assert api.spec['service_env'] == [{'name': 'GREETING', 'value': 'Hello, world'}, {'name': 'PORT', 'value': '8000'}]
+    assert api.spec['service_ports'] == [{'port': '8000', 'protocol': 'http'}, {'port': '8001', 'protocol': 'http2'}]
+    assert api.spec['service_routes'] == [{'path': '/', 'port': 8000}, {'path': '/grpc', 'port': 8001}]
+    assert api.spec['service_checks'] == [{'port': 8000, 'protocol': 'http', 'path': '/health'}]
+
+
+def test_parse_manifest_keeps_the_string_syntax():
+    [api] = parse_manifest({'services': [service(**{
+        'docker-command': 'npm start', 'service-env': 'A=1,B=2', 'service-routes': '/:8000',
+    })]})
+    assert api.spec['docker_command'] == ['npm', 'start']
+    assert api.spec['service_env'] == [{'name': 'A', 'value': '1'}, {'name': 'B', 'value': '2'}]
+    assert api.spec['service_routes'] == [{'path': '/', 'port': 8000}]
+
+
+def test_parse_manifest_rejects_invalid_entries():
+    with pytest.raises(ManifestError, match='Invalid options for the service api'):
+        parse_manifest({'services': [service(**{'service-ports': ['8000:ftp']})]})
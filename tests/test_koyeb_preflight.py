@@ -0,0 +1,139 @@
+import pytest
+
+import koyeb_preflight
+from koyeb_client import KoyebError
+from koyeb_preflight import (
+    PreflightError, definition_errors, list_references, preflight, reference_errors, referenced_secrets,
+)
+from koyeb_state import StateCache
+
+SPEC = {
+    'docker': 'nginx', 'git_url': None, 'docker_private_registry_secret': '',
+    'service_instance_type': 'nano', 'service_regions': ['fra'],
+    'service_env': [{'name': 'PORT', 'value': '8000'}],
+    'service_ports': [{'port': '8000', 'protocol': 'http'}, {'port': '9000', 'protocol': 'tcp'}],
+    'service_routes': [{'path': '/', 'port': 8000}],
+    'service_checks': [{'port': 8000, 'protocol': 'http', 'path': '/health'}, {'port': 9000, 'protocol': 'tcp'}],
+}
+
+
+def test_definition_errors_of_a_valid_definition():
+    assert definition_errors(SPEC) == []
+
+
+def test_definition_errors():
+    spec = dict(
+        SPEC,
+        docker=None,
+        service_instance_type='Nano!',
+        service_regions=[],
+        service_env=[{'name': 'NAME WITH SPACES', 'value': '1'}, {'name': 'TOKEN', 'value': '@'}],
+        service_ports=[{'port': '8000', 'protocol': 'http'}, {'port': '8000', 'protocol': 'http2'},
+                       {'port': '70000', 'protocol': 'http'}, {'port': '9000', 'protocol': 'tcp'}],
+        service_routes=[{'path': 'api', 'port': 8000}, {'path': '/', 'port': 8080}, {'path': '/', 'port': 9000}],
+        service_checks=[{'port': 8001, 'protocol': 'tcp'}, {'port': 8000, 'protocol': 'http', 'path': 'health'}],
+    )
+    assert definition_errors(spec) == [
+        'port 8000 is declared twice',
+        '"70000" is not a valid port number',
+        'the path of the route api:8000 should start with /',
+        'the route / points at port 8080, which is not declared in --service-ports',
+        'the route / is declared twice',
+        'the route / points at port 9000, which is a TCP port',
+        'the tcp healthcheck on port 8001 targets a port not declared in --service-ports',
+        'the path of the healthcheck 8000:http:health should start with /',
+        '"NAME WITH SPACES" is not a valid name of environment variable',
+        'the environment variable TOKEN references a secret without a name',
+        'no region set in --service-regions',
+        '"Nano!" is not a valid instance type',
+        'set either --docker or --git-url',
+    ]
+
+
+def test_referenced_secrets():
+    spec = dict(SPEC, docker_private_registry_secret='REGISTRY', service_env=[
+        {'name': 'TOKEN', 'value': '@TOKEN'},
+        {'name': 'URL', 'value': 'postgres://{{ secret.DB_USER }}:{{secrets.DB_PASSWORD}}@db'},
+        {'name': 'EMAIL', 'value': 'me@example.com'},
+    ])
+    assert referenced_secrets(spec) == {'TOKEN', 'DB_USER', 'DB_PASSWORD', 'REGISTRY'}
+
+
+class FakeClient:
+    def __init__(self, *, secrets_error=None):
+        self.state = StateCache()
+        self.secrets_error = secrets_error
+        self.calls = []
+
+    def secret_list(self):
+        self.calls.append('secrets')
+        if self.secrets_error:
+            raise self.secrets_error
+        return [{'id': '1', 'name': 'TOKEN'}]
+
+    def catalog_regions(self):
+        self.calls.append('regions')
+        return [{'id': 'fra'}, {'id': 'was'}]
+
+    def catalog_instances(self):
+        self.calls.append('instances')
+        return [{'id': 'nano', 'regions': ['fra', 'was']}, {'id': 'gpu', 'regions': ['was']}]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.delenv('KOYEB_PREFLIGHT', raising=False)
+    client = FakeClient()
+    monkeypatch.setattr(koyeb_preflight, 'get_client', lambda: client)
+    return client
+
+
+def test_list_references_only_lists_what_is_needed(client):
+    assert list_references([SPEC]) == {'secrets': None, 'regions': None, 'instance types': None}
+    assert client.calls == []
+
+    references = list_references([SPEC, dict(SPEC, service_env=[{'name': 'TOKEN', 'value': '@TOKEN'}])])
+    assert client.calls == ['secrets']
+    assert references['secrets'] == [{'id': '1', 'name': 'TOKEN'}]
+
+    client.calls.clear()
+    list_references([dict(SPEC, service_regions=['was'])])
+    assert sorted(client.calls) == ['instances', 'regions']
+
+
+def test_reference_errors(client):
+    spec = dict(SPEC, service_instance_type='gpu', service_regions=['fra', 'sin'],
+                service_env=[{'name': 'TOKEN', 'value': '@TOKEN'}, {'name': 'KEY', 'value': '@MISSING'}])
+    assert reference_errors(spec, list_references([spec])) == [
+        'the secret MISSING does not exist',
+        'the region sin does not exist',
+        'the instance type gpu is not available in the region fra',
+        'the instance type gpu is not available in the region sin',
+    ]
+
+
+def test_preflight_reports_the_errors_of_every_service(client):
+    with pytest.raises(PreflightError) as excinfo:
+        preflight({
+            'api': SPEC,
+            'web': dict(SPEC, service_routes=[{'path': '/', 'port': 80}]),
+            'worker': dict(SPEC, service_env=[{'name': 'KEY', 'value': '@MISSING'}]),
+        })
+    assert str(excinfo.value) == (
+        'Invalid service definition:\n'
+        '  - web: the route / points at port 80, which is not declared in --service-ports\n'
+        '  - worker: the secret MISSING does not exist'
+    )
+
+
+def test_preflight_only_warns_when_references_cant_be_listed(monkeypatch, capsys):
+    monkeypatch.delenv('KOYEB_PREFLIGHT', raising=False)
+    client = FakeClient(secrets_error=KoyebError('Error while listing the secrets\nunavailable'))
+    monkeypatch.setattr(koyeb_preflight, 'get_client', lambda: client)
+    preflight({'api': dict(SPEC, service_env=[{'name': 'KEY', 'value': '@MISSING'}])})
+    assert 'Warning: unable to check the secrets: Error while listing the secrets' in capsys.readouterr().out
+
+
+def test_preflight_can_be_disabled(client, monkeypatch):
+    monkeypatch.setenv('KOYEB_PREFLIGHT', 'false')
+    preflight({'web': dict(SPEC, service_routes=[{'path': '/', 'port': 80}])})
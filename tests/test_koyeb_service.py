@@ -0,0 +1,68 @@
+from koyeb_service import definition_diff, definition_hash, is_pinned_source, normalize_definition
+
+DEFINITION = {
+    'name': 'api',
+    'type': 'WEB',
+    'regions': ['fra', 'was'],
+    'instance_types': [{'type': 'nano'}],
+    'env': [{'key': 'PORT', 'value': '8000'}, {'key': 'TOKEN', 'secret': 'TOKEN'}],
+    'ports': [{'port': 8000, 'protocol': 'http'}],
+    'routes': [{'path': '/', 'port': 8000}],
+    'health_checks': [{'http': {'port': 8000, 'path': '/health'}}],
+    'git': {'repository': 'github.com/org/repo', 'branch': 'main', 'sha': 'abc', 'workdir': '', 'buildpack': {}},
+    'scalings': [{'min': 1, 'max': 1}],
+}
+
+
+def reordered(definition):
+    return {
+        **definition,
+        'regions': list(reversed(definition['regions'])),
+        'env': list(reversed(definition['env'])),
+        'ports': [{'port': '8000'}],
+        'routes': [{'path': '/', 'port': '8000'}],
+        'skip_cache': False,
+    }
+
+
+def test_normalize_definition_ignores_the_order_and_the_defaults():
+    assert normalize_definition(reordered(DEFINITION)) == normalize_definition(DEFINITION)
+    assert normalize_definition(DEFINITION) == {
+        'type': 'WEB',
+        'regions': ['fra', 'was'],
+        'instance_types': ['nano'],
+        'env': {'PORT': '8000', 'TOKEN': '@TOKEN'},
+        'ports': {'8000': 'http'},
+        'routes': {'/': 8000},
+        'health_checks': {'8000': 'http:/health'},
+        'git': {'repository': 'github.com/org/repo', 'branch': 'main', 'sha': 'abc'},
+    }
+
+
+def test_definition_diff_reports_the_changes_per_item():
+    desired = {
+        **DEFINITION,
+        'env': [{'key': 'PORT', 'value': '9000'}, {'key': 'DEBUG', 'value': '1'}],
+        'git': {**DEFINITION['git'], 'sha': 'def'},
+        # Not managed by the action.
+        'scalings': [{'min': 2, 'max': 4}],
+    }
+    assert definition_diff(DEFINITION, desired) == [
+        ('env.DEBUG', None, '1'),
+        ('env.PORT', '8000', '9000'),
+        ('env.TOKEN', '@TOKEN', None),
+        ('git.sha', 'abc', 'def'),
+    ]
+    assert definition_diff(DEFINITION, reordered(DEFINITION)) == []
+
+
+def test_definition_hash():
+    assert definition_hash(DEFINITION) == definition_hash(reordered(DEFINITION))
+    assert definition_hash(DEFINITION) != definition_hash({**DEFINITION, 'regions': ['fra']})
+
+
+def test_is_pinned_source():
+    assert is_pinned_source(DEFINITION)
+    assert not is_pinned_source({**DEFINITION, 'git': {**DEFINITION['git'], 'sha': ''}})
+    assert is_pinned_source({'docker': {'image': 'nginx@sha256:0123'}})
+    assert not is_pinned_source({'docker': {'image': 'nginx:latest'}})
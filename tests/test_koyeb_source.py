@@ -0,0 +1,40 @@
+import pytest
+
+from koyeb_source import SourceHashError, is_ancestor, source_hash
+
+
+def test_source_hash_only_changes_with_the_paths(git_repo):
+    first = git_repo.commit({'api/main.py': 'v1', 'web/index.js': 'v1', 'lib/util.py': 'v1'})
+    web_changed = git_repo.commit({'web/index.js': 'v2'})
+    lib_changed = git_repo.commit({'lib/util.py': 'v2'})
+
+    def hash_at(rev, paths):
+        return source_hash(rev, paths, cwd=git_repo.path)
+
+    assert hash_at(first, ['api']) == hash_at(web_changed, ['api/'])
+    assert hash_at(web_changed, ['api']) == hash_at(lib_changed, ['api'])
+    assert hash_at(web_changed, ['api', 'lib']) != hash_at(lib_changed, ['api', 'lib'])
+    assert hash_at(first, ['']) != hash_at(web_changed, [''])
+
+
+def test_source_hash_of_a_missing_path(git_repo):
+    first = git_repo.commit({'api/main.py': 'v1'})
+    created = git_repo.commit({'shared/config.py': 'v1'})
+    paths = ['api', 'shared']
+    assert source_hash(first, paths, cwd=git_repo.path) != source_hash(created, paths, cwd=git_repo.path)
+
+
+def test_source_hash_of_an_unknown_commit(git_repo):
+    git_repo.commit({'api/main.py': 'v1'})
+    with pytest.raises(SourceHashError, match='not available in the local clone'):
+        source_hash('0' * 40, ['api'], cwd=git_repo.path)
+
+
+def test_is_ancestor(git_repo):
+    first = git_repo.commit({'api/main.py': 'v1'})
+    second = git_repo.commit({'api/main.py': 'v2'})
+    assert is_ancestor(first, second, cwd=git_repo.path)
+    assert is_ancestor(second, second, cwd=git_repo.path)
+    assert not is_ancestor(second, first, cwd=git_repo.path)
+    with pytest.raises(SourceHashError):
+        is_ancestor('0' * 40, second, cwd=git_repo.path)
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+import pytest
+
+import koyeb_tracker
+from koyeb_client import KoyebError
+from koyeb_tracker import DeploymentTracker
+from koyeb_wait import FixedInterval
+
+
+class FakeClient:
+    """Client returning the next status of a deployment on every call
+    which includes it, and recording the calls."""
+
+    def __init__(self, statuses, *, error=None):
+        self.statuses = {deployment_id: list(statuses) for deployment_id, statuses in statuses.items()}
+        self.error = error
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _next(self, deployment_id):
+        statuses = self.statuses[deployment_id]
+        status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+        return {'id': deployment_id, 'app_id': 'app', 'status': status}
+
+    def deployment_get(self, deployment_id):
+        with self._lock:
+            self.calls.append(('get', deployment_id))
+            if self.error:
+                raise self.error
+            return self._next(deployment_id)
+
+    def app_deployments(self, app_id, limit):
+        with self._lock:
+            self.calls.append(('list', app_id))
+            return [self._next(deployment_id) for deployment_id in self.statuses]
+
+
+@pytest.fixture
+def use_client(monkeypatch):
+    def use(client):
+        monkeypatch.setattr(koyeb_tracker, 'get_client', lambda: client)
+        return client
+    return use
+
+
+def track(*deployment_ids):
+    """Watches the deployments until they are no longer watched, and returns
+    the statuses dispatched for each of them and the errors."""
+    changes = {deployment_id: [] for deployment_id in deployment_ids}
+    errors = []
+
+    async def main():
+        tracker = DeploymentTracker()
+        for deployment_id in deployment_ids:
+            tracker.watch(deployment_id, lambda info: changes[info['id']].append(info['status']),
+                          on_error=errors.append, strategy=FixedInterval(0.01))
+        await tracker._task
+
+    asyncio.run(main())
+    return changes, errors
+
+
+def test_only_the_changes_of_status_are_dispatched(use_client):
+    client = use_client(FakeClient({'d1': ['PROVISIONING', 'PROVISIONING', 'STARTING', 'STARTING', 'HEALTHY']}))
+    changes, errors = track('d1')
+    assert changes == {'d1': ['PROVISIONING', 'STARTING', 'HEALTHY']}
+    assert errors == []
+    assert client.calls == [('get', 'd1')] * 5
+
+
+def test_the_deployments_of_the_same_application_are_listed_at_once(use_client):
+    client = use_client(FakeClient({'d1': ['PROVISIONING', 'HEALTHY'], 'd2': ['PROVISIONING', 'STARTING', 'HEALTHY']}))
+    changes, errors = track('d1', 'd2')
+    assert changes == {'d1': ['PROVISIONING', 'HEALTHY'], 'd2': ['PROVISIONING', 'STARTING', 'HEALTHY']}
+    # The application is unknown until the first refresh, and d2 is alone in
+    # its application once d1 is healthy.
+    assert sorted(client.calls[:2]) == [('get', 'd1'), ('get', 'd2')]
+    assert client.calls[2:] == [('list', 'app'), ('get', 'd2')]
+
+
+def test_failed_deployments_are_no_longer_watched(use_client):
+    client = use_client(FakeClient({'d1': ['BUILDING', 'ERROR', 'HEALTHY']}))
+    changes, errors = track('d1')
+    assert changes == {'d1': ['BUILDING', 'ERROR']}
+    assert len(client.calls) == 2
+
+
+def test_errors_are_dispatched_to_on_error(use_client):
+    error = KoyebError('unavailable')
+    use_client(FakeClient({'d1': ['BUILDING']}, error=error))
+    changes, errors = track('d1')
+    assert changes == {'d1': []}
+    assert errors == [error]
@@ -0,0 +1,24 @@
+from koyeb_utils import parse_time, percentile
+
+
+def test_percentile_uses_the_nearest_rank():
+    values = list(range(100, 0, -1))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile(values, 0) == 1
+
+
+def test_percentile_of_few_values():
+    assert percentile([0.3], 99) == 0.3
+    assert percentile([0.1, 0.2, 0.9], 50) == 0.2
+    assert percentile([0.1, 0.2, 0.9], 95) == 0.9
+
+
+def test_parse_time():
+    assert parse_time('2024-01-02T03:04:05Z') == 1704164645
+    assert parse_time('2024-01-02T03:04:05.123456789Z') == 1704164645.123456
+    assert parse_time('2024-01-02T04:04:05+01:00') == 1704164645
+    assert parse_time('') is None
+    assert parse_time(None) is None
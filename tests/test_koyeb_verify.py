@@ -0,0 +1,112 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from koyeb_verify import RouteStats, check_thresholds, verify_endpoints
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+
+
+def route(name, latencies, *, errors=0):
+    stats = RouteStats(name)
+    for latency in latencies:
+        stats.record(latency, 200)
+    for _ in range(errors):
+        stats.record(0.01, 503)
+    return stats
+
+
+def test_check_thresholds_reports_the_exceeded_thresholds():
+    fast = route('GET /', [0.01] * 20)
+    slow = route('GET /slow', [0.01] * 18 + [0.5, 0.5])
+    failing = route('GET /error', [0.01] * 8, errors=2)
+
+    problems = check_thresholds([fast, slow, failing], max_p95=0.1, max_p99=0.2, max_error_rate=0.1)
+    assert problems == [
+        'GET /slow: p95 is 500ms (maximum 100ms)',
+        'GET /slow: p99 is 500ms (maximum 200ms)',
+        'GET /error: 20% of errors (maximum 10%)',
+    ]
+
+
+def test_check_thresholds_without_thresholds():
+    assert check_thresholds([route('GET /slow', [10])]) == []
+
+
+def test_check_thresholds_ignores_routes_without_successful_requests():
+    failing = route('GET /error', [], errors=3)
+    assert check_thresholds([failing], max_p95=0.1) == []
+    assert check_thresholds([failing], max_error_rate=0.5) == ['GET /error: 100% of errors (maximum 50%)']
+
+
+@pytest.fixture
+def application(stub_server, monkeypatch):
+    monkeypatch.delenv('GITHUB_STEP_SUMMARY', raising=False)
+
+    def slow(query, body):
+        time.sleep(0.2)
+        return 200, {}
+
+    stub_server.routes[('GET', '/')] = lambda query, body: (200, {})
+    stub_server.routes[('GET', '/slow')] = slow
+    stub_server.routes[('GET', '/error')] = lambda query, body: (503, {'message': 'unavailable'})
+    return stub_server
+
+
+ROUTES = [{'path': '/', 'port': 8000}, {'path': '/slow', 'port': 8000}, {'path': '/error', 'port': 8000}]
+
+
+def test_verify_endpoints_measures_every_route(application, capsys):
+    stats = verify_endpoints([application.url], ROUTES, requests_per_route=4, max_p95=0.1, max_error_rate=0)
+    by_name = {route.name: route for route in stats}
+
+    assert by_name[f'GET {application.url}/'].errors == 0
+    assert by_name[f'GET {application.url}/slow'].percentile(50) >= 0.2
+    assert by_name[f'GET {application.url}/error'].errors == 4
+    assert by_name[f'GET {application.url}/error'].statuses == {'503': 4}
+    assert len([request for request in application.requests if request['path'] == '/slow']) == 4
+
+    output = capsys.readouterr().out
+    assert 'Warning: Thresholds exceeded' in output
+    assert '/slow: p95 is' in output
+    assert '/error: 100% of errors' in output
+
+
+def test_verify_endpoints_replays_the_warmup_first(application):
+    verify_endpoints([application.url], [{'path': '/', 'port': 8000}], warmup=[('GET', '/slow')], requests_per_route=2)
+    assert [request['path'] for request in application.requests] == ['/slow', '/', '/']
+
+
+def test_verify_endpoints_strict_raises(application):
+    with pytest.raises(RuntimeError, match='Thresholds exceeded'):
+        verify_endpoints([application.url], ROUTES, requests_per_route=2, max_error_rate=0, strict=True)
+
+
+def test_verify_endpoints_strict_passes_within_thresholds(application):
+    stats = verify_endpoints([application.url], [{'path': '/', 'port': 8000}], requests_per_route=2,
+                             max_p95=1, max_error_rate=0, strict=True)
+    assert [route.count for route in stats] == [2]
+
+
+def run_endpoints_verify(url, *args):
+    env = {name: value for name, value in os.environ.items() if name != 'GITHUB_STEP_SUMMARY'}
+    return subprocess.run(
+        [sys.executable, os.path.join(SCRIPTS_DIR, 'endpoints-verify.py'), '--url', url,
+         '--service-routes', '/slow:8000,/error:8000', '--verify-requests', '2', *args],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, timeout=60,
+    )
+
+
+def test_endpoints_verify_exit_code(application):
+    thresholds = ['--verify-max-p95', '100', '--verify-max-error-rate', '0']
+
+    proc = run_endpoints_verify(application.url, *thresholds)
+    assert proc.returncode == 0, proc.stderr.decode()
+    assert b'Warning: Thresholds exceeded' in proc.stdout
+
+    proc = run_endpoints_verify(application.url, *thresholds, '--verify-strict')
+    assert proc.returncode == 1
+    assert b'Thresholds exceeded' in proc.stderr